@@ -2,50 +2,268 @@
 ETL class for data transfer
 """
 
-from io import StringIO
+import logging
+import queue
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager, suppress
+from io import BytesIO, StringIO
+from threading import Condition, Lock
+from typing import Callable, Iterable, Iterator
+from fsspec.core import strip_protocol
 import s3fs
 import pandas as pd
-from pyarrow import Table, parquet as pq
-import psycopg2
+import pyarrow as pa
+from pyarrow import RecordBatch, Table, csv, dataset as ds, parquet as pq
+from psycopg2 import sql
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
+
+import metrics
+from cache import DatasetCache
+from incremental import Manifest
+from layout import ParquetLayout
+from partitions import Partition, split_by_partition, table_partitions
+from pg_copy import (
+    BinaryCopyStream,
+    float_text,
+    iter_copy_batches,
+    render_floats,
+    table_column_types,
+)
+from profiling import Profiler, write_profile
+from staging import create_staging_table, drop_secondary_objects, merge_staging_table
 
 
 class Pipeline:
     """_summary_"""
 
-    def __init__(self) -> None:
-        pass
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        max_connections: int = 4,
+        arrow_native: bool = False,
+        profile: bool = False,
+        cache_dir: str | None = None,
+        cache_max_bytes: int = 10 * 2**30,
+    ) -> None:
+        """
+        Args:
+            max_concurrency (int): number of dataset part files fetched at once
+            max_connections (int): size of each Postgres connection pool
+            arrow_native (bool): move data as Arrow tables and record batches
+                from Parquet to S3 to Postgres, without converting to pandas
+            profile (bool): profile the columns of the data written to the fs
+                on the way and merge it into the profile sidecar of the
+                dataset, see profiling.read_profile
+            cache_dir (str, optional): local directory the part files read
+                from the fs are cached in, see cache.DatasetCache; every read
+                goes to the fs if not set
+            cache_max_bytes (int): size the cache is evicted down to
+        """
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.arrow_native = arrow_native
+        self.profile = profile
+        self.cache = DatasetCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self._pools = {}
+        self._pools_lock = Lock()
 
-    def put_to_fs(self, df: pd.DataFrame, path: str, fs: s3fs.S3FileSystem):
+    @metrics.instrument()
+    def put_to_fs(
+        self,
+        df: pd.DataFrame | Table,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        basename_template: str | None = None,
+        layout: ParquetLayout | None = None,
+    ):
         """
         Write a DataFrame to a Parquet file on S3
         Args:
-            df (pd.DataFrame): DataFrame to write
+            df (pd.DataFrame | Table): DataFrame or Arrow table to write
             path (str): S3 path to write the DataFrame to
+            basename_template (str, optional): part file name with an "{i}"
+                placeholder, a random name if not set
+            layout (ParquetLayout, optional): partitioning, row groups and
+                encoding, unpartitioned snappy if not set
         """
-        table = Table.from_pandas(df)
+        layout = layout or ParquetLayout()
+        table = df if isinstance(df, Table) else Table.from_pandas(df)
+        metrics.record(rows=table.num_rows, bytes=table.nbytes)
         pq.write_to_dataset(
-            table=table,
+            table=layout.add_partition_columns(table),
             root_path=path,
             filesystem=fs,
-            use_dictionary=True,
-            compression="snappy",
-            version="2.0",
+            basename_template=basename_template,
+            **layout.write_options(),
         )
+        if self.profile:
+            profiler = Profiler()
+            for batch in table.to_batches():
+                profiler.update(batch)
+            write_profile(profiler, path, fs, source=basename_template)
 
-    def read_from_fs(self, path: str, fs: s3fs.S3FileSystem) -> pd.DataFrame:
+    @metrics.instrument()
+    def read_from_fs(
+        self,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        columns: list[str] | None = None,
+        filters: list | ds.Expression | None = None,
+        layout: ParquetLayout | None = None,
+    ) -> pd.DataFrame:
         """
-        Read a Parquet file from S3 into a DataFrame
+        Read a Parquet dataset from S3 into a DataFrame
         Args:
             path (str): S3 path to read the DataFrame from
+            fs (s3fs.S3FileSystem): file system client
+            columns (list[str], optional): columns to read, all if not set
+            filters (list | ds.Expression, optional): row filter, in
+                pq.read_table DNF form or as a dataset expression
+            layout (ParquetLayout, optional): layout the dataset was written with
+        Returns:
+            pd.DataFrame: DataFrame read from all part files of the dataset
+        """
+        table = self.read_table_from_fs(
+            path=path, fs=fs, columns=columns, filters=filters, layout=layout
+        )
+        with metrics.stage("to_pandas") as stage:
+            df = table.to_pandas()
+            stage.rows, stage.bytes = metrics.size_of(df)
+        return df
+
+    @metrics.instrument()
+    def read_table_from_fs(
+        self,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        columns: list[str] | None = None,
+        filters: list | ds.Expression | None = None,
+        layout: ParquetLayout | None = None,
+    ) -> Table:
+        """
+        Read a Parquet dataset from S3 into an Arrow table, fetching part
+        files concurrently. Columns are projected and filters prune hive
+        partition directories and Parquet row groups, so skipped data is not
+        fetched.
+        Args:
+            path (str): S3 path of the dataset
+            fs (s3fs.S3FileSystem): file system client
+            columns (list[str], optional): columns to read, all but the
+                derived partition columns if not set
+            filters (list | ds.Expression, optional): row filter
+            layout (ParquetLayout, optional): layout the dataset was written with
         Returns:
-            pd.DataFrame: DataFrame read from the Parquet file
+            Table: rows of every part file of the dataset
+        """
+        with self._scanner(
+            path=path, fs=fs, columns=columns, filters=filters, layout=layout
+        ) as scanner:
+            return scanner.to_table()
+
+    @metrics.instrument()
+    def iter_batches_from_fs(
+        self,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        columns: list[str] | None = None,
+        filters: list | ds.Expression | None = None,
+        batch_size: int = 131_072,
+        layout: ParquetLayout | None = None,
+    ) -> Iterator[RecordBatch]:
+        """
+        Stream a Parquet dataset from S3 as record batches
+        Args:
+            path (str): S3 path of the dataset
+            fs (s3fs.S3FileSystem): file system client
+            columns (list[str], optional): columns to read, all but the
+                derived partition columns if not set
+            filters (list | ds.Expression, optional): row filter
+            batch_size (int): maximum number of rows per batch
+            layout (ParquetLayout, optional): layout the dataset was written with
+        Yields:
+            RecordBatch: batches of the dataset, part files read ahead
+                concurrently
         """
-        for f in fs.glob(f"{path}*"):
-            table = pq.read_table(f, filesystem=fs)
-        return table.to_pandas()
+        with self._scanner(
+            path=path,
+            fs=fs,
+            columns=columns,
+            filters=filters,
+            batch_size=batch_size,
+            layout=layout,
+        ) as scanner:
+            yield from scanner.to_batches()
 
+    @contextmanager
+    def _scanner(
+        self,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        columns: list[str] | None,
+        filters: list | ds.Expression | None,
+        batch_size: int = 131_072,
+        layout: ParquetLayout | None = None,
+    ) -> Iterator[ds.Scanner]:
+        """
+        Build a scanner over every part file of the dataset under path, or
+        over their cached copies if the pipeline has a cache
+        """
+        layout = layout or ParquetLayout()
+        if filters is not None and not isinstance(filters, ds.Expression):
+            filters = pq.filters_to_expression(layout.expand_filters(filters))
+        parquet_format = ds.ParquetFileFormat(
+            # coalesce the column chunk reads of each file into few large
+            # requests, which matters on a high-latency object store
+            default_fragment_scan_options=ds.ParquetFragmentScanOptions(
+                pre_buffer=True
+            )
+        )
+        dataset = ds.dataset(
+            strip_protocol(path),
+            filesystem=fs,
+            format=parquet_format,
+            partitioning="hive",
+        )
+        if columns is None:
+            columns = [
+                name
+                for name in dataset.schema.names
+                if name not in layout.month_partitions
+            ]
+        try:
+            with ExitStack() as stack:
+                if self.cache is not None:
+                    stack.enter_context(self.cache.reading())
+                    dataset = self.cache.cached_dataset(
+                        dataset,
+                        fs,
+                        base_dir=strip_protocol(path),
+                        filters=filters,
+                        max_concurrency=self.max_concurrency,
+                    )
+                yield dataset.scanner(
+                    columns=columns,
+                    filter=filters,
+                    batch_size=batch_size,
+                    use_threads=True,
+                    fragment_readahead=self.max_concurrency,
+                )
+        finally:
+            # once the shared lock is released, evicting cannot pull files
+            # from under this scan
+            if self.cache is not None:
+                self.cache.evict()
+
+    @metrics.instrument()
     def local_to_fs_transfer(
-        self, local_path: str, fs_path: str, fs: s3fs.S3FileSystem
+        self,
+        local_path: str,
+        fs_path: str,
+        fs: s3fs.S3FileSystem,
+        layout: ParquetLayout | None = None,
     ):
         """
         Transfer data from local to FS
@@ -53,34 +271,547 @@ class Pipeline:
             local_path (str): local path to read the DataFrame from
             fs_path (str): fs path to write the DataFrame to
             fs (s3fs.S3FileSystem): file system client
+            layout (ParquetLayout, optional): layout of the fs dataset
+        """
+        with metrics.stage("read_local") as stage:
+            if self.arrow_native:
+                df = pq.read_table(local_path)
+            else:
+                df = pd.read_parquet(local_path)
+            stage.rows, stage.bytes = metrics.size_of(df)
+        self.put_to_fs(df=df, path=fs_path, fs=fs, layout=layout)
+
+    @metrics.instrument()
+    def tee_transfer(
+        self,
+        local_path: str,
+        fs_path: str,
+        fs: s3fs.S3FileSystem,
+        config: dict,
+        table_name: str,
+        layout: ParquetLayout | None = None,
+        batch_size: int = 131_072,
+        basename_template: str | None = None,
+        key_columns: list[str] | None = None,
+        full_reload: bool = False,
+    ) -> dict:
+        """
+        Read local Parquet data once and stream its record batches to the fs
+        dataset writer and a binary Postgres COPY at the same time, instead of
+        uploading the data and downloading it again to load Postgres. The fs
+        dataset stays the durable landing copy: the COPY is committed only
+        once every part file was written, and rolled back otherwise.
+        Args:
+            local_path (str): local Parquet file or directory of part files
+            fs_path (str): fs path of the dataset to write to
+            fs (s3fs.S3FileSystem): file system client
+            config (dict): postgres connection configuration
+            table_name (str): table name to write to
+            layout (ParquetLayout, optional): layout of the fs dataset
+            batch_size (int): maximum number of rows per batch
+            basename_template (str, optional): part file name with an "{i}"
+                placeholder, a random name if not set
+            key_columns (list[str], optional): COPY into a staging table and
+                upsert on these key columns, see write_to_postgres_bulk
+            full_reload (bool): with key_columns, replace the table content
+        Returns:
+            dict: table, rows, bytes, seconds and rows_per_sec of the load
+        """
+        layout = layout or ParquetLayout()
+        source = ds.dataset(local_path, format="parquet")
+        schema = layout.add_partition_columns(source.schema.empty_table()).schema
+        # bounded, so the reader never runs more than a few batches ahead
+        # of the slower of the two sinks
+        copy_queue = queue.Queue(maxsize=4)
+        profiler = Profiler() if self.profile else None
+        start = time.perf_counter()
+        with self.connection(config) as conn, ThreadPoolExecutor(1) as executor:
+            target = table_name
+            if key_columns:
+                target = create_staging_table(conn, table_name)
+            copy = executor.submit(
+                _copy_binary,
+                conn,
+                iter(copy_queue.get, None),
+                target,
+            )
+            source_batches = source.to_batches(batch_size=batch_size)
+            if profiler is not None:
+                source_batches = profiler.observe(source_batches)
+            batches = _tee(
+                source_batches,
+                copy_queue,
+                copy,
+                layout.add_partition_columns_batch,
+            )
+            try:
+                ds.write_dataset(
+                    data=batches,
+                    base_dir=strip_protocol(fs_path),
+                    filesystem=fs,
+                    schema=schema,
+                    basename_template=basename_template
+                    or f"{uuid.uuid4().hex}-{{i}}.parquet",
+                    **layout.dataset_write_options(),
+                )
+            except BaseException:
+                # end the COPY without masking the write error by its own, a
+                # failed write is rolled back when the connection is returned
+                batches.close()
+                if not copy.done():
+                    with suppress(Exception):
+                        _put(copy_queue, None, copy)
+                raise
+            if not copy.done():
+                _put(copy_queue, None, copy)
+            stream = copy.result()
+            if key_columns:
+                merge_staging_table(
+                    conn, target, table_name, key_columns, stream.columns, full_reload
+                )
+            conn.commit()
+        if profiler is not None:
+            write_profile(profiler, fs_path, fs, source=basename_template)
+        return _copy_stats(table_name, [stream], time.perf_counter() - start)
+
+    @metrics.instrument()
+    def incremental_transfer(
+        self,
+        local_path: str,
+        fs_path: str,
+        fs: s3fs.S3FileSystem,
+        config: dict,
+        table_name: str,
+        manifest_path: str,
+        watermark_column: str | None = None,
+        layout: ParquetLayout | None = None,
+        key_columns: list[str] | None = None,
+    ) -> dict:
+        """
+        Upload and load only the data that earlier runs did not ingest.
+        The manifest at manifest_path records the ingested local part files
+        and the high-water mark of watermark_column, so the cost of a run
+        follows the size of the delta instead of the size of the table.
+        Rewritten part files are diffed on key_columns against the keys of
+        the dataset at fs_path, bounded by the watermark where there is one,
+        or else on the watermark alone, see Manifest.delta; a table with
+        neither raises ValueError.
+        Args:
+            local_path (str): local Parquet file or directory of part files
+            fs_path (str): fs path of the dataset to append to
+            fs (s3fs.S3FileSystem): file system client
+            config (dict): postgres connection configuration
+            table_name (str): table name to write to
+            manifest_path (str): fs path of the manifest of the table
+            watermark_column (str, optional): column whose maximum bounds the
+                rows taken from rewritten part files
+            layout (ParquetLayout, optional): layout of the fs dataset
+            key_columns (list[str], optional): upsert on these key columns
+                through a staging table instead of appending, and skip the
+                rows of rewritten part files whose key was ingested
+        Returns:
+            dict: table, rows and parts ingested and the new watermark
+        """
+        if not watermark_column and not key_columns:
+            raise ValueError(
+                f"incremental loads of {table_name} need a watermark column "
+                "or key columns"
+            )
+        manifest = Manifest.load(
+            manifest_path, fs, table=table_name, watermark_column=watermark_column
+        )
+
+        def ingested_keys(filters: ds.Expression | None) -> Table | None:
+            if not fs.exists(fs_path):
+                return None
+            return self.read_table_from_fs(
+                path=fs_path, fs=fs, columns=key_columns, filters=filters, layout=layout
+            )
+
+        delta, changed = manifest.delta(
+            local_path, key_columns=key_columns, ingested_keys=ingested_keys
+        )
+        if delta is not None:
+            # named after the delta, so a retried run overwrites its own files
+            self.put_to_fs(
+                delta,
+                path=fs_path,
+                fs=fs,
+                basename_template=f"incremental-{manifest.digest(changed)}-{{i}}.parquet",
+                layout=layout,
+            )
+            if key_columns:
+                self.write_to_postgres_bulk(
+                    data=delta,
+                    config=config,
+                    table_name=table_name,
+                    key_columns=key_columns,
+                )
+            else:
+                self.write_to_postgres_binary(
+                    data=delta, config=config, table_name=table_name
+                )
+        if changed:
+            manifest.commit(delta, changed)
+            manifest.save(manifest_path, fs)
+        stats = {
+            "table": table_name,
+            "rows": delta.num_rows if delta is not None else 0,
+            "parts": len(changed),
+            "watermark": manifest.watermark,
+        }
+        logging.info(
+            "Ingested %d new rows of %s from %d part files (watermark %s)",
+            stats["rows"],
+            table_name,
+            stats["parts"],
+            stats["watermark"],
+        )
+        return stats
+
+    def connection(self, config: dict):
+        """
+        Borrow a connection from the pool of this configuration, creating the
+        pool on first use. The transaction is rolled back if the block raises;
+        committing is left to the caller.
+        Args:
+            config (dict): postgres connection configuration
+        Returns:
+            ContextManager[connection]: pooled psycopg2 connection
+        """
+        return self._pool(config).connection()
+
+    def connections(self, config: dict, count: int):
+        """
+        Borrow count connections from the pool of this configuration at once,
+        waiting until that many are free rather than holding some of them
+        while waiting for the others. Every transaction is rolled back if the
+        block raises; committing is left to the caller.
+        Args:
+            config (dict): postgres connection configuration
+            count (int): number of connections, at most max_connections
+        Returns:
+            ContextManager[list[connection]]: pooled psycopg2 connections
         """
-        df = pd.read_parquet(local_path)
-        self.put_to_fs(df=df, path=fs_path, fs=fs)
+        return self._pool(config).connections(count)
 
-    def write_to_postgres(self, df: pd.DataFrame, config: dict, table_name: str):
+    def close(self):
+        """
+        Close every pooled connection
+        """
+        with self._pools_lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.close()
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _pool(self, config: dict) -> "_ConnectionPool":
+        """
+        Get or create the connection pool of a configuration
+        """
+        key = tuple(sorted(config.items()))
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = _ConnectionPool(config, self.max_connections)
+            return self._pools[key]
+
+    @metrics.instrument()
+    def write_to_postgres(
+        self, df: pd.DataFrame | Table, config: dict, table_name: str
+    ):
         """
         Write a DataFrame to a Postgres table
         Args:
-            df (pd.DataFrame): data to write
+            df (pd.DataFrame | Table): data to write, Arrow tables are rendered
+                to CSV by Arrow without a pandas conversion
             config (dict): postgres connection configuration
             table_name (str): table name to write to
         """
-        conn = psycopg2.connect(**config)
-        sio = StringIO()
-        df.to_csv(sio, index=None, header=None)
+        with metrics.stage("render_csv", table=table_name) as stage:
+            # floats are rendered by float_text, so that a float loaded into a
+            # text column reads the same whichever path loaded it
+            if isinstance(df, Table):
+                sio = BytesIO()
+                csv.write_csv(
+                    render_floats(df),
+                    sio,
+                    write_options=csv.WriteOptions(include_header=False),
+                )
+                columns = df.schema.names
+            else:
+                sio = StringIO()
+                df.assign(
+                    **{
+                        name: float_text(pa.array(df[name], from_pandas=True))
+                        .to_pandas()
+                        for name in df.select_dtypes("floating").columns
+                    }
+                ).to_csv(sio, index=None, header=None)
+                columns = df.columns
+            stage.rows, stage.bytes = len(df), sio.tell()
         sio.seek(0)
-        with conn.cursor() as c:
-            c.copy_expert(
-                sql=f"""
-                COPY {table_name} (
-                    {",".join(df.columns)}
-                ) FROM STDIN WITH CSV""",
-                file=sio,
+        with metrics.stage("copy", table=table_name) as stage:
+            with self.connection(config) as conn:
+                with conn.cursor() as c:
+                    c.copy_expert(
+                        sql=f"""
+                        COPY {table_name} (
+                            {",".join(columns)}
+                        ) FROM STDIN WITH CSV""",
+                        file=sio,
+                    )
+                conn.commit()
+            stage.rows, stage.bytes = len(df), sio.tell()
+        metrics.record(rows=len(df), bytes=sio.tell())
+
+    @metrics.instrument()
+    def write_to_postgres_binary(
+        self,
+        data: Table | Iterable[RecordBatch],
+        config: dict,
+        table_name: str,
+        batch_size: int = 65_536,
+    ) -> dict:
+        """
+        Stream Arrow data into a Postgres table with COPY ... (FORMAT binary).
+        Batches are encoded lazily as COPY reads them, so memory is bounded
+        by batch_size rows instead of the whole rendered table.
+        Args:
+            data (Table | Iterable[RecordBatch]): data to write
+            config (dict): postgres connection configuration
+            table_name (str): table name to write to
+            batch_size (int): maximum number of rows encoded at a time
+        Returns:
+            dict: table, rows, bytes, seconds and rows_per_sec of the load
+        """
+        start = time.perf_counter()
+        with self.connection(config) as conn:
+            stream = _copy_binary(
+                conn, iter_copy_batches(data, batch_size=batch_size), table_name
+            )
+            conn.commit()
+        return _copy_stats(table_name, [stream], time.perf_counter() - start)
+
+    @metrics.instrument()
+    def write_to_postgres_parallel(
+        self,
+        table: Table,
+        config: dict,
+        table_name: str,
+        parallelism: int | None = None,
+        batch_size: int = 65_536,
+    ) -> dict:
+        """
+        Split a table into slices and COPY them over several pooled
+        connections at the same time. Every slice runs in its own transaction
+        and all of them are committed together with a two-phase commit, see
+        _two_phase: if any slice fails, none is committed.
+        Args:
+            table (Table): data to write
+            config (dict): postgres connection configuration
+            table_name (str): table name to write to
+            parallelism (int, optional): number of slices and connections,
+                capped by max_connections, which is also the default
+            batch_size (int): maximum number of rows encoded at a time
+        Returns:
+            dict: table, rows, bytes, seconds and rows_per_sec of the load
+        """
+        parallelism = min(parallelism or self.max_connections, self.max_connections)
+        slice_rows = max(1, -(-table.num_rows // parallelism))
+        slices = [
+            table.slice(offset, slice_rows)
+            for offset in range(0, table.num_rows, slice_rows)
+        ]
+        start = time.perf_counter()
+        with self.connections(config, len(slices)) as connections:
+            with _two_phase(connections):
+                with ThreadPoolExecutor(max_workers=len(slices) or 1) as executor:
+                    futures = [
+                        executor.submit(
+                            _copy_binary,
+                            conn,
+                            iter_copy_batches(table_slice, batch_size=batch_size),
+                            table_name,
+                        )
+                        for conn, table_slice in zip(connections, slices)
+                    ]
+                    wait(futures)
+                errors = [
+                    f.exception() for f in futures if f.exception() is not None
+                ]
+                if errors:
+                    # leaving the block with an exception rolls back every slice
+                    raise errors[0]
+            streams = [f.result() for f in futures]
+        return _copy_stats(table_name, streams, time.perf_counter() - start)
+
+    @metrics.instrument()
+    def write_to_postgres_bulk(
+        self,
+        data: Table | Iterable[RecordBatch],
+        config: dict,
+        table_name: str,
+        key_columns: list[str],
+        full_reload: bool = False,
+        batch_size: int = 65_536,
+    ) -> dict:
+        """
+        Bulk load Arrow data into a keyed Postgres table. The data is COPYed
+        into an UNLOGGED staging table without indexes and then merged with
+        INSERT ... ON CONFLICT on key_columns, so reruns update rows instead
+        of duplicating them or failing on the key. A full reload replaces the
+        content of the table and drops its secondary indexes and constraints
+        during the insert, rebuilding them once at the end. Everything runs
+        in one transaction.
+        Args:
+            data (Table | Iterable[RecordBatch]): data to write
+            config (dict): postgres connection configuration
+            table_name (str): table name to write to
+            key_columns (list[str]): primary key or unique constraint columns
+            full_reload (bool): replace the rows of the table
+            batch_size (int): maximum number of rows encoded at a time
+        Returns:
+            dict: table, rows, bytes, seconds and rows_per_sec of the load
+        """
+        start = time.perf_counter()
+        with self.connection(config) as conn:
+            staging = create_staging_table(conn, table_name)
+            stream = _copy_binary(
+                conn, iter_copy_batches(data, batch_size=batch_size), staging
+            )
+            merge_staging_table(
+                conn, staging, table_name, key_columns, stream.columns, full_reload
+            )
+            conn.commit()
+        return _copy_stats(table_name, [stream], time.perf_counter() - start)
+
+    @metrics.instrument()
+    def write_to_postgres_partitions(
+        self,
+        table: Table,
+        config: dict,
+        table_name: str,
+        key_columns: list[str] | None = None,
+        full_reload: bool = False,
+        parallelism: int | None = None,
+        batch_size: int = 65_536,
+        lock_timeout: float = 60.0,
+    ) -> dict:
+        """
+        Load a table into a range partitioned Postgres table by routing its
+        rows to their partitions and COPYing into the partitions directly,
+        several at the same time over pooled connections. Every connection
+        loads its share of the partitions in one transaction and all of them
+        are committed together with a two-phase commit, see _two_phase: if
+        any share fails, none is committed. A share waiting longer than
+        lock_timeout for a lock fails the load, since the lock can be held by
+        another share that only releases it once every share succeeded, e.g.
+        the loan_ids claim of a loan_id repeated under two start_dates.
+        With key_columns every partition is upserted through its own staging
+        table, see write_to_postgres_bulk. A full reload truncates every
+        partition first, including those without rows, and like
+        write_to_postgres_bulk drops the secondary indexes and constraints of
+        the table during the load. They are dropped in a transaction of their
+        own before the shares are loaded, since the shares cannot drop the
+        indexes of their partitions, and rebuilt once afterwards, whether the
+        load succeeded or not.
+        Args:
+            table (Table): data to write
+            config (dict): postgres connection configuration
+            table_name (str): partitioned table name to write to
+            key_columns (list[str], optional): unique constraint columns to
+                upsert on, including the partition key
+            full_reload (bool): replace the rows of the table
+            parallelism (int, optional): number of connections, capped by
+                max_connections, which is also the default
+            batch_size (int): maximum number of rows encoded at a time
+            lock_timeout (float): seconds a share waits for a lock
+        Returns:
+            dict: table, rows, bytes, seconds and rows_per_sec of the load
+        """
+        start = time.perf_counter()
+        with self.connection(config) as conn:
+            with conn.cursor() as c:
+                key, partitions = table_partitions(c, table_name)
+            conn.rollback()
+        if not partitions:
+            raise ValueError(f"{table_name} has no partitions")
+        split = [
+            (partition, rows)
+            for partition, rows in split_by_partition(table, key, partitions)
+            if rows.num_rows or full_reload
+        ]
+        parallelism = min(parallelism or self.max_connections, self.max_connections)
+        # largest partitions first, each to the least loaded connection
+        shares: list[list[tuple[Partition, Table]]] = [
+            [] for _ in range(min(parallelism, len(split)))
+        ]
+        for partition, rows in sorted(split, key=lambda p: -p[1].num_rows):
+            min(shares, key=lambda s: sum(r.num_rows for _, r in s)).append(
+                (partition, rows)
             )
-        conn.commit()
+        rebuild = []
+        if full_reload:
+            with self.connection(config) as conn:
+                with conn.cursor() as c:
+                    rebuild = drop_secondary_objects(c, table_name)
+                conn.commit()
+        try:
+            with self.connections(config, len(shares)) as connections:
+                with _two_phase(connections):
+                    with ThreadPoolExecutor(max_workers=len(shares) or 1) as executor:
+                        futures = [
+                            executor.submit(
+                                _load_partitions,
+                                conn,
+                                share,
+                                key_columns,
+                                full_reload,
+                                batch_size,
+                                lock_timeout,
+                            )
+                            for conn, share in zip(connections, shares)
+                        ]
+                        wait(futures)
+                    errors = [
+                        f.exception() for f in futures if f.exception() is not None
+                    ]
+                    if errors:
+                        # leaving the block with an exception rolls back every
+                        # share
+                        raise errors[0]
+                streams = [stream for f in futures for stream in f.result()]
+        finally:
+            if full_reload:
+                with self.connection(config) as conn:
+                    with conn.cursor() as c:
+                        for statement in rebuild:
+                            c.execute(statement)
+                        c.execute(
+                            sql.SQL("ANALYZE {}").format(
+                                sql.Identifier(*table_name.split("."))
+                            )
+                        )
+                    conn.commit()
+        return _copy_stats(table_name, streams, time.perf_counter() - start)
 
+    @metrics.instrument()
     def fs_to_postgres_transfer(
-        self, path: str, fs: s3fs.S3FileSystem, config: dict, table_name: str
+        self,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        config: dict,
+        table_name: str,
+        binary: bool = False,
+        parallelism: int = 1,
+        layout: ParquetLayout | None = None,
+        key_columns: list[str] | None = None,
+        full_reload: bool = False,
     ):
         """
         transfer data from FS to Postgres
@@ -89,6 +820,320 @@ class Pipeline:
             fs (s3fs.S3FileSystem): file system client
             config (dict): postgres connection configuration
             table_name (str): table name to write to
+            binary (bool): stream record batches through a binary COPY
+                instead of rendering the whole DataFrame to CSV, always the
+                case for an arrow_native pipeline
+            parallelism (int): number of connections the table is split over,
+                implies binary when above 1. A range partitioned table is
+                split by partition, see write_to_postgres_partitions.
+            layout (ParquetLayout, optional): layout of the fs dataset
+            key_columns (list[str], optional): bulk load through a staging
+                table upserting on these key columns, see
+                write_to_postgres_bulk; binary is ignored
+            full_reload (bool): with key_columns, replace the table content
         """
-        df = self.read_from_fs(path=path, fs=fs)
+        if parallelism > 1 and self._is_partitioned(config, table_name):
+            self.write_to_postgres_partitions(
+                table=self.read_table_from_fs(path=path, fs=fs, layout=layout),
+                config=config,
+                table_name=table_name,
+                key_columns=key_columns,
+                full_reload=full_reload,
+                parallelism=parallelism,
+            )
+            return
+        if key_columns:
+            self.write_to_postgres_bulk(
+                data=self.iter_batches_from_fs(path=path, fs=fs, layout=layout),
+                config=config,
+                table_name=table_name,
+                key_columns=key_columns,
+                full_reload=full_reload,
+            )
+            return
+        if parallelism > 1:
+            self.write_to_postgres_parallel(
+                table=self.read_table_from_fs(path=path, fs=fs, layout=layout),
+                config=config,
+                table_name=table_name,
+                parallelism=parallelism,
+            )
+            return
+        if binary or self.arrow_native:
+            self.write_to_postgres_binary(
+                data=self.iter_batches_from_fs(path=path, fs=fs, layout=layout),
+                config=config,
+                table_name=table_name,
+            )
+            return
+        df = self.read_from_fs(path=path, fs=fs, layout=layout)
         self.write_to_postgres(df=df, config=config, table_name=table_name)
+
+    def _is_partitioned(self, config: dict, table_name: str) -> bool:
+        """
+        Whether a Postgres table is partitioned
+        """
+        with self.connection(config) as conn:
+            with conn.cursor() as c:
+                c.execute(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                    "WHERE partrelid = %s::regclass)",
+                    (table_name,),
+                )
+                partitioned = c.fetchone()[0]
+            conn.rollback()
+        return partitioned
+
+
+class _ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool whose getconn blocks, instead of
+    raising, while all max_connections connections are in use. Borrowers of
+    several connections take them all at once, so two of them can never each
+    hold part of the pool while waiting for the rest.
+    """
+
+    def __init__(self, config: dict, max_connections: int) -> None:
+        self._pool = ThreadedConnectionPool(0, max_connections, **config)
+        self._max_connections = max_connections
+        self._free = max_connections
+        self._released = Condition()
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """
+        Borrow a connection, rolled back if the block raises
+        """
+        with self.connections(1) as (conn,):
+            yield conn
+
+    @contextmanager
+    def connections(self, count: int) -> Iterator[list[connection]]:
+        """
+        Borrow count connections at once, all rolled back if the block raises
+        """
+        if not 0 <= count <= self._max_connections:
+            raise ValueError(
+                f"count must be between 0 and {self._max_connections}, got {count}"
+            )
+        with self._released:
+            self._released.wait_for(lambda: self._free >= count)
+            self._free -= count
+        conns = []
+        try:
+            for _ in range(count):
+                conns.append(self._pool.getconn())
+            try:
+                yield conns
+            except BaseException:
+                for conn in conns:
+                    if not conn.closed:
+                        conn.rollback()
+                raise
+        finally:
+            for conn in conns:
+                self._pool.putconn(conn, close=bool(conn.closed))
+            with self._released:
+                self._free += count
+                self._released.notify_all()
+
+    def close(self):
+        """
+        Close every connection of the pool
+        """
+        self._pool.closeall()
+
+
+def _copy_binary(
+    conn: connection, batches: Iterator[RecordBatch], table_name: str
+) -> BinaryCopyStream:
+    """
+    Run a binary COPY of batches into table_name on conn without committing.
+    The COPY column list is taken from the first batch.
+    """
+    first = next(batches, None)
+    if first is None:
+        return BinaryCopyStream(batches=(), columns=[], column_types={})
+    with conn.cursor() as c:
+        stream = BinaryCopyStream(
+            batches=_prepend(first, batches),
+            columns=first.schema.names,
+            column_types=table_column_types(c, table_name),
+        )
+        c.copy_expert(
+            sql=f"""
+            COPY {table_name} (
+                {",".join(stream.columns)}
+            ) FROM STDIN WITH (FORMAT binary)""",
+            file=stream,
+            size=1 << 20,
+        )
+    return stream
+
+
+def _load_partitions(
+    conn: connection,
+    share: list[tuple[Partition, Table]],
+    key_columns: list[str] | None,
+    full_reload: bool,
+    batch_size: int,
+    lock_timeout: float,
+) -> list[BinaryCopyStream]:
+    """
+    COPY the rows of several partitions on conn without committing, upserting
+    through a staging table per partition when key_columns are given
+    """
+    with conn.cursor() as c:
+        c.execute(
+            "SET LOCAL lock_timeout = %s", (f"{int(lock_timeout * 1000)}ms",)
+        )
+    streams = []
+    for partition, rows in share:
+        if full_reload:
+            with conn.cursor() as c:
+                c.execute(f"TRUNCATE {partition.name}")
+        if not rows.num_rows:
+            continue
+        batches = iter_copy_batches(rows, batch_size=batch_size)
+        if key_columns:
+            staging = create_staging_table(conn, partition.name)
+            stream = _copy_binary(conn, batches, staging)
+            merge_staging_table(
+                conn, staging, partition.name, key_columns, stream.columns
+            )
+        else:
+            stream = _copy_binary(conn, batches, partition.name)
+        streams.append(stream)
+    return streams
+
+
+@contextmanager
+def _two_phase(connections: list[connection]) -> Iterator[None]:
+    """
+    Run the transactions of several connections as one. They are begun as
+    two-phase transactions; once the block succeeded every one is prepared
+    and only then are they committed. All of them are rolled back if the
+    block or any prepare fails. A single connection is committed directly.
+    Needs max_prepared_transactions of the server to be at least the number
+    of connections loading at the same time.
+    """
+    if len(connections) < 2:
+        yield
+        for conn in connections:
+            conn.commit()
+        return
+    gtrid = f"etl-{uuid.uuid4().hex}"
+    begun = []
+    try:
+        for i, conn in enumerate(connections):
+            conn.tpc_begin(conn.xid(0, f"{gtrid}-{i}", ""))
+            begun.append(conn)
+        yield
+        for conn in connections:
+            conn.tpc_prepare()
+    except BaseException:
+        for conn in begun:
+            try:
+                if not conn.closed:
+                    conn.tpc_rollback()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Could not roll back transaction %s", gtrid)
+        raise
+    for i, conn in enumerate(connections):
+        try:
+            conn.tpc_commit()
+        except Exception:
+            logging.error(
+                "Transactions %s-%d and later were prepared but not committed, "
+                "finish them with COMMIT PREPARED",
+                gtrid,
+                i,
+            )
+            raise
+
+
+def _copy_stats(
+    table_name: str, streams: list[BinaryCopyStream], seconds: float
+) -> dict:
+    """
+    Summarize and log the COPY streams of one table load
+    """
+    rows = sum(stream.rows for stream in streams)
+    stats = {
+        "table": table_name,
+        "rows": rows,
+        "bytes": sum(stream.bytes for stream in streams),
+        "seconds": seconds,
+        "rows_per_sec": rows / seconds if seconds else 0.0,
+    }
+    logging.info(
+        "Loaded %d rows into %s in %.2fs (%.0f rows/s)",
+        rows,
+        table_name,
+        seconds,
+        stats["rows_per_sec"],
+    )
+    return stats
+
+
+def _tee(
+    batches: Iterator[RecordBatch],
+    copy_queue: queue.Queue,
+    copy: Future,
+    transform: Callable[[RecordBatch], RecordBatch],
+) -> Iterator[RecordBatch]:
+    """
+    Hand every batch to the COPY consuming copy_queue and yield it, with
+    transform applied, to the dataset writer
+    """
+    for batch in batches:
+        _put(copy_queue, batch, copy)
+        yield transform(batch)
+
+
+def _put(copy_queue: queue.Queue, item: RecordBatch | None, copy: Future):
+    """
+    Put an item on the queue of a running COPY, raising instead of blocking
+    forever if the COPY stopped consuming
+    """
+    while True:
+        if copy.done():
+            copy.result()
+            raise RuntimeError("COPY finished before the end of the data")
+        try:
+            copy_queue.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _prepend(first: RecordBatch, rest: Iterator[RecordBatch]) -> Iterator[RecordBatch]:
+    """
+    Yield first and then the remaining batches
+    """
+    yield first
+    yield from rest
+
+
+def combine_batches(
+    batches: Iterable[RecordBatch], rows: int
+) -> Iterator[RecordBatch]:
+    """
+    Merge record batches into batches of at least rows rows, the last one
+    excepted. Dataset batches are at most one part file each, so a finely
+    partitioned dataset otherwise yields many small batches.
+    Args:
+        batches (Iterable[RecordBatch]): batches sharing a schema
+        rows (int): minimum rows per merged batch
+    Yields:
+        RecordBatch: merged batches
+    """
+    buffered, buffered_rows = [], 0
+    for batch in batches:
+        buffered.append(batch)
+        buffered_rows += batch.num_rows
+        if buffered_rows >= rows:
+            yield Table.from_batches(buffered).combine_chunks().to_batches()[0]
+            buffered, buffered_rows = [], 0
+    if buffered_rows:
+        yield Table.from_batches(buffered).combine_chunks().to_batches()[0]
@@ -0,0 +1,186 @@
+"""
+Local read-through disk cache of the part files of fs datasets, shared by the
+pipelines and notebooks of a host
+"""
+
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator
+
+import s3fs
+from pyarrow import dataset as ds, fs as pafs
+
+import metrics
+
+LOCK_FILE = ".lock"
+
+
+class DatasetCache:
+    """
+    Copies of fs part files on local disk, keyed by object path and version
+    (ETag, or modification time and size where the file system has no ETag),
+    so a changed object is fetched again and an unchanged one never is.
+    Cached files are memory-mapped when scanned.
+
+    The cache is safe to share between processes: files are downloaded to a
+    temporary name and renamed into place, scans hold a shared lock on the
+    cache directory and least recently used files are evicted down to
+    max_bytes only under an exclusive lock, i.e. when no scan is running.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 2**30) -> None:
+        """
+        Args:
+            directory (str): local cache directory, created if needed
+            max_bytes (int): size the cache is evicted down to
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, LOCK_FILE)
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """
+        Keep the cached files from being evicted while they are scanned
+        """
+        with open(self._lock_path, "a+b") as lock:
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def cached_dataset(
+        self,
+        dataset: ds.FileSystemDataset,
+        fs: s3fs.S3FileSystem,
+        base_dir: str,
+        filters: ds.Expression | None = None,
+        max_concurrency: int = 8,
+    ) -> ds.FileSystemDataset:
+        """
+        Local, memory-mapped copy of the part files of an fs dataset that can
+        match filters, fetching the missing or changed ones. Must be called
+        and scanned within reading().
+        Args:
+            dataset (ds.FileSystemDataset): dataset discovered on fs
+            fs (s3fs.S3FileSystem): file system client of the dataset
+            base_dir (str): fs path the dataset was discovered under, without
+                protocol; partition directories below it are kept
+            filters (ds.Expression, optional): row filter, part files of
+                partitions it excludes are not fetched
+            max_concurrency (int): part files fetched at once
+        Returns:
+            ds.FileSystemDataset: dataset over the cached files, with the
+                schema and the hive partitioning of dataset
+        """
+        paths = [
+            fragment.path for fragment in dataset.get_fragments(filter=filters)
+        ]
+        if paths == [base_dir]:
+            base_dir = os.path.dirname(base_dir)
+        location = f"{fs.protocol}:{base_dir}"
+        root = os.path.join(
+            self.directory, hashlib.sha256(location.encode()).hexdigest()[:16]
+        )
+        with metrics.stage("fetch_to_cache") as stage:
+            with ThreadPoolExecutor(max_concurrency) as executor:
+                fetched = list(
+                    executor.map(
+                        lambda path: self._fetch(fs, path, base_dir, root), paths
+                    )
+                )
+            stage.rows = sum(1 for _, size in fetched if size)
+            stage.bytes = sum(size for _, size in fetched)
+        logging.debug(
+            "%d of %d part files of %s fetched to the cache",
+            stage.rows,
+            len(paths),
+            base_dir,
+        )
+        return ds.dataset(
+            [local_path for local_path, _ in fetched],
+            schema=dataset.schema,
+            format=dataset.format,
+            filesystem=pafs.LocalFileSystem(use_mmap=True),
+            partitioning=dataset.partitioning,
+            partition_base_dir=root,
+        )
+
+    def evict(self) -> int:
+        """
+        Remove least recently used files until the cache fits in max_bytes,
+        unless a scan is running in any process
+        Returns:
+            int: bytes removed
+        """
+        with open(self._lock_path, "a+b") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            try:
+                entries = []
+                for directory, _, names in os.walk(self.directory):
+                    for name in names:
+                        if name == LOCK_FILE or name.endswith(".tmp"):
+                            continue
+                        path = os.path.join(directory, name)
+                        stat = os.stat(path)
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                total = sum(size for _, size, _ in entries)
+                removed = 0
+                for _, size, path in sorted(entries):
+                    if total - removed <= self.max_bytes:
+                        break
+                    os.remove(path)
+                    removed += size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        if removed:
+            logging.info(
+                "Evicted %d bytes from the cache %s", removed, self.directory
+            )
+        return removed
+
+    def _fetch(
+        self, fs: s3fs.S3FileSystem, path: str, base_dir: str, root: str
+    ) -> tuple[str, int]:
+        """
+        Local copy of one part file, keeping its partition directories
+        relative to base_dir, with its last use recorded in its mtime
+        Returns:
+            tuple[str, int]: local path and bytes downloaded, 0 on a hit
+        """
+        info = fs.info(path)
+        version = str(
+            info.get("ETag")
+            or info.get("mtime")
+            or info.get("LastModified")
+            or info.get("created")
+        )
+        key = hashlib.sha256(f"{version}:{info.get('size')}".encode()).hexdigest()
+        directory, name = os.path.split(os.path.relpath(path, base_dir))
+        local_path = os.path.join(root, directory, f"{key[:16]}-{name}")
+        if os.path.exists(local_path):
+            os.utime(local_path)
+            return local_path, 0
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(local_path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f, fs.open(path, "rb") as remote:
+                while block := remote.read(8 << 20):
+                    f.write(block)
+            os.replace(tmp_path, local_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return local_path, os.path.getsize(local_path)
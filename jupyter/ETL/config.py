@@ -0,0 +1,22 @@
+"""
+Connection configuration shared by the setup scripts, the ETL pipeline and the
+orchestrator, read from the environment. Kept free of heavy imports so that
+reading it does not load the pipeline.
+"""
+
+import os
+
+
+def create_postgress_config() -> dict:
+    """
+    Read the Postgres connection configuration from the environment
+    Returns:
+        dict: postgres connection configuration
+    """
+    return {
+        "database": os.environ["POSTGRES_DATABASE"],
+        "user": os.environ["POSTGRES_USER"],
+        "password": os.environ["POSTGRES_PASSWORD"],
+        "host": os.environ["POSTGRES_HOST"],
+        "port": os.environ["POSTGRES_PORT"],
+    }
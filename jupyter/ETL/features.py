@@ -0,0 +1,539 @@
+"""
+Model-ready loan features materialized from the loans and customers datasets
+of the landing zone, refreshed incrementally as new data lands
+"""
+
+import hashlib
+import json
+import logging
+import math
+import re
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import s3fs
+from fsspec.core import strip_protocol
+from pyarrow import compute as pc, dataset as ds
+
+import metrics
+from ETL import Pipeline
+from layout import ParquetLayout
+
+KEY_COLUMN = "loan_id"
+# refresh sequence number of every feature row, the highest one of a key wins
+VERSION_COLUMN = "_version"
+LOAN_COLUMNS = [
+    "loan_id",
+    "customer_id",
+    "loan_amount",
+    "interest_rate",
+    "start_date",
+    "status",
+    "loan_intent",
+    "credit_score",
+    "loan_term",
+    "loan_grade",
+    "collateral_value",
+]
+CUSTOMER_COLUMNS = [
+    "customer_id",
+    "date_of_birth",
+    "income",
+    "employment_status",
+    "years_of_employment",
+    "cb_person_default_on_file",
+    "cb_preson_cred_hist_length",
+]
+# bin edges and labels of the groups of the credit-risk notebook, left closed
+AGE_GROUPS = ([20, 26, 36, 46, 56, 66], ["20-25", "26-35", "36-45", "46-55", "56-65"])
+INCOME_GROUPS = (
+    [0, 25_000, 50_000, 75_000, 100_000, math.inf],
+    ["low", "low-middle", "middle", "high-middle", "high"],
+)
+LOAN_AMOUNT_GROUPS = (
+    [0, 5_000, 10_000, 15_000, math.inf],
+    ["small", "medium", "large", "very large"],
+)
+# fixed vocabularies, so that every refresh produces the same one-hot columns
+ONE_HOT_CATEGORIES = {
+    "cb_person_default_on_file": ["Y", "N"],
+    "loan_grade": ["A", "B", "C", "D", "E", "F", "G"],
+    "loan_intent": [
+        "Personal",
+        "Mortgage",
+        "Education",
+        "Business",
+        "Medical",
+        "Venture",
+        "Home improvement",
+        "Debt consolidation",
+    ],
+    "employment_status": ["Employed", "Unemployed", "Self-employed"],
+    "age_group": AGE_GROUPS[1],
+    "income_group": INCOME_GROUPS[1],
+    "loan_amount_group": LOAN_AMOUNT_GROUPS[1],
+}
+
+
+@dataclass
+class FeatureManifest:
+    """
+    Refresh state of a feature table
+    Args:
+        version (int): sequence number of the last refresh
+        sources (dict[str, dict[str, str]]): source dataset name to the
+            checksum of every part file the features were computed from
+        parts (list[str]): part files of the feature table
+        updated_at (str | None): time of the last refresh
+    """
+
+    version: int = 0
+    sources: dict[str, dict[str, str]] = field(default_factory=dict)
+    parts: list[str] = field(default_factory=list)
+    updated_at: str | None = None
+
+    @classmethod
+    def load(cls, path: str, fs: s3fs.S3FileSystem) -> "FeatureManifest":
+        """
+        Read a manifest, or start an empty one if it does not exist yet
+        Args:
+            path (str): fs path of the manifest
+            fs (s3fs.S3FileSystem): file system client
+        Returns:
+            FeatureManifest: refresh state of the feature table
+        """
+        if not fs.exists(path):
+            return cls()
+        with fs.open(path, "r") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str, fs: s3fs.S3FileSystem):
+        """
+        Write the manifest
+        Args:
+            path (str): fs path of the manifest
+            fs (s3fs.S3FileSystem): file system client
+        """
+        self.updated_at = datetime.now().isoformat()
+        with fs.open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+
+def prepare_customers(customers: pa.Table) -> pa.Table:
+    """
+    Reduce customers to what compute_features joins once, for callers that
+    compute the features of many chunks of loans against the same customers
+    Args:
+        customers (pa.Table): customers with at least CUSTOMER_COLUMNS
+    Returns:
+        pa.Table: CUSTOMER_COLUMNS of the last row of every non-NULL
+            customer_id, sorted by customer_id
+    """
+    customers = customers.select(CUSTOMER_COLUMNS)
+    customers = customers.filter(pc.is_valid(customers["customer_id"]))
+    customers = _last_per_key(customers, "customer_id")
+    return customers.sort_by("customer_id").combine_chunks()
+
+
+@metrics.instrument()
+def compute_features(
+    loans: pa.Table, customers: pa.Table, prepared: bool = False
+) -> pa.Table:
+    """
+    Join loans to their customers and derive the features of the credit-risk
+    notebook with vectorized Arrow and NumPy operations: the person's age at
+    the start of the loan, the ratio features, the age, income and loan
+    amount groups, dictionary encoded categories and their one-hot columns.
+    Scaling is left to the notebooks, as it has to be fitted on the training
+    split only.
+    Args:
+        loans (pa.Table): loans with at least LOAN_COLUMNS
+        customers (pa.Table): customers with at least CUSTOMER_COLUMNS; the
+            last row of a customer_id is used
+        prepared (bool): customers were returned by prepare_customers; they
+            are looked up by binary search of their sorted ids instead of
+            being deduplicated and hashed for a join on every call
+    Returns:
+        pa.Table: one row of features per loan, keyed by loan_id
+    """
+    loans = loans.select(LOAN_COLUMNS).filter(pc.is_valid(loans[KEY_COLUMN]))
+    if prepared:
+        joined = _lookup_customers(loans, customers)
+    else:
+        customers = _last_per_key(customers.select(CUSTOMER_COLUMNS), "customer_id")
+        joined = loans.join(customers, "customer_id", join_type="left outer")
+    metrics.record(rows=joined.num_rows, bytes=joined.nbytes)
+
+    loan_amount = _float(joined["loan_amount"])
+    income = _float(joined["income"])
+    emp_length = _float(joined["years_of_employment"])
+    age_days = pc.subtract(
+        pc.cast(joined["start_date"], pa.date32()).cast(pa.int32()),
+        pc.cast(joined["date_of_birth"], pa.date32(), safe=False).cast(pa.int32()),
+    )
+    person_age = pc.floor(pc.divide(pc.cast(age_days, pa.float64()), 365.25))
+
+    features = {
+        "loan_id": joined["loan_id"],
+        "customer_id": joined["customer_id"],
+        "start_date": joined["start_date"],
+        "loan_status": joined["status"],
+        "person_age": person_age,
+        "person_income": income,
+        "person_emp_length": emp_length,
+        "cb_person_cred_hist_length": joined["cb_preson_cred_hist_length"],
+        "loan_amount": joined["loan_amount"],
+        "interest_rate": joined["interest_rate"],
+        "loan_term": joined["loan_term"],
+        "credit_score": joined["credit_score"],
+        "collateral_value": joined["collateral_value"],
+        "loan_percent_income": _ratio(loan_amount, income),
+        "loan_to_emp_length_ratio": _ratio(emp_length, loan_amount),
+        "int_rate_to_loan_amt_ratio": _ratio(
+            _float(joined["interest_rate"]), loan_amount
+        ),
+        "collateral_to_loan_ratio": _ratio(
+            _float(joined["collateral_value"]), loan_amount
+        ),
+        "age_group": _bins(person_age, *AGE_GROUPS),
+        "income_group": _bins(income, *INCOME_GROUPS),
+        "loan_amount_group": _bins(loan_amount, *LOAN_AMOUNT_GROUPS),
+    }
+    for column in (
+        "loan_grade",
+        "loan_intent",
+        "cb_person_default_on_file",
+        "employment_status",
+    ):
+        features[column] = pc.dictionary_encode(joined[column])
+    for column, categories in ONE_HOT_CATEGORIES.items():
+        values = features[column]
+        if pa.types.is_dictionary(values.type):
+            values = pc.cast(values, pa.string())
+        for category in categories:
+            features[f"{column}_{_slug(category)}"] = pc.cast(
+                pc.fill_null(pc.equal(values, category), False), pa.int8()
+            )
+    return pa.table(features)
+
+
+@metrics.instrument()
+def materialize_features(
+    pipeline: Pipeline,
+    fs: s3fs.S3FileSystem,
+    loans_path: str,
+    customers_path: str,
+    features_path: str,
+    loans_layout: ParquetLayout | None = None,
+    customers_layout: ParquetLayout | None = None,
+    max_parts: int = 16,
+) -> dict:
+    """
+    Refresh the feature table at features_path. Only the loans affected by
+    source part files that appeared or changed since the last refresh are
+    recomputed: the loans of new loan parts and every loan of the customers
+    of new customer parts. They are appended as a new part file whose rows
+    supersede the older rows of the same loan_id, see read_features. The
+    table is compacted once it has more than max_parts part files. Removed
+    source part files trigger a full rebuild, whose part file is written and
+    recorded in the manifest before the older part files are removed.
+    Args:
+        pipeline (Pipeline): pipeline reading the datasets
+        fs (s3fs.S3FileSystem): file system client
+        loans_path (str): fs path of the loans dataset
+        customers_path (str): fs path of the customers dataset
+        features_path (str): fs path of the feature table
+        loans_layout (ParquetLayout, optional): layout of the loans dataset
+        customers_layout (ParquetLayout, optional): layout of the customers
+            dataset
+        max_parts (int): part files kept before compacting
+    Returns:
+        dict: refreshed rows, whether it was a full rebuild, and the version
+    """
+    manifest_path = f"{features_path}/_manifest.json"
+    manifest = FeatureManifest.load(manifest_path, fs)
+    sources = {
+        "loans": source_checksums(loans_path, fs),
+        "customers": source_checksums(customers_path, fs),
+    }
+    changed = {
+        name: sorted(
+            part
+            for part, checksum in checksums.items()
+            if manifest.sources.get(name, {}).get(part) != checksum
+        )
+        for name, checksums in sources.items()
+    }
+    full = not manifest.parts or any(
+        set(manifest.sources.get(name, {})) - set(checksums)
+        for name, checksums in sources.items()
+    )
+
+    if full:
+        loans = pipeline.read_table_from_fs(
+            loans_path, fs, columns=LOAN_COLUMNS, layout=loans_layout
+        )
+    else:
+        affected = []
+        if changed["loans"]:
+            affected.append(
+                _read_parts(changed["loans"], loans_path, fs, LOAN_COLUMNS)
+            )
+        if changed["customers"]:
+            customer_ids = _read_parts(
+                changed["customers"], customers_path, fs, ["customer_id"]
+            )["customer_id"]
+            affected.append(
+                pipeline.read_table_from_fs(
+                    loans_path,
+                    fs,
+                    columns=LOAN_COLUMNS,
+                    filters=ds.field("customer_id").isin(pc.unique(customer_ids)),
+                    layout=loans_layout,
+                )
+            )
+        loans = _last_per_key(
+            pa.concat_tables(affected, promote_options="default")
+            if affected
+            else pa.table({}),
+            KEY_COLUMN,
+        )
+
+    stats = {"rows": 0, "full": full, "version": manifest.version}
+    if loans.num_rows or full:
+        customers = pipeline.read_table_from_fs(
+            customers_path,
+            fs,
+            columns=CUSTOMER_COLUMNS,
+            filters=None
+            if full
+            else ds.field("customer_id").isin(pc.unique(loans["customer_id"])),
+            layout=customers_layout,
+        )
+        features = compute_features(loans, customers)
+        manifest.version += 1
+        features = features.append_column(
+            VERSION_COLUMN,
+            pa.array(np.full(features.num_rows, manifest.version, dtype=np.int64)),
+        )
+        # named after the sources, so a retried refresh overwrites its own file
+        digest = hashlib.sha256(
+            json.dumps([manifest.version, sources], sort_keys=True).encode()
+        ).hexdigest()[:16]
+        template = f"part-{manifest.version:06d}-{digest}-{{i}}.parquet"
+        pipeline.put_to_fs(
+            features, path=features_path, fs=fs, basename_template=template
+        )
+        if full:
+            manifest.parts = []
+        manifest.parts.append(template.format(i=0))
+        stats.update(rows=features.num_rows, version=manifest.version)
+    manifest.sources = sources
+    manifest.save(manifest_path, fs)
+    if full:
+        _remove_parts(features_path, fs, keep=manifest.parts)
+    logging.info(
+        "Refreshed %d feature rows at %s (version %d%s)",
+        stats["rows"],
+        features_path,
+        stats["version"],
+        ", full rebuild" if full else "",
+    )
+    if len(manifest.parts) > max_parts:
+        compact_features(pipeline, fs, features_path)
+    return stats
+
+
+@metrics.instrument()
+def compact_features(
+    pipeline: Pipeline, fs: s3fs.S3FileSystem, features_path: str
+):
+    """
+    Rewrite a feature table as a single part file holding the latest row of
+    every loan_id. The new part file is written before the old ones are
+    removed, and rows keep their version, so readers never see a loan missing
+    or an outdated row win.
+    Args:
+        pipeline (Pipeline): pipeline reading and writing the table
+        fs (s3fs.S3FileSystem): file system client
+        features_path (str): fs path of the feature table
+    """
+    manifest_path = f"{features_path}/_manifest.json"
+    manifest = FeatureManifest.load(manifest_path, fs)
+    table = read_features(pipeline, features_path, fs, keep_version=True)
+    template = f"compact-{manifest.version:06d}-{{i}}.parquet"
+    pipeline.put_to_fs(table, path=features_path, fs=fs, basename_template=template)
+    _remove_parts(features_path, fs, keep=[template.format(i=0)])
+    manifest.parts = [template.format(i=0)]
+    manifest.save(manifest_path, fs)
+    logging.info("Compacted %s to %d rows", features_path, table.num_rows)
+
+
+@metrics.instrument()
+def read_features(
+    pipeline: Pipeline,
+    features_path: str,
+    fs: s3fs.S3FileSystem,
+    columns: list[str] | None = None,
+    filters: ds.Expression | None = None,
+    keep_version: bool = False,
+) -> pa.Table:
+    """
+    Read the latest features of every loan, e.g. in a notebook:
+    read_features(Pipeline(), "s3://landing-zone/features/loans", fs).to_pandas()
+    Args:
+        pipeline (Pipeline): pipeline reading the table
+        features_path (str): fs path of the feature table
+        fs (s3fs.S3FileSystem): file system client
+        columns (list[str], optional): feature columns, all if not set
+        filters (ds.Expression, optional): row filter, applied after older
+            rows are dropped so that it never selects a superseded row
+        keep_version (bool): keep the refresh version column
+    Returns:
+        pa.Table: one row per loan_id
+    """
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys([KEY_COLUMN, *columns, VERSION_COLUMN]))
+    table = pipeline.read_table_from_fs(features_path, fs, columns=read_columns)
+    table = table.take(pc.sort_indices(table, [(VERSION_COLUMN, "ascending")]))
+    table = _last_per_key(table, KEY_COLUMN)
+    if filters is not None:
+        table = table.filter(filters)
+    if columns is not None:
+        table = table.select(columns + ([VERSION_COLUMN] if keep_version else []))
+    elif not keep_version:
+        table = table.drop_columns([VERSION_COLUMN])
+    return table
+
+
+def source_checksums(path: str, fs: s3fs.S3FileSystem) -> dict[str, str]:
+    """
+    Checksum of every part file of a dataset, the ETag on S3
+    Args:
+        path (str): fs path of the dataset
+        fs (s3fs.S3FileSystem): file system client
+    Returns:
+        dict[str, str]: part file path to checksum
+    """
+    if not fs.exists(path):
+        return {}
+    return {
+        part: str(fs.ukey(part))
+        for part in fs.find(strip_protocol(path))
+        if part.endswith(".parquet")
+        and not part.rsplit("/", 1)[-1].startswith((".", "_"))
+    }
+
+
+def _read_parts(
+    parts: list[str], path: str, fs: s3fs.S3FileSystem, columns: list[str]
+) -> pa.Table:
+    """
+    Read some part files of a hive partitioned dataset, with the values of
+    their partition directories
+    """
+    dataset = ds.dataset(
+        parts,
+        filesystem=fs,
+        format="parquet",
+        partitioning="hive",
+        partition_base_dir=strip_protocol(path),
+    )
+    return dataset.to_table(columns=columns)
+
+
+def _remove_parts(features_path: str, fs: s3fs.S3FileSystem, keep: list[str]):
+    """
+    Remove the part files of a feature table but those named in keep
+    """
+    for part in source_checksums(features_path, fs):
+        if part.rsplit("/", 1)[-1] not in keep:
+            fs.rm(part)
+
+
+def _last_per_key(table: pa.Table, key: str) -> pa.Table:
+    """
+    Keep the last row of every key, in the order of those rows
+    """
+    if not table.num_rows:
+        return table
+    rows = table.append_column("__row", pa.array(np.arange(table.num_rows)))
+    last = rows.group_by(key, use_threads=False).aggregate([("__row", "max")])
+    return table.take(np.sort(last["__row_max"].to_numpy()))
+
+
+def _lookup_customers(loans: pa.Table, customers: pa.Table) -> pa.Table:
+    """
+    Left join of loans to customers returned by prepare_customers, by binary
+    search of the sorted customer ids; falls back to a hash join for non
+    integer ids
+    """
+    keys = customers["customer_id"]
+    if not (
+        pa.types.is_integer(keys.type)
+        and pa.types.is_integer(loans.schema.field("customer_id").type)
+    ):
+        return loans.join(customers, "customer_id", join_type="left outer")
+    # a single chunk after combine_chunks, so this is a zero-copy view
+    sorted_ids = (
+        keys.chunk(0).to_numpy() if keys.num_chunks == 1 else keys.to_numpy()
+    )
+    ids = loans["customer_id"]
+    wanted = pc.fill_null(ids, 0).to_numpy()
+    positions = np.minimum(
+        np.searchsorted(sorted_ids, wanted), max(len(sorted_ids) - 1, 0)
+    )
+    found = pc.is_valid(ids).to_numpy(zero_copy_only=False)
+    if len(sorted_ids):
+        found &= sorted_ids[positions] == wanted
+    else:
+        found[:] = False
+    matches = customers.drop_columns(["customer_id"]).take(
+        pa.array(positions, mask=~found)
+    )
+    for name, column in zip(matches.column_names, matches.columns):
+        loans = loans.append_column(name, column)
+    return loans
+
+
+def _float(values: pa.ChunkedArray) -> pa.ChunkedArray:
+    """
+    Values cast to float64
+    """
+    return pc.cast(values, pa.float64())
+
+
+def _ratio(
+    numerator: pa.ChunkedArray, denominator: pa.ChunkedArray
+) -> pa.ChunkedArray:
+    """
+    numerator / denominator, NULL where the denominator is 0
+    """
+    return pc.if_else(
+        pc.equal(denominator, 0.0), None, pc.divide(numerator, denominator)
+    )
+
+
+def _bins(values: pa.ChunkedArray, edges: list[float], labels: list[str]) -> pa.Array:
+    """
+    Dictionary encoded label of the [edges[i], edges[i + 1]) bin of every
+    value, NULL outside of the bins
+    """
+    array = pc.cast(values, pa.float64()).to_numpy(zero_copy_only=False)
+    index = np.searchsorted(edges, array, side="right") - 1
+    outside = np.isnan(array) | (index < 0) | (index >= len(labels))
+    return pa.DictionaryArray.from_arrays(
+        pa.array(np.where(outside, 0, index).astype(np.int8), mask=outside),
+        pa.array(labels),
+    )
+
+
+def _slug(value: str) -> str:
+    """
+    Category as a column name suffix, e.g. "Home improvement" to
+    "home_improvement"
+    """
+    return re.sub(r"[^0-9a-z]+", "_", value.lower()).strip("_")
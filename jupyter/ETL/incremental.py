@@ -0,0 +1,227 @@
+"""
+Manifest of ingested part files and high-water marks for incremental loads
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Callable
+
+import pyarrow as pa
+import s3fs
+from pyarrow import compute as pc, dataset as ds, parquet as pq
+
+
+@dataclass
+class Manifest:
+    """
+    Ingestion state of one table
+    Args:
+        table (str): table name
+        watermark_column (str | None): column whose maximum is tracked
+        watermark (str | None): highest ingested value of watermark_column
+        parts (dict[str, dict]): fingerprint of every ingested local part file
+        updated_at (str | None): time of the last ingestion
+    """
+
+    table: str
+    watermark_column: str | None = None
+    watermark: str | None = None
+    parts: dict[str, dict] = field(default_factory=dict)
+    updated_at: str | None = None
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        fs: s3fs.S3FileSystem,
+        table: str,
+        watermark_column: str | None = None,
+    ) -> "Manifest":
+        """
+        Read a manifest, or start an empty one if it does not exist yet
+        Args:
+            path (str): S3 path of the manifest
+            fs (s3fs.S3FileSystem): file system client
+            table (str): table name
+            watermark_column (str, optional): column tracked by the watermark
+        Returns:
+            Manifest: ingestion state of the table
+        """
+        if not fs.exists(path):
+            return cls(table=table, watermark_column=watermark_column)
+        with fs.open(path, "r") as f:
+            return cls(**json.load(f))
+
+    def save(self, path: str, fs: s3fs.S3FileSystem):
+        """
+        Write the manifest
+        Args:
+            path (str): S3 path of the manifest
+            fs (s3fs.S3FileSystem): file system client
+        """
+        self.updated_at = datetime.now().isoformat()
+        with fs.open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    def delta(
+        self,
+        local_path: str,
+        key_columns: list[str] | None = None,
+        ingested_keys: Callable[[ds.Expression | None], pa.Table | None]
+        | None = None,
+    ) -> tuple[pa.Table | None, dict[str, dict]]:
+        """
+        Collect the rows of local_path that were not ingested yet. Part files
+        never seen before are taken whole. Part files rewritten since the last
+        run are diffed against the ingested rows, see _unseen.
+        Args:
+            local_path (str): Parquet file or directory of part files
+            key_columns (list[str], optional): key of the table
+            ingested_keys (Callable, optional): reads the key_columns of the
+                ingested rows matching a dataset filter, all of them for None,
+                and returns None if nothing was ingested; required with
+                key_columns
+        Returns:
+            tuple: new rows (None if there are none) and the fingerprints of
+                the part files they came from
+        """
+        tables, changed = [], {}
+        read_keys = _once(ingested_keys) if ingested_keys is not None else None
+        for part in local_parts(local_path):
+            previous = self.parts.get(part)
+            current = fingerprint(part, previous)
+            if previous is not None and previous["sha256"] == current["sha256"]:
+                if previous != current:
+                    # same content written again, e.g. a regenerated snapshot
+                    changed[part] = current
+                continue
+            changed[part] = current
+            table = pq.read_table(part)
+            if previous is not None:
+                table = self._unseen(table, key_columns, read_keys)
+            if table.num_rows:
+                tables.append(table)
+        if not tables:
+            return None, changed
+        return pa.concat_tables(tables, promote_options="default"), changed
+
+    def _unseen(
+        self,
+        table: pa.Table,
+        key_columns: list[str] | None,
+        read_keys: Callable[[ds.Expression | None], pa.Table | None],
+    ) -> pa.Table:
+        """
+        Rows of a rewritten part file that were not ingested yet. With
+        key_columns, the rows at or above the watermark (all rows without
+        one) whose key is not among the ingested keys. Without, the rows
+        strictly above the watermark: rows equal to it cannot be told apart
+        from the ingested ones and are skipped. Rows with a NULL watermark
+        are skipped either way. Raises ValueError without a key or watermark.
+        """
+        bound = None
+        if self.watermark_column and self.watermark:
+            column = table[self.watermark_column]
+            bound = pa.scalar(self.watermark).cast(column.type)
+        if not key_columns:
+            if bound is None:
+                raise ValueError(
+                    f"{self.table} has neither a key nor a watermark to diff "
+                    "rewritten part files on"
+                )
+            return table.filter(pc.greater(table[self.watermark_column], bound))
+        if bound is None:
+            ingested = read_keys(None)
+        else:
+            table = table.filter(
+                pc.greater_equal(table[self.watermark_column], bound)
+            )
+            ingested = read_keys(ds.field(self.watermark_column) >= bound)
+        if ingested is None:
+            return table
+        return table.join(
+            ingested.select(key_columns), keys=key_columns, join_type="left anti"
+        )
+
+    def commit(self, delta: pa.Table | None, changed: dict[str, dict]):
+        """
+        Record a delta as ingested
+        Args:
+            delta (pa.Table | None): rows that were ingested
+            changed (dict[str, dict]): fingerprints returned by delta
+        """
+        self.parts.update(changed)
+        if delta is None or not self.watermark_column:
+            return
+        column = delta[self.watermark_column]
+        highest = pc.max(column)
+        if highest.is_valid and (
+            self.watermark is None
+            or pc.greater(highest, pa.scalar(self.watermark).cast(column.type)).as_py()
+        ):
+            self.watermark = str(highest.as_py())
+
+    def digest(self, changed: dict[str, dict]) -> str:
+        """
+        Stable identifier of a delta, used to name its S3 part files so that
+        retrying a failed run overwrites them instead of duplicating them
+        """
+        payload = json.dumps([self.watermark, changed], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _once(func: Callable) -> Callable:
+    """
+    Call func on the first call only and return its result from then on
+    """
+    result = []
+
+    def wrapper(*args):
+        if not result:
+            result.append(func(*args))
+        return result[0]
+
+    return wrapper
+
+
+def local_parts(local_path: str) -> list[str]:
+    """
+    List the Parquet part files of a local file or dataset directory
+    Args:
+        local_path (str): Parquet file or directory
+    Returns:
+        list[str]: sorted part file paths
+    """
+    if not os.path.isdir(local_path):
+        return [local_path]
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(local_path)
+        for name in names
+        if name.endswith(".parquet") and not name.startswith((".", "_"))
+    )
+
+
+def fingerprint(path: str, previous: dict | None = None) -> dict:
+    """
+    Identify the content of a local file. The content hash is reused from
+    the previous fingerprint while size and modification time are unchanged.
+    Args:
+        path (str): local file
+        previous (dict, optional): fingerprint recorded by an earlier run
+    Returns:
+        dict: size, mtime_ns and sha256 of the file
+    """
+    stat = os.stat(path)
+    current = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and all(previous[k] == v for k, v in current.items()):
+        return previous
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    current["sha256"] = sha256.hexdigest()
+    return current
@@ -0,0 +1,130 @@
+"""
+Physical Parquet layout of the S3 datasets
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+
+import pyarrow as pa
+from pyarrow import compute as pc, dataset as ds
+
+
+@dataclass
+class ParquetLayout:
+    """
+    How a dataset is partitioned and encoded on S3
+    Args:
+        partition_cols (list[str]): hive partition columns, in directory order
+        month_partitions (dict[str, str]): derived "YYYY-MM" partition column
+            to the date column it is computed from, e.g.
+            {"start_month": "start_date"}
+        row_group_size (int | None): maximum rows per row group
+        compression (str): Parquet codec, e.g. "snappy", "zstd" or "lz4"
+        compression_level (int | None): codec level, codec default if not set
+        use_dictionary (bool | list[str]): dictionary encode all columns, none,
+            or only the listed ones
+        version (str): Parquet format version
+    """
+
+    partition_cols: list[str] = field(default_factory=list)
+    month_partitions: dict[str, str] = field(default_factory=dict)
+    row_group_size: int | None = None
+    compression: str = "snappy"
+    compression_level: int | None = None
+    use_dictionary: bool | list[str] = True
+    version: str = "2.6"
+
+    def write_options(self) -> dict:
+        """
+        Keyword arguments of pq.write_to_dataset for this layout
+        """
+        options = {
+            "partition_cols": self.partition_cols or None,
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "use_dictionary": self.use_dictionary,
+            "version": self.version,
+        }
+        if self.row_group_size:
+            options["row_group_size"] = self.row_group_size
+            options["min_rows_per_group"] = self.row_group_size
+        return options
+
+    def dataset_write_options(self) -> dict:
+        """
+        Keyword arguments of ds.write_dataset for this layout, used when the
+        data arrives as a stream of record batches instead of a table
+        """
+        options = {
+            "format": "parquet",
+            "file_options": ds.ParquetFileFormat().make_write_options(
+                compression=self.compression,
+                compression_level=self.compression_level,
+                use_dictionary=self.use_dictionary,
+                version=self.version,
+            ),
+            "partitioning": self.partition_cols or None,
+            "partitioning_flavor": "hive" if self.partition_cols else None,
+            "existing_data_behavior": "overwrite_or_ignore",
+        }
+        if self.row_group_size:
+            options["max_rows_per_group"] = self.row_group_size
+            options["min_rows_per_group"] = self.row_group_size
+        return options
+
+    def add_partition_columns(self, table: pa.Table) -> pa.Table:
+        """
+        Append the derived month partition columns to a table
+        """
+        for name, source in self.month_partitions.items():
+            column = table[source]
+            if not pa.types.is_timestamp(column.type):
+                column = pc.cast(column, pa.timestamp("s"))
+            table = table.append_column(name, pc.strftime(column, format="%Y-%m"))
+        return table
+
+    def add_partition_columns_batch(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        """
+        Append the derived month partition columns to a record batch
+        """
+        if not self.month_partitions:
+            return batch
+        table = self.add_partition_columns(pa.Table.from_batches([batch]))
+        return table.combine_chunks().to_batches()[0]
+
+    def expand_filters(self, filters: list | None) -> list | None:
+        """
+        Add the month partition bounds implied by filters on their date
+        columns, so that date filters also prune partition directories
+        Args:
+            filters (list | None): filters in pq.read_table DNF form
+        Returns:
+            list | None: filters as a list of conjunctions
+        """
+        if not filters or not self.month_partitions:
+            return filters
+        conjunctions = [filters] if isinstance(filters[0], tuple) else filters
+        sources = {source: name for name, source in self.month_partitions.items()}
+        expanded = []
+        for conjunction in conjunctions:
+            implied = []
+            for column, op, value in conjunction:
+                if column not in sources:
+                    continue
+                if op in (">", ">="):
+                    implied.append((sources[column], ">=", _month(value)))
+                elif op in ("<", "<="):
+                    implied.append((sources[column], "<=", _month(value)))
+                elif op in ("=", "=="):
+                    implied.append((sources[column], "=", _month(value)))
+                elif op == "in":
+                    implied.append((sources[column], "in", {_month(v) for v in value}))
+            expanded.append(list(conjunction) + implied)
+        return expanded
+
+
+def _month(value: date | str) -> str:
+    """
+    "YYYY-MM" of a date, datetime or ISO string
+    """
+    return value[:7] if isinstance(value, str) else value.strftime("%Y-%m")
@@ -0,0 +1,425 @@
+"""
+Per-stage instrumentation of the ETL pipeline and the mock data generators.
+
+Every stage records its wall time, CPU time, rows, bytes and the peak RSS of
+the process. The run can be exported as a JSON report and as a Prometheus
+textfile. Setting ETL_PROFILE to "cprofile" or "pyinstrument" also profiles
+every outermost stage of a thread into ETL_PROFILE_DIR (the working directory
+if not set).
+"""
+
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Iterator
+
+import pandas as pd
+import pyarrow as pa
+
+PROFILE_ENV = "ETL_PROFILE"
+PROFILE_DIR_ENV = "ETL_PROFILE_DIR"
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+# stage measurements summed over the runs of a stage in the Prometheus export
+SUMMED_FIELDS = ("wall_seconds", "cpu_seconds", "rows", "bytes")
+
+
+@dataclass
+class StageMetrics:
+    """
+    Measurements of one run of a stage
+    Args:
+        stage (str): stage name, e.g. "put_to_fs" or "copy"
+        labels (dict[str, str]): extra dimensions, e.g. the table name
+        parent (str | None): stage this one ran inside of, on the same thread
+        status (str): "succeeded" or "failed"
+        started_at (str): start time
+        wall_seconds (float): elapsed time
+        cpu_seconds (float): CPU time of the whole process during the stage,
+            including the work of stages running concurrently
+        rows (int): rows processed
+        bytes (int): bytes processed
+        peak_rss_bytes (int): highest resident set size of the process so far
+    """
+
+    stage: str
+    labels: dict[str, str] = field(default_factory=dict)
+    parent: str | None = None
+    status: str = "succeeded"
+    started_at: str = ""
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    rows: int = 0
+    bytes: int = 0
+    peak_rss_bytes: int = 0
+
+
+class Recorder:
+    """
+    Thread-safe collection of the stage metrics of a run
+    """
+
+    def __init__(self) -> None:
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now().isoformat()
+        self._stages: list[StageMetrics] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(
+        self, name: str, current: bool = True, **labels: Any
+    ) -> Iterator[StageMetrics]:
+        """
+        Measure the block as one run of a stage. Rows and bytes are set on
+        the yielded StageMetrics or added with record.
+        Args:
+            name (str): stage name
+            current (bool): make it the stage of this thread that record and
+                nested stages refer to, which a generator suspended between
+                items must not do
+            **labels: extra dimensions of the stage, e.g. table="loans"
+        Yields:
+            StageMetrics: measurements, completed when the block exits
+        """
+        stack = self._stack()
+        metrics = StageMetrics(
+            stage=name,
+            labels={key: str(value) for key, value in labels.items()},
+            parent=stack[-1].stage if stack else None,
+            started_at=datetime.now().isoformat(),
+        )
+        # only outermost stages are profiled, a profiler enabled by a nested
+        # stage would replace the one of the outer stage
+        profiled = current and not stack
+        if current:
+            stack.append(metrics)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            with _profile(name if profiled else None):
+                yield metrics
+        except GeneratorExit:
+            # a consumer stopped reading a generator stage early
+            raise
+        except BaseException:
+            metrics.status = "failed"
+            raise
+        finally:
+            metrics.wall_seconds = time.perf_counter() - wall
+            metrics.cpu_seconds = time.process_time() - cpu
+            metrics.peak_rss_bytes = peak_rss_bytes()
+            if current:
+                stack.pop()
+            with self._lock:
+                self._stages.append(metrics)
+            logging.debug(
+                "Stage %s %s in %.3fs (%d rows, %d bytes)",
+                name,
+                metrics.status,
+                metrics.wall_seconds,
+                metrics.rows,
+                metrics.bytes,
+            )
+
+    def record(
+        self, rows: int = 0, bytes: int = 0  # pylint: disable=redefined-builtin
+    ):
+        """
+        Add rows and bytes to the innermost stage running on this thread
+        """
+        stack = self._stack()
+        if stack:
+            stack[-1].rows += rows
+            stack[-1].bytes += bytes
+
+    def stages(self) -> list[dict]:
+        """
+        Metrics of every finished stage, in completion order
+        """
+        with self._lock:
+            return [asdict(metrics) for metrics in self._stages]
+
+    def extend(self, stages: list[dict], **labels: Any):
+        """
+        Add stages recorded elsewhere, e.g. by a worker process
+        Args:
+            stages (list[dict]): stages as returned by stages()
+            **labels: labels added to every stage, e.g. shard=3
+        """
+        extra = {key: str(value) for key, value in labels.items()}
+        with self._lock:
+            for stage in stages:
+                stage = dict(stage, labels={**stage["labels"], **extra})
+                self._stages.append(StageMetrics(**stage))
+
+    def reset(self):
+        """
+        Forget the recorded stages and start a new run
+        """
+        with self._lock:
+            self._stages = []
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now().isoformat()
+
+    def report(self) -> dict:
+        """
+        Run report with the metrics of every stage
+        """
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "finished_at": datetime.now().isoformat(),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": self.stages(),
+        }
+
+    def write_json(self, path: str):
+        """
+        Write the run report as JSON
+        """
+        _write_atomic(path, json.dumps(self.report(), indent=2))
+
+    def write_prometheus(self, path: str, job: str = "etl"):
+        """
+        Write the metrics in the Prometheus text format, e.g. for the
+        node_exporter textfile collector. Runs of the same stage and labels
+        are summed.
+        Args:
+            path (str): file to write, named *.prom for the textfile collector
+            job (str): value of the job label
+        """
+        totals: dict[tuple, dict[str, float]] = {}
+        for stage in self.stages():
+            key = (
+                ("job", job),
+                ("stage", stage["stage"]),
+                ("status", stage["status"]),
+                *sorted(stage["labels"].items()),
+            )
+            total = totals.setdefault(
+                key, {"runs": 0, **dict.fromkeys(SUMMED_FIELDS, 0)}
+            )
+            total["runs"] += 1
+            for name in SUMMED_FIELDS:
+                total[name] += stage[name]
+        lines = []
+        for name, kind, help_text in (
+            ("runs", "counter", "Number of runs of the stage"),
+            ("wall_seconds", "counter", "Wall time spent in the stage"),
+            ("cpu_seconds", "counter", "Process CPU time spent in the stage"),
+            ("rows", "counter", "Rows processed by the stage"),
+            ("bytes", "counter", "Bytes processed by the stage"),
+        ):
+            lines.append(f"# HELP etl_stage_{name}_total {help_text}")
+            lines.append(f"# TYPE etl_stage_{name}_total {kind}")
+            for key, total in totals.items():
+                lines.append(
+                    f"etl_stage_{name}_total{{{_labels(key)}}} {total[name]}"
+                )
+        lines.append("# HELP etl_peak_rss_bytes Peak resident set size of the run")
+        lines.append("# TYPE etl_peak_rss_bytes gauge")
+        lines.append(f'etl_peak_rss_bytes{{job="{job}"}} {peak_rss_bytes()}')
+        lines.append("# HELP etl_last_run_timestamp_seconds End time of the run")
+        lines.append("# TYPE etl_last_run_timestamp_seconds gauge")
+        lines.append(f'etl_last_run_timestamp_seconds{{job="{job}"}} {time.time()}')
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+    def export(self, directory: str, name: str = "etl"):
+        """
+        Write <name>-report.json and <name>.prom into directory
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.write_json(os.path.join(directory, f"{name}-report.json"))
+        self.write_prometheus(os.path.join(directory, f"{name}.prom"), job=name)
+        logging.info("Wrote metrics of run %s to %s", self.run_id, directory)
+
+    def _stack(self) -> list[StageMetrics]:
+        """
+        Stages running on the current thread, innermost last
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+
+RECORDER = Recorder()
+
+
+def stage(name: str, **labels: Any):
+    """
+    Measure a block as a stage of the default recorder
+    """
+    return RECORDER.stage(name, **labels)
+
+
+def record(rows: int = 0, bytes: int = 0):  # pylint: disable=redefined-builtin
+    """
+    Add rows and bytes to the current stage of the default recorder
+    """
+    RECORDER.record(rows=rows, bytes=bytes)
+
+
+def instrument(name: str | None = None) -> Callable:
+    """
+    Decorate a function, method or generator function as a stage of the
+    default recorder. The stage is labelled with the table_name argument if
+    the function has one. Unless the function records them itself, rows and
+    bytes are taken from a returned Arrow table, DataFrame, integer row count
+    or stats dict, or from the batches a generator yields.
+    Args:
+        name (str, optional): stage name, the function name if not set
+    """
+
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        def labels(args, kwargs) -> dict:
+            if "table_name" not in signature.parameters:
+                return {}
+            bound = signature.bind_partial(*args, **kwargs)
+            table_name = bound.arguments.get("table_name")
+            return {} if table_name is None else {"table": table_name}
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with RECORDER.stage(
+                    stage_name, current=False, **labels(args, kwargs)
+                ) as metrics:
+                    for item in func(*args, **kwargs):
+                        rows, size = size_of(item)
+                        metrics.rows += rows
+                        metrics.bytes += size
+                        yield item
+
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with RECORDER.stage(stage_name, **labels(args, kwargs)) as metrics:
+                result = func(*args, **kwargs)
+                if not metrics.rows and not metrics.bytes:
+                    metrics.rows, metrics.bytes = size_of(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def peak_rss_bytes() -> int:
+    """
+    Highest resident set size of the process so far
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def size_of(value: Any) -> tuple[int, int]:
+    """
+    Rows and bytes of an Arrow table or batch, a DataFrame, an integer row
+    count or a stats dict with rows and bytes keys
+    """
+    if isinstance(value, (pa.Table, pa.RecordBatch)):
+        return value.num_rows, value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=False).sum())
+    if isinstance(value, dict):
+        return int(value.get("rows") or 0), int(value.get("bytes") or 0)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value, 0
+    return 0, 0
+
+
+@contextmanager
+def _profile(name: str | None) -> Iterator[None]:
+    """
+    Profile the block with the profiler named by ETL_PROFILE, if any, unless
+    name is None
+    """
+    profiler_name = os.environ.get(PROFILE_ENV, "").lower()
+    if not profiler_name or name is None:
+        yield
+        return
+    directory = os.environ.get(PROFILE_DIR_ENV, ".")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(
+        directory, f"{name}-{os.getpid()}-{threading.get_ident()}-{time.time_ns()}"
+    )
+    if profiler_name == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already active
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+    elif profiler_name == "pyinstrument":
+        try:
+            from pyinstrument import Profiler  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            logging.warning(
+                "%s=pyinstrument but pyinstrument is not installed", PROFILE_ENV
+            )
+            yield
+            return
+        profiler = Profiler(async_mode="disabled")
+        try:
+            profiler.start()
+        except RuntimeError:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.stop()
+            _write_atomic(f"{path}.html", profiler.output_html())
+    else:
+        raise ValueError(
+            f"{PROFILE_ENV} must be cprofile or pyinstrument, not {profiler_name!r}"
+        )
+
+
+def _labels(key: tuple) -> str:
+    """
+    Render label pairs in the Prometheus text format
+    """
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in key)
+
+
+def _escape(value: str) -> str:
+    """
+    Escape a Prometheus label value
+    """
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _write_atomic(path: str, text: str):
+    """
+    Write text to path through a temporary file, so readers such as the
+    textfile collector never see a partial file
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
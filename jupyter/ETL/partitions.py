@@ -0,0 +1,136 @@
+"""
+Routing of Arrow tables to the partitions of a range partitioned Postgres table
+"""
+
+import re
+from dataclasses import dataclass
+
+import pyarrow as pa
+from pyarrow import compute as pc
+
+_BOUND = re.compile(r"^FOR VALUES FROM \((.+)\) TO \((.+)\)$")
+
+
+@dataclass
+class Partition:
+    """
+    One partition of a range partitioned table
+    Args:
+        name (str): partition name, schema qualified when needed
+        lower (str | None): inclusive lower bound, None for MINVALUE
+        upper (str | None): exclusive upper bound, None for MAXVALUE
+        is_default (bool): whether this is the DEFAULT partition
+    """
+
+    name: str
+    lower: str | None = None
+    upper: str | None = None
+    is_default: bool = False
+
+
+def table_partitions(cursor, table_name: str) -> tuple[str | None, list[Partition]]:
+    """
+    Look up the partition key and the partitions of a table
+    Args:
+        cursor: psycopg2 cursor
+        table_name (str): table name, optionally schema qualified
+
+    Returns:
+        tuple[str | None, list[Partition]]: partition key column and
+            partitions, None and an empty list if the table is not partitioned
+    """
+    cursor.execute("SELECT pg_get_partkeydef(%s::regclass)", (table_name,))
+    key = cursor.fetchone()[0]
+    if key is None:
+        return None, []
+    match = re.fullmatch(r"RANGE \((\w+)\)", key)
+    if match is None:
+        raise ValueError(
+            f"{table_name} is partitioned by {key}, only single column RANGE "
+            "partitioning is supported"
+        )
+    cursor.execute(
+        """
+        SELECT c.oid::regclass::text, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY 1""",
+        (table_name,),
+    )
+    partitions = []
+    for name, bound in cursor.fetchall():
+        if bound == "DEFAULT":
+            partitions.append(Partition(name=name, is_default=True))
+            continue
+        bounds = _BOUND.match(bound)
+        if bounds is None:
+            raise ValueError(f"Unsupported bound of partition {name}: {bound}")
+        partitions.append(
+            Partition(
+                name=name,
+                lower=_bound_value(bounds.group(1)),
+                upper=_bound_value(bounds.group(2)),
+            )
+        )
+    return match.group(1), partitions
+
+
+def split_by_partition(
+    table: pa.Table, key: str, partitions: list[Partition]
+) -> list[tuple[Partition, pa.Table]]:
+    """
+    Split a table into the rows of every partition. Rows outside of every
+    range, and rows with a NULL key, go to the default partition.
+    Args:
+        table (pa.Table): rows to route
+        key (str): partition key column
+        partitions (list[Partition]): partitions of the target table
+
+    Returns:
+        list[tuple[Partition, pa.Table]]: every partition with its rows,
+            possibly none
+    """
+    column = table.column(key)
+    routed = pa.array([False] * table.num_rows, pa.bool_())
+    split = []
+    for partition in partitions:
+        if partition.is_default:
+            continue
+        mask = pc.is_valid(column)
+        if partition.lower is not None:
+            mask = pc.and_(
+                mask, pc.greater_equal(column, _scalar(partition.lower, column.type))
+            )
+        if partition.upper is not None:
+            mask = pc.and_(
+                mask, pc.less(column, _scalar(partition.upper, column.type))
+            )
+        mask = pc.fill_null(mask, False)
+        routed = pc.or_(routed, mask)
+        split.append((partition, table.filter(mask)))
+    rest = table.filter(pc.invert(routed))
+    default = next((p for p in partitions if p.is_default), None)
+    if default is not None:
+        split.append((default, rest))
+    elif rest.num_rows:
+        raise ValueError(
+            f"{rest.num_rows} rows fall outside of every partition and there "
+            "is no default partition"
+        )
+    return split
+
+
+def _bound_value(literal: str) -> str | None:
+    """
+    Value of a bound literal like '2024-01-01', None for MINVALUE/MAXVALUE
+    """
+    if literal in ("MINVALUE", "MAXVALUE"):
+        return None
+    return literal.strip("'").replace("''", "'")
+
+
+def _scalar(value: str, type_: pa.DataType) -> pa.Scalar:
+    """
+    Bound value cast to the type of the partition key column
+    """
+    return pa.scalar(value).cast(type_)
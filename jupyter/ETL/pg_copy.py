@@ -0,0 +1,294 @@
+"""
+Encoder for the PostgreSQL binary COPY format
+"""
+
+from typing import Iterable, Iterator
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import RecordBatch, compute as pc
+
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + (0).to_bytes(4, "big") + (0).to_bytes(4, "big")
+COPY_TRAILER = (-1).to_bytes(2, "big", signed=True)
+# days between the Unix epoch and the PostgreSQL epoch (2000-01-01)
+PG_EPOCH_DAYS = 10957
+PG_EPOCH_MICROSECONDS = PG_EPOCH_DAYS * 86_400_000_000
+FIXED_WIDTH_TYPES = {
+    "smallint": (pa.int16(), ">i2"),
+    "integer": (pa.int32(), ">i4"),
+    "bigint": (pa.int64(), ">i8"),
+    "real": (pa.float32(), ">f4"),
+    "double precision": (pa.float64(), ">f8"),
+    "boolean": (pa.uint8(), "u1"),
+}
+TEXT_TYPES = ("character varying", "text", "character")
+HEX_VALUES = np.full(256, 255, dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b"0123456789", dtype=np.uint8)] = np.arange(10)
+HEX_VALUES[np.frombuffer(b"abcdef", dtype=np.uint8)] = np.arange(10, 16)
+HEX_VALUES[np.frombuffer(b"ABCDEF", dtype=np.uint8)] = np.arange(10, 16)
+
+
+def table_column_types(cursor, table_name: str) -> dict[str, str]:
+    """
+    Look up the column types of a Postgres table
+    Args:
+        cursor: psycopg2 cursor
+        table_name (str): table name, optionally schema qualified
+
+    Returns:
+        dict[str, str]: column name to type name without modifiers, e.g.
+            "character varying" or "double precision"
+    """
+    cursor.execute(
+        """
+        SELECT a.attname, format_type(a.atttypid, NULL)
+        FROM pg_attribute a
+        WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY a.attnum""",
+        (table_name,),
+    )
+    return dict(cursor.fetchall())
+
+
+class BinaryCopyStream:
+    """
+    File-like producer of COPY ... FROM STDIN (FORMAT binary) data.
+    Record batches are encoded one at a time as they are read, so memory is
+    bounded by the size of one batch and its encoding.
+    """
+
+    def __init__(
+        self,
+        batches: Iterable[RecordBatch],
+        columns: list[str],
+        column_types: dict[str, str],
+    ) -> None:
+        """
+        Args:
+            batches (Iterable[RecordBatch]): data to encode
+            columns (list[str]): columns to encode, in COPY column list order
+            column_types (dict[str, str]): Postgres type of each column
+        """
+        missing = [column for column in columns if column not in column_types]
+        if missing:
+            raise KeyError(f"Columns {missing} do not exist in the target table")
+        self.columns = columns
+        self.column_types = column_types
+        self.rows = 0
+        self.bytes = 0
+        self._batches = iter(batches)
+        self._pending = memoryview(COPY_HEADER)
+        self._finished = False
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes of the COPY stream, an empty result marks its end
+        """
+        while not self._pending and not self._finished:
+            batch = next(self._batches, None)
+            if batch is None:
+                self._pending = memoryview(COPY_TRAILER)
+                self._finished = True
+            elif batch.num_rows:
+                self._pending = memoryview(self.encode(batch))
+                self.rows += batch.num_rows
+        if size is None or size < 0:
+            size = len(self._pending)
+        chunk = self._pending[:size]
+        self._pending = self._pending[size:]
+        self.bytes += len(chunk)
+        return chunk.tobytes()
+
+    def encode(self, batch: RecordBatch) -> np.ndarray:
+        """
+        Encode the tuples of one record batch
+        Args:
+            batch (RecordBatch): rows to encode
+
+        Returns:
+            np.ndarray: uint8 buffer of the encoded tuples
+        """
+        fields = [
+            _encode_column(batch.column(column), self.column_types[column])
+            for column in self.columns
+        ]
+        # every tuple is an int16 field count followed by, per field, an int32
+        # length (-1 for NULL) and the value bytes
+        field_sizes = [4 + np.maximum(lengths, 0) for lengths, _, _ in fields]
+        tuple_sizes = 2 + np.sum(field_sizes, axis=0, dtype=np.int64)
+        tuple_starts = np.zeros(batch.num_rows, dtype=np.int64)
+        np.cumsum(tuple_sizes[:-1], out=tuple_starts[1:])
+        out = np.empty(int(tuple_sizes.sum()), dtype=np.uint8)
+
+        _scatter_fixed(
+            out,
+            tuple_starts,
+            np.full(
+                (batch.num_rows, 1), len(self.columns), dtype=">i2"
+            ).view(np.uint8),
+        )
+        position = tuple_starts + 2
+        for (lengths, data, offsets), size in zip(fields, field_sizes):
+            _scatter_fixed(
+                out, position, lengths.astype(">i4").reshape(-1, 1).view(np.uint8)
+            )
+            valid = lengths >= 0
+            if data.ndim == 2:
+                _scatter_fixed(out, position[valid] + 4, data)
+            else:
+                _scatter_variable(
+                    out, position[valid] + 4, data, offsets, lengths[valid]
+                )
+            position += size
+        return out
+
+
+def iter_copy_batches(
+    data: pa.Table | Iterable[RecordBatch], batch_size: int = 65_536
+) -> Iterator[RecordBatch]:
+    """
+    Split a table or re-chunk a batch stream into batches of bounded size
+    """
+    if isinstance(data, pa.Table):
+        yield from data.to_batches(max_chunksize=batch_size)
+        return
+    for batch in data:
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+def _encode_column(
+    array: pa.Array, pg_type: str
+) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+    """
+    Encode the values of an Arrow array for a Postgres column type
+    Args:
+        array (pa.Array): values
+        pg_type (str): Postgres type name
+
+    Returns:
+        tuple: int32 lengths (-1 for NULL), then either a (valid rows, width)
+            uint8 matrix for fixed-width types, or a uint8 buffer with int64
+            start offsets of every valid value for variable-width types
+    """
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    valid = np.logical_not(array.is_null().to_numpy(zero_copy_only=False))
+
+    def fixed(values: np.ndarray) -> tuple:
+        width = values.dtype.itemsize
+        lengths = np.where(valid, width, -1).astype(np.int32)
+        return lengths, values[valid].reshape(-1, 1).view(np.uint8), None
+
+    if pg_type in FIXED_WIDTH_TYPES:
+        arrow_type, numpy_type = FIXED_WIDTH_TYPES[pg_type]
+        if pa.types.is_boolean(array.type):
+            array = pc.cast(array, pa.int8())
+        values = pc.fill_null(pc.cast(array, arrow_type), 0)
+        return fixed(values.to_numpy().astype(numpy_type))
+    if pg_type == "date":
+        if pa.types.is_timestamp(array.type):
+            array = pc.cast(array, pa.timestamp("s"), safe=False)
+        days = pc.fill_null(pc.cast(array, pa.date32()), 0).cast(pa.int32())
+        return fixed((days.to_numpy() - PG_EPOCH_DAYS).astype(">i4"))
+    if pg_type == "timestamp without time zone":
+        microseconds = pc.fill_null(
+            pc.cast(array, pa.timestamp("us")), 0
+        ).cast(pa.int64())
+        return fixed((microseconds.to_numpy() - PG_EPOCH_MICROSECONDS).astype(">i8"))
+    if pg_type == "uuid":
+        lengths = np.where(valid, 16, -1).astype(np.int32)
+        return lengths, _uuid_bytes(array, valid), None
+    if pg_type in TEXT_TYPES:
+        if pa.types.is_floating(array.type):
+            array = float_text(array)
+        elif not pa.types.is_string(array.type):
+            array = pc.cast(array, pa.string())
+        offsets = np.frombuffer(array.buffers()[1], dtype=np.int32)[
+            array.offset : array.offset + len(array) + 1
+        ].astype(np.int64)
+        data = np.frombuffer(array.buffers()[2] or b"", dtype=np.uint8)
+        lengths = np.where(valid, np.diff(offsets), -1).astype(np.int32)
+        return lengths, data, offsets[:-1][valid]
+    raise TypeError(f"Binary COPY does not support Postgres type {pg_type!r}")
+
+
+def float_text(array: pa.Array | pa.ChunkedArray) -> pa.Array | pa.ChunkedArray:
+    """
+    Render float values as text the same way on every load path, binary COPY
+    and CSV alike: integral values through int64 ("1", not "1.0"), the
+    others in the shortest form that reads back as the same float
+    Args:
+        array (pa.Array | pa.ChunkedArray): float values
+
+    Returns:
+        pa.Array | pa.ChunkedArray: string values, NULL where array is NULL
+    """
+    integral = pc.and_(
+        pc.equal(pc.floor(array), array), pc.less(pc.abs(array), 2.0**63)
+    )
+    integers = pc.cast(pc.if_else(integral, array, 0.0), pa.int64())
+    return pc.if_else(
+        integral, pc.cast(integers, pa.string()), pc.cast(array, pa.string())
+    )
+
+
+def render_floats(table: pa.Table) -> pa.Table:
+    """
+    Replace the float columns of a table with their float_text rendering
+    """
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            table = table.set_column(i, field.name, float_text(table.column(i)))
+    return table
+
+
+def _uuid_bytes(array: pa.Array, valid: np.ndarray) -> np.ndarray:
+    """
+    Parse canonical UUID strings (or pass 16-byte binaries) into a (n, 16) matrix
+    """
+    if pa.types.is_fixed_size_binary(array.type) and array.type.byte_width == 16:
+        data = np.frombuffer(array.buffers()[1], dtype=np.uint8)
+        return data.reshape(-1, 16)[array.offset : array.offset + len(array)][valid]
+    array = pc.cast(array, pa.string())
+    offsets = np.frombuffer(array.buffers()[1], dtype=np.int32)[
+        array.offset : array.offset + len(array) + 1
+    ]
+    if np.any(np.diff(offsets)[valid] != 36):
+        raise ValueError("uuid columns must hold 36 character canonical UUIDs")
+    data = np.frombuffer(array.buffers()[2] or b"", dtype=np.uint8)
+    text = data[offsets[:-1][valid, None] + np.arange(36)]
+    digits = HEX_VALUES[np.delete(text, [8, 13, 18, 23], axis=1)]
+    if np.any(digits == 255) or np.any(text[:, [8, 13, 18, 23]] != ord("-")):
+        raise ValueError("uuid columns must hold 36 character canonical UUIDs")
+    return (digits[:, 0::2] << 4) | digits[:, 1::2]
+
+
+def _scatter_fixed(out: np.ndarray, starts: np.ndarray, values: np.ndarray):
+    """
+    Write row i of the (n, width) values matrix at out[starts[i]:starts[i] + width]
+    """
+    out[starts[:, None] + np.arange(values.shape[1])] = values
+
+
+def _scatter_variable(
+    out: np.ndarray,
+    starts: np.ndarray,
+    data: np.ndarray,
+    offsets: np.ndarray,
+    lengths: np.ndarray,
+):
+    """
+    Copy data[offsets[i]:offsets[i] + lengths[i]] to out[starts[i]:] for every i
+    """
+    total = int(lengths.sum())
+    if not total:
+        return
+    value_starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=value_starts[1:])
+    shift = np.repeat(starts - value_starts, lengths)
+    source_shift = np.repeat(offsets - value_starts, lengths)
+    index = np.arange(total, dtype=np.int64)
+    out[index + shift] = data[index + source_shift]
@@ -2,11 +2,57 @@
 ETL pipeline for mock data
 """
 
+import argparse
 import logging
 import os
+from functools import partial
 
 import s3fs
+import metrics
+from config import create_postgress_config
 from ETL import Pipeline
+from layout import ParquetLayout
+from scheduler import DAGFailedError, Task, run_dag
+
+BUCKET = "landing-zone"
+# tables whose Postgres load has to finish before the load of the key table,
+# e.g. because of foreign keys
+TABLE_DEPENDENCIES = {"loans": ["customers"]}
+# primary keys or unique constraints the Postgres loads upsert on, loans is
+# partitioned on start_date so its constraint includes it
+KEY_COLUMNS = {"customers": ["customer_id"], "loans": ["loan_id", "start_date"]}
+# columns whose high-water mark bounds incremental loads of rewritten files
+WATERMARK_COLUMNS = {"loans": "start_date"}
+# S3 layouts used with --partitioned
+PARTITIONED_LAYOUTS = {
+    "customers": ParquetLayout(
+        partition_cols=["country"], row_group_size=1_000_000, compression="zstd"
+    ),
+    "loans": ParquetLayout(
+        partition_cols=["start_month", "loan_grade"],
+        month_partitions={"start_month": "start_date"},
+        row_group_size=1_000_000,
+        compression="zstd",
+    ),
+}
+
+
+def create_fs() -> s3fs.S3FileSystem:
+    """
+    Create the MinIO client of the landing zone from the environment
+    Returns:
+        s3fs.S3FileSystem: s3 file system client
+    """
+    return s3fs.S3FileSystem(
+        anon=False,
+        use_ssl=False,
+        client_kwargs={
+            "endpoint_url": os.environ["MINIO_ENDPOINT"],
+            "aws_access_key_id": os.environ["MINIO_ROOT_USER"],
+            "aws_secret_access_key": os.environ["MINIO_ROOT_PASSWORD"],
+            "verify": False,
+        },
+    )
 
 
 def create_pipeline(
@@ -15,6 +61,8 @@ def create_pipeline(
     bucket: str,
     fs: s3fs.S3FileSystem,
     postgress_config: dict,
+    pipeline: Pipeline | None = None,
+    tee: bool = False,
 ):
     """
     Create ETL pipeline for mock data from local to S3 and S3 to Postgres
@@ -24,9 +72,24 @@ def create_pipeline(
         bucket (str): s3 bucket name
         fs (s3fs.S3FileSystem): s3 file system client
         postgress_config (dict): postgres connection configuration
+        pipeline (Pipeline, optional): pipeline whose connection pool is
+            reused, a new one if not set
+        tee (bool): read the local data once and write it to S3 and Postgres
+            at the same time instead of loading Postgres back from S3
     """
-    pipeline = Pipeline()
+    pipeline = pipeline or Pipeline()
     try:
+        if tee:
+            pipeline.tee_transfer(
+                local_path=f"{local_data_dir}/{table_name}.parquet",
+                fs_path=f"s3://{bucket}/{table_name}",
+                fs=fs,
+                config=postgress_config,
+                table_name=table_name,
+                key_columns=KEY_COLUMNS.get(table_name),
+            )
+            logging.info("ETL pipeline completed for table: %s", table_name)
+            return
         pipeline.local_to_fs_transfer(
             local_path=f"{local_data_dir}/{table_name}.parquet",
             fs_path=f"s3://{bucket}/{table_name}",
@@ -37,52 +100,383 @@ def create_pipeline(
             fs=fs,
             config=postgress_config,
             table_name=table_name,
+            key_columns=KEY_COLUMNS.get(table_name),
         )
         logging.info("ETL pipeline completed for table: %s", table_name)
     except Exception as e:  # pylint: disable=broad-except
         logging.error("Error in ETL pipeline for table %s: %s", table_name, str(e))
+        raise
 
 
-def main():
+def create_pipeline_tasks(
+    table_name: str,
+    local_data_dir: str,
+    bucket: str,
+    fs: s3fs.S3FileSystem,
+    postgress_config: dict,
+    pipeline: Pipeline,
+    load_after: list[str] | None = None,
+    incremental: bool = False,
+    layout: ParquetLayout | None = None,
+    tee: bool = False,
+    full_reload: bool = False,
+    parallelism: int = 1,
+) -> list[Task]:
+    """
+    Create the local to S3 and S3 to Postgres stages of a table as DAG tasks
+    Args:
+        table_name (str): name of the table
+        local_data_dir (str): local directory path
+        bucket (str): s3 bucket name
+        fs (s3fs.S3FileSystem): s3 file system client
+        postgress_config (dict): postgres connection configuration
+        pipeline (Pipeline): pipeline shared by the tasks
+        load_after (list[str], optional): tables that must be loaded into
+            Postgres before this one
+        incremental (bool): upload and load only the data not ingested yet,
+            as a single load:<table> task
+        layout (ParquetLayout, optional): layout of the S3 dataset
+        tee (bool): read the local data once and write it to S3 and Postgres
+            at the same time, as a single load:<table> task
+        full_reload (bool): replace the Postgres rows of the table instead of
+            upserting, rebuilding its secondary indexes and constraints once
+        parallelism (int): connections the S3 to Postgres load is spread
+            over, by partition for partitioned tables
+    Returns:
+        list[Task]: upload:<table> and load:<table> tasks
+    """
+    if incremental:
+        return [
+            Task(
+                name=f"load:{table_name}",
+                func=partial(
+                    pipeline.incremental_transfer,
+                    local_path=f"{local_data_dir}/{table_name}.parquet",
+                    fs_path=f"s3://{bucket}/{table_name}",
+                    fs=fs,
+                    config=postgress_config,
+                    table_name=table_name,
+                    manifest_path=f"s3://{bucket}/_manifests/{table_name}.json",
+                    watermark_column=WATERMARK_COLUMNS.get(table_name),
+                    layout=layout,
+                    key_columns=KEY_COLUMNS.get(table_name),
+                ),
+                depends_on=tuple(f"load:{t}" for t in load_after or []),
+            )
+        ]
+    if tee:
+        return [
+            Task(
+                name=f"load:{table_name}",
+                func=partial(
+                    pipeline.tee_transfer,
+                    local_path=f"{local_data_dir}/{table_name}.parquet",
+                    fs_path=f"s3://{bucket}/{table_name}",
+                    fs=fs,
+                    config=postgress_config,
+                    table_name=table_name,
+                    layout=layout,
+                    key_columns=KEY_COLUMNS.get(table_name),
+                    full_reload=full_reload,
+                ),
+                depends_on=tuple(f"load:{t}" for t in load_after or []),
+            )
+        ]
+    upload = Task(
+        name=f"upload:{table_name}",
+        func=partial(
+            pipeline.local_to_fs_transfer,
+            local_path=f"{local_data_dir}/{table_name}.parquet",
+            fs_path=f"s3://{bucket}/{table_name}",
+            fs=fs,
+            layout=layout,
+        ),
+    )
+    load = Task(
+        name=f"load:{table_name}",
+        func=partial(
+            pipeline.fs_to_postgres_transfer,
+            path=f"s3://{bucket}/{table_name}",
+            fs=fs,
+            config=postgress_config,
+            table_name=table_name,
+            layout=layout,
+            key_columns=KEY_COLUMNS.get(table_name),
+            full_reload=full_reload,
+            parallelism=parallelism,
+        ),
+        depends_on=(upload.name, *[f"load:{t}" for t in load_after or []]),
+    )
+    return [upload, load]
+
+
+def main(
+    incremental: bool = False,
+    partitioned: bool = False,
+    tee: bool = False,
+    arrow_native: bool = False,
+    metrics_dir: str | None = None,
+    full_reload: bool = False,
+    parallelism: int = 1,
+    features: bool = False,
+    score_model: str | None = None,
+    segment: bool = False,
+    segment_columns: list[str] | None = None,
+    profile: bool = False,
+    cache_dir: str | None = None,
+    fs: s3fs.S3FileSystem | None = None,
+    postgress_config: dict | None = None,
+):
     """
     Generate mock data for customer and loans tables and write to S3
+    Args:
+        incremental (bool): only ingest data that earlier runs did not
+        partitioned (bool): write the S3 datasets with PARTITIONED_LAYOUTS
+        tee (bool): write each table to S3 and Postgres in a single read
+        arrow_native (bool): keep the data in Arrow instead of pandas
+        metrics_dir (str, optional): directory the JSON run report and the
+            Prometheus textfile of the stage metrics are written to
+        full_reload (bool): replace the Postgres tables instead of upserting
+        parallelism (int): connections each S3 to Postgres load is spread over
+        features (bool): refresh the loan feature table once the tables landed
+        score_model (str, optional): joblib model file every loan is scored
+            with once the tables landed
+        segment (bool): segment the customers once the tables landed
+        segment_columns (list[str], optional): customer columns the segments
+            are fitted on, segmentation.SEGMENT_FEATURES if not set
+        profile (bool): profile the columns of the tables on their way to S3
+            into a _profile.json sidecar of every dataset
+        cache_dir (str, optional): local directory the S3 part files are
+            cached in between runs
+        fs (s3fs.S3FileSystem, optional): s3 file system client, created
+            from the environment if not set
+        postgress_config (dict, optional): postgres connection configuration,
+            read from the environment if not set
     """
     # declare configurations
     home = os.environ["HOME"]
     local_data_dir = f"{home}/work/data"
-    bucket = "landing-zone"
+    bucket = BUCKET
     table_names = ["customers", "loans"]
-    fs = s3fs.S3FileSystem(
-        anon=False,
-        use_ssl=False,
-        client_kwargs={
-            "endpoint_url": os.environ["MINIO_ENDPOINT"],
-            "aws_access_key_id": os.environ["MINIO_ROOT_USER"],
-            "aws_secret_access_key": os.environ["MINIO_ROOT_PASSWORD"],
-            "verify": False,
-        },
-    )
-    postgress_config = {
-        "database": os.environ["POSTGRES_DATABASE"],
-        "user": os.environ["POSTGRES_USER"],
-        "password": os.environ["POSTGRES_PASSWORD"],
-        "host": os.environ["POSTGRES_HOST"],
-        "port": os.environ["POSTGRES_PORT"],
-    }
+    fs = fs or create_fs()
+    postgress_config = postgress_config or create_postgress_config()
 
     for table_name in table_names:
         if not os.path.exists(f"{local_data_dir}/{table_name}.parquet"):
             raise FileNotFoundError(
                 f"File {local_data_dir}/{table_name}.parquet not found"
             )
-        else:
-            create_pipeline(
+
+    with Pipeline(
+        max_connections=max(parallelism, 4),
+        arrow_native=arrow_native,
+        profile=profile,
+        cache_dir=cache_dir,
+    ) as pipeline:
+        tasks = [
+            task
+            for table_name in table_names
+            for task in create_pipeline_tasks(
                 table_name=table_name,
                 local_data_dir=local_data_dir,
                 bucket=bucket,
                 fs=fs,
                 postgress_config=postgress_config,
+                pipeline=pipeline,
+                load_after=[
+                    t for t in TABLE_DEPENDENCIES.get(table_name, []) if t in table_names
+                ],
+                incremental=incremental,
+                layout=PARTITIONED_LAYOUTS.get(table_name) if partitioned else None,
+                tee=tee,
+                full_reload=full_reload,
+                parallelism=parallelism,
+            )
+        ]
+        # the optional stages import sklearn and joblib, only when enabled
+        # pylint: disable=import-outside-toplevel
+        if features:
+            from features import materialize_features
+
+            tasks.append(
+                Task(
+                    name="features:loans",
+                    func=partial(
+                        materialize_features,
+                        pipeline=pipeline,
+                        fs=fs,
+                        loans_path=f"s3://{bucket}/loans",
+                        customers_path=f"s3://{bucket}/customers",
+                        features_path=f"s3://{bucket}/features/loans",
+                        loans_layout=PARTITIONED_LAYOUTS["loans"]
+                        if partitioned
+                        else None,
+                        customers_layout=PARTITIONED_LAYOUTS["customers"]
+                        if partitioned
+                        else None,
+                    ),
+                    depends_on=tuple(task.name for task in tasks),
+                )
+            )
+        if score_model:
+            from scoring import score_loans
+
+            tasks.append(
+                Task(
+                    name="score:loans",
+                    func=partial(
+                        score_loans,
+                        pipeline=pipeline,
+                        fs=fs,
+                        loans_path=f"s3://{bucket}/loans",
+                        customers_path=f"s3://{bucket}/customers",
+                        model_path=score_model,
+                        config=postgress_config,
+                        loans_layout=PARTITIONED_LAYOUTS["loans"]
+                        if partitioned
+                        else None,
+                        customers_layout=PARTITIONED_LAYOUTS["customers"]
+                        if partitioned
+                        else None,
+                    ),
+                    depends_on=tuple(
+                        task.name
+                        for task in tasks
+                        if task.name.split(":")[0] in ("upload", "load")
+                    ),
+                )
+            )
+        if segment:
+            from segmentation import segment_customers
+
+            tasks.append(
+                Task(
+                    name="segment:customers",
+                    func=partial(
+                        segment_customers,
+                        pipeline=pipeline,
+                        fs=fs,
+                        path=f"s3://{bucket}/customers",
+                        output_path=f"s3://{bucket}/customer_segments",
+                        labels_path=f"{local_data_dir}/customer_clusters.parquet",
+                        columns=segment_columns,
+                        layout=PARTITIONED_LAYOUTS["customers"]
+                        if partitioned
+                        else None,
+                    ),
+                    depends_on=tuple(
+                        task.name
+                        for task in tasks
+                        if task.name.split(":")[0] in ("upload", "load")
+                    ),
+                )
             )
+        results = run_dag(tasks, max_workers=len(tasks), raise_on_failure=False)
+
+    if metrics_dir:
+        metrics.RECORDER.export(metrics_dir, name="pipeline")
+
+    for result in results.values():
+        logging.info("%s: %s (%.2fs)", result.name, result.status, result.seconds)
+    if any(result.status == "failed" for result in results.values()):
+        raise DAGFailedError(results)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """
+    Parse command line arguments
+    Args:
+        argv (list[str], optional): arguments, sys.argv[1:] if not set
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--incremental",
+        action="store_true",
+        help="upload and load only new part files and rows above the watermark",
+    )
+    mode.add_argument(
+        "--tee",
+        action="store_true",
+        help="read local data once and stream it to S3 and Postgres together",
+    )
+    parser.add_argument(
+        "--full-reload",
+        action="store_true",
+        help="replace the Postgres tables, rebuilding their indexes after the load",
+    )
+    parser.add_argument(
+        "--arrow-native",
+        action="store_true",
+        help="move the data as Arrow tables and binary COPY instead of pandas",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.environ.get("ETL_METRICS_DIR"),
+        help="write a JSON run report and a Prometheus textfile of the stages",
+    )
+    parser.add_argument(
+        "--partitioned",
+        action="store_true",
+        help="partition the S3 datasets, e.g. loans by start month and grade",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=1,
+        help="connections per Postgres load, loans is loaded partition-wise",
+    )
+    parser.add_argument(
+        "--features",
+        action="store_true",
+        help="refresh the loan feature table of the credit-risk notebooks",
+    )
+    parser.add_argument(
+        "--score-model",
+        help="joblib credit-risk model to score every loan with into loan_scores",
+    )
+    parser.add_argument(
+        "--segment",
+        action="store_true",
+        help="segment the customers out of core into customer_segments",
+    )
+    parser.add_argument(
+        "--segment-columns",
+        type=lambda value: value.split(","),
+        help="comma separated customer columns to segment on, e.g. income to "
+        "validate against the labels of setup/generate_mock_data_1.py",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="profile the columns while uploading, cached next to each dataset",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=os.environ.get("ETL_CACHE_DIR"),
+        help="cache the S3 part files read by the loads in this local directory",
+    )
+    args = parser.parse_args(argv)
+    if args.incremental and args.full_reload:
+        parser.error("--full-reload cannot be combined with --incremental")
+    return args
+
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    main(
+        incremental=args.incremental,
+        partitioned=args.partitioned,
+        tee=args.tee,
+        arrow_native=args.arrow_native,
+        metrics_dir=args.metrics_dir,
+        full_reload=args.full_reload,
+        parallelism=args.parallelism,
+        features=args.features,
+        score_model=args.score_model,
+        segment=args.segment,
+        segment_columns=args.segment_columns,
+        profile=args.profile,
+        cache_dir=args.cache_dir,
+    )
@@ -0,0 +1,442 @@
+"""
+Single-pass column profiles of the datasets, computed with Arrow compute while
+record batches stream through the pipeline and cached as a sidecar file next
+to the dataset
+"""
+
+import json
+import logging
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import s3fs
+from pyarrow import compute as pc
+
+PROFILE_FILE = "_profile.json"
+QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+DESCRIBE_COLUMNS = [
+    "type",
+    "count",
+    "null_count",
+    "null_fraction",
+    "mean",
+    "std",
+    "min",
+]
+
+
+@dataclass
+class ColumnProfile:
+    """
+    Mergeable statistics of one column
+    Args:
+        name (str): column name
+        type (str): Arrow type of the column
+        kind (str): "numeric", "temporal", "string" or "other"
+        count (int): rows seen
+        null_count (int): NULL rows seen
+        min (float | str | None): smallest value, ISO text for temporal columns
+        max (float | str | None): largest value, ISO text for temporal columns
+        sum (float): sum of the values of a numeric column
+        sum_squares (float): sum of the squared values of a numeric column
+        sample (list[float]): uniform reservoir sample of the values of a
+            numeric column, the approximate quantiles are computed from it
+        counts (dict[str, int]): approximate counts of the most frequent
+            values of a string column
+        high_cardinality (bool): the string column has too many distinct
+            values for top-k counts to be meaningful, they are not kept
+    """
+
+    name: str
+    type: str
+    kind: str
+    count: int = 0
+    null_count: int = 0
+    min: float | str | None = None
+    max: float | str | None = None
+    sum: float = 0.0
+    sum_squares: float = 0.0
+    sample: list[float] = field(default_factory=list)
+    counts: dict[str, int] = field(default_factory=dict)
+    high_cardinality: bool = False
+
+    def summary(self, top_k: int) -> dict:
+        """
+        describe() like statistics of the column
+        Args:
+            top_k (int): most frequent values reported
+        Returns:
+            dict: counts, null fraction, min/max and, depending on the kind,
+                mean, std and quantiles or the top values
+        """
+        valid = self.count - self.null_count
+        summary = {
+            "type": self.type,
+            "count": self.count,
+            "null_count": self.null_count,
+            "null_fraction": self.null_count / self.count if self.count else 0.0,
+            "min": self.min,
+            "max": self.max,
+        }
+        if self.kind == "numeric" and valid:
+            mean = self.sum / valid
+            summary["mean"] = mean
+            summary["std"] = (
+                float(np.sqrt(max(self.sum_squares - valid * mean**2, 0) / (valid - 1)))
+                if valid > 1
+                else 0.0
+            )
+            summary["quantiles"] = {
+                str(q): float(value)
+                for q, value in zip(QUANTILES, np.quantile(self.sample, QUANTILES))
+            }
+        if self.kind == "string" and not self.high_cardinality:
+            top = sorted(self.counts.items(), key=lambda item: -item[1])[:top_k]
+            summary["top_k"] = [[value, count] for value, count in top]
+        return summary
+
+
+class Profiler:
+    """
+    Profile of the columns of a stream of record batches. Numeric columns get
+    exact null counts, min/max, mean and std and approximate quantiles from a
+    fixed size reservoir sample; string columns get approximate top-k counts
+    kept within a bounded number of candidates, except the mostly unique ones
+    (ids, names, addresses) which are only counted. Profiles of different
+    streams, e.g. the appends of an incremental load, can be merged.
+    """
+
+    def __init__(
+        self,
+        sample_size: int = 4096,
+        top_k: int = 10,
+        max_candidates: int = 1024,
+        max_distinct_ratio: float = 0.5,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            sample_size (int): reservoir size of every numeric column
+            top_k (int): most frequent values reported per string column
+            max_candidates (int): distinct values tracked per string column
+            max_distinct_ratio (float): share of distinct values in a batch of
+                at least max_candidates values above which a string column
+                is high cardinality and its top-k counts are dropped
+            seed (int): seed of the reservoir sampling
+        """
+        self.sample_size = sample_size
+        self.top_k = top_k
+        self.max_candidates = max_candidates
+        self.max_distinct_ratio = max_distinct_ratio
+        self.columns: dict[str, ColumnProfile] = {}
+        self.rows = 0
+        self._rng = np.random.default_rng(seed)
+        # non-NULL values offered to the reservoir of every numeric column
+        self._seen: dict[str, int] = {}
+
+    def observe(self, batches: Iterable[pa.RecordBatch]) -> Iterator[pa.RecordBatch]:
+        """
+        Profile batches on their way to a consumer
+        Args:
+            batches (Iterable[pa.RecordBatch]): batches to profile
+        Yields:
+            pa.RecordBatch: the same batches, unchanged
+        """
+        for batch in batches:
+            self.update(batch)
+            yield batch
+
+    def update(self, data: pa.RecordBatch | pa.Table):
+        """
+        Add the rows of a batch or table to the profile
+        Args:
+            data (pa.RecordBatch | pa.Table): rows to profile
+        """
+        self.rows += data.num_rows
+        for name, array in zip(data.schema.names, data.columns):
+            if pa.types.is_dictionary(array.type):
+                array = pc.cast(array, array.type.value_type)
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = ColumnProfile(
+                    name=name, type=str(array.type), kind=_kind(array.type)
+                )
+            self._update_column(column, array)
+
+    def _update_column(self, column: ColumnProfile, array: pa.Array):
+        column.count += len(array)
+        column.null_count += array.null_count
+        if array.null_count == len(array) or column.kind == "other":
+            return
+        if column.kind == "string":
+            if column.high_cardinality:
+                return
+            values = pc.drop_null(array)
+            counts = pc.value_counts(values)
+            if (
+                len(values) >= self.max_candidates
+                and len(counts) > self.max_distinct_ratio * len(values)
+            ):
+                column.high_cardinality = True
+                column.counts = {}
+                return
+            if len(counts) > self.max_candidates:
+                # only the most frequent values of the batch can make the
+                # candidates, pick them in Arrow rather than in Python
+                counts = counts.take(
+                    pc.select_k_unstable(
+                        counts.field("counts"),
+                        self.max_candidates,
+                        sort_keys=[("counts", "descending")],
+                    )
+                )
+            for value, count in zip(
+                counts.field("values").to_pylist(), counts.field("counts").to_pylist()
+            ):
+                column.counts[value] = column.counts.get(value, 0) + count
+            if len(column.counts) > self.max_candidates:
+                column.counts = dict(
+                    sorted(column.counts.items(), key=lambda item: -item[1])[
+                        : self.max_candidates // 2
+                    ]
+                )
+            return
+        bounds = pc.min_max(array)
+        low, high = bounds["min"].as_py(), bounds["max"].as_py()
+        if column.kind == "temporal":
+            low, high = low.isoformat(), high.isoformat()
+        else:
+            low, high = float(low), float(high)
+        column.min = low if column.min is None else min(column.min, low)
+        column.max = high if column.max is None else max(column.max, high)
+        if column.kind != "numeric":
+            return
+        values = pc.cast(pc.drop_null(array), pa.float64())
+        column.sum += pc.sum(values).as_py()
+        column.sum_squares += pc.sum(pc.multiply(values, values)).as_py()
+        self._reservoir(column, values.to_numpy(zero_copy_only=False))
+
+    def _reservoir(self, column: ColumnProfile, values: np.ndarray):
+        """
+        Offer values to the reservoir sample of a column (algorithm R)
+        """
+        seen = self._seen.get(column.name, 0)
+        sample = column.sample
+        free = max(self.sample_size - len(sample), 0)
+        sample.extend(values[:free].tolist())
+        rest = values[free:]
+        if len(rest):
+            position = seen + free + np.arange(len(rest))
+            slots = self._rng.integers(0, position + 1)
+            taken = slots < self.sample_size
+            for slot, value in zip(slots[taken], rest[taken]):
+                sample[slot] = float(value)
+        self._seen[column.name] = seen + len(values)
+
+    def merge(self, other: "Profiler"):
+        """
+        Add the profile of another stream to this one
+        Args:
+            other (Profiler): profile to merge in
+        """
+        self.rows += other.rows
+        for name, theirs in other.columns.items():
+            ours = self.columns.get(name)
+            if ours is None:
+                self.columns[name] = theirs
+                self._seen[name] = other._seen.get(name, 0)
+                continue
+            seen = self._seen.get(name, 0), other._seen.get(name, 0)
+            ours.count += theirs.count
+            ours.null_count += theirs.null_count
+            for bound, pick in (("min", min), ("max", max)):
+                values = [
+                    value
+                    for value in (getattr(ours, bound), getattr(theirs, bound))
+                    if value is not None
+                ]
+                setattr(ours, bound, pick(values) if values else None)
+            ours.sum += theirs.sum
+            ours.sum_squares += theirs.sum_squares
+            ours.high_cardinality = ours.high_cardinality or theirs.high_cardinality
+            if ours.high_cardinality:
+                ours.counts = {}
+            else:
+                for value, count in theirs.counts.items():
+                    ours.counts[value] = ours.counts.get(value, 0) + count
+            ours.sample = self._merge_samples(
+                ours.sample, seen[0], theirs.sample, seen[1]
+            )
+            self._seen[name] = sum(seen)
+
+    def _merge_samples(
+        self, left: list[float], left_seen: int, right: list[float], right_seen: int
+    ) -> list[float]:
+        """
+        Reservoir sample of the union of two streams, from their samples: the
+        number of values taken from each side is drawn as from the union of
+        the streams, the values uniformly from each sample
+        """
+        if len(left) + len(right) <= self.sample_size:
+            return left + right
+        from_left = self._rng.hypergeometric(left_seen, right_seen, self.sample_size)
+        from_left = min(max(from_left, self.sample_size - len(right)), len(left))
+        picked = [
+            self._rng.choice(side, size=size, replace=False)
+            for side, size in ((left, from_left), (right, self.sample_size - from_left))
+        ]
+        return np.concatenate(picked).tolist()
+
+    def to_dict(self) -> dict:
+        """
+        Profile and the state needed to merge more data into it later
+        """
+        return {
+            "rows": self.rows,
+            "sample_size": self.sample_size,
+            "top_k": self.top_k,
+            "max_candidates": self.max_candidates,
+            "max_distinct_ratio": self.max_distinct_ratio,
+            "columns": {
+                name: column.summary(self.top_k)
+                for name, column in self.columns.items()
+            },
+            "state": {
+                name: {**asdict(column), "seen": self._seen.get(name, 0)}
+                for name, column in self.columns.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, profile: dict) -> "Profiler":
+        """
+        Restore a profiler from to_dict output
+        """
+        profiler = cls(
+            sample_size=profile["sample_size"],
+            top_k=profile["top_k"],
+            max_candidates=profile["max_candidates"],
+            max_distinct_ratio=profile.get("max_distinct_ratio", 0.5),
+        )
+        profiler.rows = profile["rows"]
+        for name, state in profile["state"].items():
+            state = dict(state)
+            profiler._seen[name] = state.pop("seen")
+            profiler.columns[name] = ColumnProfile(**state)
+        return profiler
+
+
+def profile_path(dataset_path: str) -> str:
+    """
+    Path of the profile sidecar of a dataset
+    """
+    return f"{dataset_path.rstrip('/')}/{PROFILE_FILE}"
+
+
+def write_profile(
+    profiler: Profiler,
+    dataset_path: str,
+    fs: s3fs.S3FileSystem,
+    source: str | None = None,
+) -> dict:
+    """
+    Merge a profile into the sidecar of a dataset the profiled rows were
+    appended to, creating it if needed
+    Args:
+        profiler (Profiler): profile of the appended rows
+        dataset_path (str): fs path of the dataset
+        fs (s3fs.S3FileSystem): file system client
+        source (str, optional): name of the appended part files; a sidecar
+            that already counts this source is left unchanged, so that a
+            retried append is not profiled twice
+    Returns:
+        dict: the stored profile
+    """
+    path = profile_path(dataset_path)
+    sources = []
+    appended = profiler.rows
+    if fs.exists(path):
+        with fs.open(path, "r") as f:
+            stored = json.load(f)
+        sources = stored.get("sources", [])
+        if source is not None and source in sources:
+            return stored
+        merged = Profiler.from_dict(stored)
+        merged.merge(profiler)
+        profiler = merged
+    profile = {
+        "dataset": dataset_path,
+        "updated_at": datetime.now().isoformat(),
+        "sources": sources + ([source] if source is not None else []),
+        **profiler.to_dict(),
+    }
+    with fs.open(path, "w") as f:
+        json.dump(profile, f)
+    logging.info(
+        "Profiled %d rows of %s (%d in total)", appended, dataset_path, profile["rows"]
+    )
+    return profile
+
+
+def read_profile(dataset_path: str, fs: s3fs.S3FileSystem) -> dict | None:
+    """
+    Read the cached profile of a dataset
+    Args:
+        dataset_path (str): fs path of the dataset
+        fs (s3fs.S3FileSystem): file system client
+    Returns:
+        dict | None: profile, None if the dataset has none
+    """
+    path = profile_path(dataset_path)
+    if not fs.exists(path):
+        return None
+    with fs.open(path, "r") as f:
+        return json.load(f)
+
+
+def describe(profile: dict) -> pd.DataFrame:
+    """
+    Cached profile as a describe() like frame, one row per column, for EDA
+    without rescanning the dataset
+    Args:
+        profile (dict): profile returned by read_profile
+    Returns:
+        pd.DataFrame: count, nulls, mean, std, min, quantiles, max and top
+            value of every column
+    """
+    rows = {}
+    for name, column in profile["columns"].items():
+        row = {key: column.get(key) for key in DESCRIBE_COLUMNS}
+        row.update(
+            {
+                f"{float(q):.0%}": value
+                for q, value in column.get("quantiles", {}).items()
+            }
+        )
+        row["max"] = column.get("max")
+        if column.get("top_k"):
+            row["top"], row["freq"] = column["top_k"][0]
+        rows[name] = row
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def _kind(type_: pa.DataType) -> str:
+    """
+    Statistics family of an Arrow type
+    """
+    if (
+        pa.types.is_integer(type_)
+        or pa.types.is_floating(type_)
+        or pa.types.is_boolean(type_)
+        or pa.types.is_decimal(type_)
+    ):
+        return "numeric"
+    if pa.types.is_temporal(type_):
+        return "temporal"
+    if pa.types.is_string(type_) or pa.types.is_large_string(type_):
+        return "string"
+    return "other"
@@ -0,0 +1,148 @@
+"""
+Small DAG scheduler running independent ETL stages concurrently
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+
+@dataclass
+class Task:
+    """
+    Unit of work of a DAG
+    Args:
+        name (str): unique task name
+        func (Callable[[], Any]): work to run
+        depends_on (tuple[str, ...]): names of the tasks that must succeed first
+    """
+
+    name: str
+    func: Callable[[], Any]
+    depends_on: tuple[str, ...] = field(default_factory=tuple)
+
+
+@dataclass
+class TaskResult:
+    """
+    Outcome of a task
+    Args:
+        name (str): task name
+        status (str): "succeeded", "failed" or "skipped" when a dependency
+            did not succeed
+        seconds (float): wall time of the task
+        result (Any): return value of the task
+        error (BaseException | None): exception raised by the task
+    """
+
+    name: str
+    status: str
+    seconds: float = 0.0
+    result: Any = None
+    error: BaseException | None = None
+
+
+class DAGFailedError(RuntimeError):
+    """
+    Raised when at least one task of a DAG failed
+    """
+
+    def __init__(self, results: dict[str, TaskResult]) -> None:
+        self.results = results
+        failed = [r.name for r in results.values() if r.status == "failed"]
+        super().__init__(f"Tasks failed: {', '.join(failed)}")
+
+
+def run_dag(
+    tasks: list[Task], max_workers: int = 4, raise_on_failure: bool = True
+) -> dict[str, TaskResult]:
+    """
+    Run tasks on a thread pool as soon as their dependencies succeeded.
+    Tasks depending on a failed task are skipped, independent ones keep
+    running.
+    Args:
+        tasks (list[Task]): tasks of the DAG
+        max_workers (int): maximum number of tasks running at once
+        raise_on_failure (bool): raise DAGFailedError once every runnable
+            task finished if any task failed
+    Returns:
+        dict[str, TaskResult]: result of every task, in task order
+    """
+    by_name = {task.name: task for task in tasks}
+    _validate(by_name)
+    results: dict[str, TaskResult] = {}
+    running: dict[Future, tuple[Task, float]] = {}
+    started: set[str] = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(results) < len(by_name):
+            for task in by_name.values():
+                if task.name in started:
+                    continue
+                statuses = [
+                    results[d].status if d in results else None
+                    for d in task.depends_on
+                ]
+                if any(status in ("failed", "skipped") for status in statuses):
+                    started.add(task.name)
+                    results[task.name] = TaskResult(name=task.name, status="skipped")
+                    logging.warning(
+                        "Skipping task %s: a dependency did not succeed", task.name
+                    )
+                elif all(status == "succeeded" for status in statuses):
+                    started.add(task.name)
+                    running[executor.submit(task.func)] = (task, time.perf_counter())
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task, start = running.pop(future)
+                seconds = time.perf_counter() - start
+                error = future.exception()
+                if error is None:
+                    results[task.name] = TaskResult(
+                        name=task.name,
+                        status="succeeded",
+                        seconds=seconds,
+                        result=future.result(),
+                    )
+                    logging.info("Task %s succeeded in %.2fs", task.name, seconds)
+                else:
+                    results[task.name] = TaskResult(
+                        name=task.name, status="failed", seconds=seconds, error=error
+                    )
+                    logging.error(
+                        "Task %s failed after %.2fs: %s", task.name, seconds, error
+                    )
+
+    results = {name: results[name] for name in by_name}
+    if raise_on_failure and any(r.status == "failed" for r in results.values()):
+        raise DAGFailedError(results)
+    return results
+
+
+def _validate(tasks: dict[str, Task]):
+    """
+    Check that dependencies exist and do not form a cycle
+    """
+    for task in tasks.values():
+        unknown = [d for d in task.depends_on if d not in tasks]
+        if unknown:
+            raise ValueError(f"Task {task.name} depends on unknown tasks {unknown}")
+    visiting, visited = set(), set()
+
+    def visit(name: str):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through task {name}")
+        visiting.add(name)
+        for dependency in tasks[name].depends_on:
+            visit(dependency)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in tasks:
+        visit(name)
@@ -0,0 +1,259 @@
+"""
+Batch scoring of the loans of the landing zone with a serialized credit-risk
+model, written back to Postgres
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator
+
+import joblib
+import numpy as np
+import pyarrow as pa
+import s3fs
+
+import metrics
+from ETL import Pipeline, combine_batches
+from features import (
+    CUSTOMER_COLUMNS,
+    LOAN_COLUMNS,
+    compute_features,
+    prepare_customers,
+)
+from layout import ParquetLayout
+
+SCORES_TABLE = "loan_scores"
+# feature columns that identify a loan or are its label rather than inputs
+NON_FEATURE_COLUMNS = ["loan_id", "customer_id", "start_date", "loan_status"]
+
+# state of a scoring worker process, set by _init_worker
+_MODEL = None
+_COLUMNS: list[str] | None = None
+_CUSTOMERS: pa.Table | None = None
+
+
+@dataclass
+class WorkerStats:
+    """
+    Throughput of one scoring worker process
+    Args:
+        pid (int): worker process id
+        chunks (int): chunks scored
+        rows (int): loans scored
+        seconds (float): time spent computing features and scoring
+    """
+
+    pid: int
+    chunks: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        """
+        Loans scored per second of work
+        """
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+@metrics.instrument()
+def score_loans(
+    pipeline: Pipeline,
+    fs: s3fs.S3FileSystem,
+    loans_path: str,
+    customers_path: str,
+    model_path: str,
+    config: dict,
+    table_name: str = SCORES_TABLE,
+    loans_layout: ParquetLayout | None = None,
+    customers_layout: ParquetLayout | None = None,
+    workers: int | None = None,
+    batch_size: int = 65_536,
+) -> dict:
+    """
+    Score every loan of the loans dataset. Loans are streamed from S3 in
+    chunks of batch_size rows and scored in a pool of worker processes, each
+    of which loads the model and the customers once. Chunks are submitted
+    ahead of the scores being consumed, up to two per worker, so memory stays
+    bounded while the workers stay busy. The scores are streamed into a
+    binary COPY and upserted into table_name on loan_id, see
+    Pipeline.write_to_postgres_bulk.
+    Args:
+        pipeline (Pipeline): pipeline reading the datasets and loading Postgres
+        fs (s3fs.S3FileSystem): file system client
+        loans_path (str): fs path of the loans dataset
+        customers_path (str): fs path of the customers dataset
+        model_path (str): local joblib file of a fitted classifier with
+            predict_proba; it is given the columns of feature_names_in_ if
+            set, every numeric feature of features.compute_features otherwise
+        config (dict): postgres connection configuration
+        table_name (str): table the scores are upserted into
+        loans_layout (ParquetLayout, optional): layout of the loans dataset
+        customers_layout (ParquetLayout, optional): layout of the customers
+            dataset
+        workers (int, optional): worker processes, the CPU count if not set
+        batch_size (int): loans per chunk
+    Returns:
+        dict: rows, seconds and rows_per_sec of the run, and the WorkerStats
+            of every worker
+    """
+    workers = workers or os.cpu_count() or 1
+    model_version = _model_version(model_path)
+    # deduplicated and sorted once here rather than in every chunk of every
+    # worker, see features.prepare_customers
+    customers = prepare_customers(
+        pipeline.read_table_from_fs(
+            customers_path, fs, columns=CUSTOMER_COLUMNS, layout=customers_layout
+        )
+    )
+    batches = pipeline.iter_batches_from_fs(
+        loans_path,
+        fs,
+        columns=LOAN_COLUMNS,
+        batch_size=batch_size,
+        layout=loans_layout,
+    )
+    stats: dict[int, WorkerStats] = {}
+    start = time.perf_counter()
+    # spawned rather than forked, as the parent runs Arrow and pool threads
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(model_path, customers),
+    ) as executor:
+        loaded = pipeline.write_to_postgres_bulk(
+            data=_scores(
+                executor,
+                combine_batches(batches, batch_size),
+                workers,
+                model_version,
+                stats,
+            ),
+            config=config,
+            table_name=table_name,
+            key_columns=["loan_id"],
+            batch_size=batch_size,
+        )
+    seconds = time.perf_counter() - start
+    for worker in sorted(stats.values(), key=lambda w: w.pid):
+        logging.info(
+            "Scoring worker %d: %d rows in %d chunks, %.2fs (%.0f rows/s)",
+            worker.pid,
+            worker.rows,
+            worker.chunks,
+            worker.seconds,
+            worker.rows_per_sec,
+        )
+    result = {
+        "rows": loaded["rows"],
+        "seconds": seconds,
+        "rows_per_sec": loaded["rows"] / seconds if seconds else 0.0,
+        "model_version": model_version,
+        "workers": list(stats.values()),
+    }
+    logging.info(
+        "Scored %d loans with model %s in %.2fs (%.0f rows/s, %d workers)",
+        result["rows"],
+        model_version,
+        seconds,
+        result["rows_per_sec"],
+        len(stats),
+    )
+    return result
+
+
+def _scores(
+    executor: ProcessPoolExecutor,
+    batches: Iterator[pa.RecordBatch],
+    workers: int,
+    model_version: str,
+    stats: dict[int, WorkerStats],
+) -> Iterator[pa.RecordBatch]:
+    """
+    Submit the chunks to the workers and yield their scores in order, with
+    at most two chunks per worker in flight
+    """
+    pending: deque[Future] = deque()
+    scored_at = datetime.now()
+
+    def collect(future: Future) -> pa.RecordBatch:
+        scores, pid, seconds = future.result()
+        worker = stats.setdefault(pid, WorkerStats(pid=pid))
+        worker.chunks += 1
+        worker.rows += scores.num_rows
+        worker.seconds += seconds
+        return scores.append_column(
+            "model_version", pa.array([model_version] * scores.num_rows)
+        ).append_column(
+            "scored_at",
+            pa.array([scored_at] * scores.num_rows, pa.timestamp("us")),
+        )
+
+    try:
+        for batch in batches:
+            pending.append(executor.submit(_score_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _init_worker(model_path: str, customers: pa.Table):
+    """
+    Load the model and keep the customers of a worker process
+    """
+    global _MODEL, _COLUMNS, _CUSTOMERS  # pylint: disable=global-statement
+    _MODEL = joblib.load(model_path)
+    names = getattr(_MODEL, "feature_names_in_", None)
+    _COLUMNS = list(names) if names is not None else None
+    _CUSTOMERS = customers
+
+
+def _score_batch(batch: pa.RecordBatch) -> tuple[pa.RecordBatch, int, float]:
+    """
+    Compute the features of a chunk of loans and score them in a worker
+    process
+    Returns:
+        tuple: loan_id and score of every loan, worker pid and seconds spent
+    """
+    start = time.perf_counter()
+    features = compute_features(
+        pa.Table.from_batches([batch]), _CUSTOMERS, prepared=True
+    )
+    columns = _COLUMNS or [
+        name
+        for name, type_ in zip(features.column_names, features.schema.types)
+        if name not in NON_FEATURE_COLUMNS
+        and (pa.types.is_integer(type_) or pa.types.is_floating(type_))
+    ]
+    scores = _MODEL.predict_proba(features.select(columns).to_pandas())[:, 1]
+    result = pa.RecordBatch.from_arrays(
+        [
+            features["loan_id"].combine_chunks(),
+            pa.array(np.asarray(scores, dtype=np.float64)),
+        ],
+        names=["loan_id", "score"],
+    )
+    return result, os.getpid(), time.perf_counter() - start
+
+
+def _model_version(model_path: str) -> str:
+    """
+    File name and content hash of a model, identifying it in the scores
+    """
+    sha256 = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return f"{os.path.basename(model_path)}@{sha256.hexdigest()[:12]}"
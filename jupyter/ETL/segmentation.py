@@ -0,0 +1,393 @@
+"""
+Out-of-core customer segmentation: incremental scaling, IncrementalPCA and
+MiniBatchKMeans fitted on streamed batches of the customers dataset
+"""
+
+import itertools
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import s3fs
+from fsspec.core import strip_protocol
+from pyarrow import compute as pc, dataset as ds, parquet as pq
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import IncrementalPCA
+from sklearn.preprocessing import StandardScaler
+
+import metrics
+from ETL import Pipeline, combine_batches
+from layout import ParquetLayout
+
+# numeric customer columns the segments are fitted on by default, "age" is
+# derived from date_of_birth
+SEGMENT_FEATURES = [
+    "income",
+    "age",
+    "years_of_employment",
+    "cb_preson_cred_hist_length",
+]
+# the only column the clusters of generate_mock_data_1.py differ in, to pass
+# as columns when validating against their labels; the other columns are
+# noise there and blur the clusters
+LABELED_SEGMENT_FEATURES = ["income"]
+SEGMENT_COLUMN = "segment"
+
+
+@dataclass
+class SegmentationModel:
+    """
+    Fitted segmentation stages
+    Args:
+        columns (list[str]): feature columns, in model order
+        scaler (StandardScaler): feature standardization
+        pca (IncrementalPCA): dimensionality reduction of the scaled features
+        kmeans (MiniBatchKMeans): clustering of the reduced features
+    """
+
+    columns: list[str]
+    scaler: StandardScaler
+    pca: IncrementalPCA
+    kmeans: MiniBatchKMeans
+
+    def predict(self, batch: pa.RecordBatch | pa.Table) -> np.ndarray:
+        """
+        Segment of every customer of a batch
+        Args:
+            batch (pa.RecordBatch | pa.Table): customers
+        Returns:
+            np.ndarray: segment index of every row
+        """
+        features = self.scale(feature_matrix(batch, self.columns))
+        return self.kmeans.predict(self.pca.transform(features))
+
+    def scale(self, features: np.ndarray) -> np.ndarray:
+        """
+        Standardize features, missing values imputed with the mean of their
+        column first
+        Args:
+            features (np.ndarray): feature_matrix output
+        Returns:
+            np.ndarray: scaled features without NaN
+        """
+        features = np.where(np.isnan(features), self.scaler.mean_, features)
+        return self.scaler.transform(features)
+
+
+@metrics.instrument()
+def segment_customers(
+    pipeline: Pipeline,
+    fs: s3fs.S3FileSystem,
+    path: str,
+    output_path: str,
+    labels_path: str | None = None,
+    layout: ParquetLayout | None = None,
+    **kwargs,
+) -> dict:
+    """
+    Fit the segmentation of the customers dataset, write the segmented
+    customers and score them against known labels when there are any
+    Args:
+        pipeline (Pipeline): pipeline reading and writing the datasets
+        fs (s3fs.S3FileSystem): file system client
+        path (str): fs path of the customers dataset
+        output_path (str): fs path of the segmented customers dataset
+        labels_path (str, optional): local Parquet file of customer_id and
+            cluster, skipped if it does not exist
+        layout (ParquetLayout, optional): layout of both datasets
+        **kwargs: fit_segmentation arguments
+    Returns:
+        dict: customers segmented and adjusted Rand index, None without
+            labels or with too few customers labeled, see evaluate_segments
+    """
+    model = fit_segmentation(pipeline, path, fs, layout=layout, **kwargs)
+    rows = write_segments(pipeline, model, path, output_path, fs, layout=layout)
+    score = None
+    if labels_path and os.path.exists(labels_path):
+        score = evaluate_segments(
+            pipeline, output_path, labels_path, fs, layout=layout
+        )
+    return {"rows": rows, "adjusted_rand_index": score}
+
+
+@metrics.instrument()
+def fit_segmentation(
+    pipeline: Pipeline,
+    path: str,
+    fs: s3fs.S3FileSystem,
+    columns: list[str] | None = None,
+    n_clusters: int = 5,
+    n_components: int = 3,
+    epochs: int = 3,
+    batch_size: int = 65_536,
+    layout: ParquetLayout | None = None,
+    random_state: int = 42,
+) -> SegmentationModel:
+    """
+    Fit the segmentation of the customers dataset without holding it in
+    memory. Every stage is fitted with partial_fit on batches streamed from
+    the dataset, in one pass for the scaler and the PCA and in epochs passes
+    for MiniBatchKMeans, so memory is bounded by batch_size rows.
+    Args:
+        pipeline (Pipeline): pipeline reading the dataset
+        path (str): fs path of the customers dataset
+        fs (s3fs.S3FileSystem): file system client
+        columns (list[str], optional): feature columns, SEGMENT_FEATURES if
+            not set
+        n_clusters (int): number of segments
+        n_components (int): PCA components the clustering runs on, at most
+            the number of columns
+        epochs (int): passes of MiniBatchKMeans over the dataset
+        batch_size (int): rows per partial_fit
+        layout (ParquetLayout, optional): layout of the dataset
+        random_state (int): seed of the clustering
+    Returns:
+        SegmentationModel: fitted stages
+    """
+    columns = columns or SEGMENT_FEATURES
+    n_components = min(n_components, len(columns))
+    model = SegmentationModel(
+        columns=columns,
+        scaler=StandardScaler(),
+        pca=IncrementalPCA(n_components=n_components),
+        kmeans=MiniBatchKMeans(
+            n_clusters=n_clusters, random_state=random_state, n_init=3
+        ),
+    )
+
+    def batches() -> Iterator[np.ndarray]:
+        source = pipeline.iter_batches_from_fs(
+            path, fs, columns=_source_columns(columns), layout=layout
+        )
+        for batch in combine_batches(source, batch_size):
+            yield feature_matrix(batch, columns)
+
+    with metrics.stage("fit_scaler"):
+        # missing values are left out of the means and variances
+        for features in batches():
+            model.scaler.partial_fit(features)
+    with metrics.stage("fit_pca"):
+        # IncrementalPCA needs at least n_components rows per partial_fit,
+        # so a short last batch is carried over to the next one
+        carry = np.empty((0, len(columns)))
+        for features in batches():
+            features = np.vstack([carry, model.scale(features)])
+            if len(features) < n_components:
+                carry = features
+                continue
+            model.pca.partial_fit(features)
+            carry = np.empty((0, len(columns)))
+    with metrics.stage("fit_kmeans"):
+        for _ in range(epochs):
+            for features in batches():
+                reduced = model.pca.transform(model.scale(features))
+                if not hasattr(model.kmeans, "cluster_centers_") and (
+                    len(reduced) < n_clusters
+                ):
+                    continue
+                model.kmeans.partial_fit(reduced)
+    logging.info(
+        "Fitted %d segments on %d customers, PCA explained variance %.2f",
+        n_clusters,
+        int(np.max(model.scaler.n_samples_seen_)),
+        float(np.sum(model.pca.explained_variance_ratio_)),
+    )
+    return model
+
+
+@metrics.instrument()
+def write_segments(
+    pipeline: Pipeline,
+    model: SegmentationModel,
+    path: str,
+    output_path: str,
+    fs: s3fs.S3FileSystem,
+    batch_size: int = 65_536,
+    layout: ParquetLayout | None = None,
+) -> int:
+    """
+    Stream the customers dataset to output_path with the segment of every
+    customer as an extra column, in the same layout
+    Args:
+        pipeline (Pipeline): pipeline reading the dataset
+        model (SegmentationModel): fitted segmentation
+        path (str): fs path of the customers dataset
+        output_path (str): fs path of the segmented customers dataset
+        fs (s3fs.S3FileSystem): file system client
+        batch_size (int): rows segmented at a time
+        layout (ParquetLayout, optional): layout of both datasets
+    Returns:
+        int: customers written
+    """
+    layout = layout or ParquetLayout()
+    written = 0
+
+    def segmented() -> Iterator[pa.RecordBatch]:
+        nonlocal written
+        source = pipeline.iter_batches_from_fs(path, fs, layout=layout)
+        for batch in combine_batches(source, batch_size):
+            segments = pa.array(model.predict(batch).astype(np.int32))
+            written += batch.num_rows
+            yield layout.add_partition_columns_batch(
+                batch.append_column(SEGMENT_COLUMN, segments)
+            )
+
+    batches = segmented()
+    first = next(batches, None)
+    if first is None:
+        return 0
+    if fs.exists(output_path):
+        fs.rm(output_path, recursive=True)
+    ds.write_dataset(
+        itertools.chain([first], batches),
+        strip_protocol(output_path),
+        schema=first.schema,
+        filesystem=fs,
+        basename_template=f"segments-{datetime.now():%Y%m%d%H%M%S}-{{i}}.parquet",
+        **layout.dataset_write_options(),
+    )
+    logging.info("Wrote the segments of %d customers to %s", written, output_path)
+    return written
+
+
+@metrics.instrument()
+def evaluate_segments(
+    pipeline: Pipeline,
+    segments_path: str,
+    labels_path: str,
+    fs: s3fs.S3FileSystem,
+    batch_size: int = 65_536,
+    layout: ParquetLayout | None = None,
+    min_labeled: float = 0.5,
+) -> float | None:
+    """
+    Adjusted Rand index of the segments against known cluster labels, e.g.
+    those saved by generate_mock_data_1.py. The contingency table of the two
+    labelings is accumulated batch by batch; customers without a label are
+    left out. Labels of other customers, e.g. saved before the customers were
+    generated again, give no score rather than one computed on a few
+    customers.
+    Args:
+        pipeline (Pipeline): pipeline reading the segments
+        segments_path (str): fs path of the segmented customers dataset
+        labels_path (str): local Parquet file of customer_id and cluster
+        fs (s3fs.S3FileSystem): file system client
+        batch_size (int): rows compared at a time
+        layout (ParquetLayout, optional): layout of the segments dataset
+        min_labeled (float): share of the segmented customers that must have
+            a label to score them
+    Returns:
+        float | None: adjusted Rand index, 1.0 for identical partitions, None
+            if fewer than 2 or than min_labeled of the customers have a label
+    """
+    labels = pq.read_table(labels_path, columns=["customer_id", "cluster"])
+    label_ids = labels["customer_id"].combine_chunks()
+    label_values = pc.cast(labels["cluster"], pa.int64()).to_numpy()
+    contingency: dict[tuple[int, int], int] = {}
+    segmented = labeled = 0
+    source = pipeline.iter_batches_from_fs(
+        segments_path,
+        fs,
+        columns=["customer_id", SEGMENT_COLUMN],
+        batch_size=batch_size,
+        layout=layout,
+    )
+    for batch in source:
+        index = pc.index_in(batch.column("customer_id"), value_set=label_ids)
+        known = pc.is_valid(index).to_numpy(zero_copy_only=False)
+        segmented += batch.num_rows
+        labeled += int(known.sum())
+        clusters = label_values[pc.fill_null(index, 0).to_numpy()[known]]
+        segments = batch.column(SEGMENT_COLUMN).to_numpy()[known]
+        pairs, counts = np.unique(
+            np.stack([clusters, segments]), axis=1, return_counts=True
+        )
+        for (cluster, segment), count in zip(pairs.T, counts):
+            key = (int(cluster), int(segment))
+            contingency[key] = contingency.get(key, 0) + int(count)
+    logging.info(
+        "%d of %d segmented customers have a label in %s",
+        labeled,
+        segmented,
+        labels_path,
+    )
+    if labeled < 2 or labeled < min_labeled * segmented:
+        logging.warning(
+            "Too few segmented customers have a label to score the segments, "
+            "the labels may belong to an earlier generation of the customers"
+        )
+        return None
+    score = adjusted_rand_index(contingency)
+    logging.info("Adjusted Rand index of the segments: %.3f", score)
+    return score
+
+
+def adjusted_rand_index(contingency: dict[tuple[int, int], int]) -> float:
+    """
+    Adjusted Rand index of two labelings from their contingency table
+    Args:
+        contingency (dict[tuple[int, int], int]): number of items of every
+            (label, other label) pair
+    Returns:
+        float: adjusted Rand index, NaN for fewer than 2 items
+    """
+    rows: dict[int, int] = {}
+    cols: dict[int, int] = {}
+    for (row, col), count in contingency.items():
+        rows[row] = rows.get(row, 0) + count
+        cols[col] = cols.get(col, 0) + count
+    n = sum(contingency.values())
+
+    def pairs(counts) -> float:
+        values = np.fromiter(counts, dtype=np.float64)
+        return float(np.sum(values * (values - 1) / 2))
+
+    index = pairs(contingency.values())
+    row_pairs, col_pairs = pairs(rows.values()), pairs(cols.values())
+    total = n * (n - 1) / 2
+    if total == 0:
+        return float("nan")
+    expected = row_pairs * col_pairs / total
+    maximum = (row_pairs + col_pairs) / 2
+    if maximum == expected:
+        return 1.0
+    return (index - expected) / (maximum - expected)
+
+
+def feature_matrix(
+    batch: pa.RecordBatch | pa.Table, columns: list[str]
+) -> np.ndarray:
+    """
+    Float matrix of the segmentation features of a batch, missing values
+    as NaN
+    Args:
+        batch (pa.RecordBatch | pa.Table): customers
+        columns (list[str]): feature columns, "age" derived from date_of_birth
+    Returns:
+        np.ndarray: one row per customer, one column per feature
+    """
+    names = batch.schema.names
+    matrix = np.empty((batch.num_rows, len(columns)))
+    for i, column in enumerate(columns):
+        if column == "age" and "age" not in names:
+            born = pc.cast(
+                batch.column(names.index("date_of_birth")), pa.date32(), safe=False
+            )
+            days = pc.cast(pc.cast(born, pa.int32()), pa.float64())
+            today = (datetime.now().date() - datetime(1970, 1, 1).date()).days
+            values = pc.divide(pc.subtract(today, days), 365.25)
+        else:
+            values = pc.cast(batch.column(names.index(column)), pa.float64())
+        matrix[:, i] = pc.fill_null(values, np.nan).to_numpy(zero_copy_only=False)
+    return matrix
+
+
+def _source_columns(columns: list[str]) -> list[str]:
+    """
+    Dataset columns the feature columns are read or derived from
+    """
+    return ["date_of_birth" if column == "age" else column for column in columns]
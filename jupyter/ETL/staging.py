@@ -0,0 +1,193 @@
+"""
+Staging tables for bulk loads merged into keyed Postgres tables
+"""
+
+import logging
+import uuid
+
+from psycopg2 import sql
+from psycopg2.extensions import connection
+
+
+def create_staging_table(conn: connection, table_name: str) -> str:
+    """
+    Create an UNLOGGED, index-free copy of the columns of a table. It is
+    created in the current transaction, so a rollback removes it too.
+    Args:
+        conn (connection): psycopg2 connection
+        table_name (str): table the staging table is modelled on
+
+    Returns:
+        str: name of the staging table
+    """
+    staging = f"{table_name.rsplit('.', 1)[-1]}_staging_{uuid.uuid4().hex[:8]}"
+    with conn.cursor() as c:
+        c.execute(
+            sql.SQL(
+                "CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)"
+            ).format(sql.Identifier(staging), _table(table_name))
+        )
+    return staging
+
+
+def merge_staging_table(
+    conn: connection,
+    staging: str,
+    table_name: str,
+    key_columns: list[str],
+    columns: list[str],
+    full_reload: bool = False,
+) -> int:
+    """
+    Upsert the rows of a staging table into its table and drop it, without
+    committing. Rows sharing a key are reduced to the last one copied and
+    rows with a NULL in a NOT NULL key column are skipped, so that nullable
+    key columns of a UNIQUE NULLS NOT DISTINCT constraint still match. A full
+    reload replaces the content of the table instead, with its secondary
+    indexes, foreign key and check constraints dropped during the insert and
+    rebuilt afterwards.
+    Args:
+        conn (connection): psycopg2 connection the staging table was filled on
+        staging (str): staging table name
+        table_name (str): table to merge into
+        key_columns (list[str]): columns of the primary key or unique
+            constraint the rows are matched on
+        columns (list[str]): columns filled in the staging table
+        full_reload (bool): replace the rows of the table
+
+    Returns:
+        int: number of rows inserted or updated
+    """
+    missing = [column for column in key_columns if column not in columns]
+    if missing:
+        raise KeyError(f"Key columns {missing} were not loaded into {staging}")
+    keys = sql.SQL(", ").join(map(sql.Identifier, key_columns))
+    names = sql.SQL(", ").join(map(sql.Identifier, columns))
+    updates = [
+        sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(column))
+        for column in columns
+        if column not in key_columns
+    ]
+    with conn.cursor() as c:
+        c.execute(
+            """
+            SELECT attname FROM pg_attribute
+            WHERE attrelid = %s::regclass AND attnotnull AND attname = ANY(%s)""",
+            (table_name, key_columns),
+        )
+        not_null_keys = [column for column, in c.fetchall()]
+    merge = sql.SQL(
+        """
+        INSERT INTO {table} ({names})
+        SELECT DISTINCT ON ({keys}) {names}
+        FROM {staging}
+        WHERE {not_null}
+        ORDER BY {keys}, ctid DESC
+        ON CONFLICT ({keys}) DO {action}"""
+    ).format(
+        table=_table(table_name),
+        names=names,
+        keys=keys,
+        staging=sql.Identifier(staging),
+        not_null=sql.SQL(" AND ").join(
+            [sql.SQL("TRUE")]
+            + [
+                sql.SQL("{} IS NOT NULL").format(sql.Identifier(column))
+                for column in not_null_keys
+            ]
+        ),
+        action=(
+            sql.SQL("UPDATE SET ") + sql.SQL(", ").join(updates)
+            if updates
+            else sql.SQL("NOTHING")
+        ),
+    )
+    with conn.cursor() as c:
+        rebuild = []
+        if full_reload:
+            rebuild = drop_secondary_objects(c, table_name)
+            c.execute(sql.SQL("TRUNCATE {}").format(_table(table_name)))
+        c.execute(merge)
+        merged = c.rowcount
+        for statement in rebuild:
+            c.execute(statement)
+        c.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(staging)))
+        if full_reload:
+            c.execute(sql.SQL("ANALYZE {}").format(_table(table_name)))
+    logging.info(
+        "Merged %d rows into %s%s",
+        merged,
+        table_name,
+        " (full reload)" if full_reload else "",
+    )
+    return merged
+
+
+def drop_secondary_objects(cursor, table_name: str) -> list[sql.Composable]:
+    """
+    Drop the indexes that do not back a primary key or unique constraint and
+    the foreign key and check constraints of a table
+    Args:
+        cursor: psycopg2 cursor
+        table_name (str): table name, optionally schema qualified
+
+    Returns:
+        list[sql.Composable]: statements that recreate what was dropped
+    """
+    cursor.execute(
+        """
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid
+            )
+            -- partition indexes follow the index of their partitioned table
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_inherits h WHERE h.inhrelid = i.indexrelid
+            )""",
+        (table_name,),
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype IN ('f', 'c')""",
+        (table_name,),
+    )
+    constraints = cursor.fetchall()
+    rebuild = []
+    for name, definition in constraints:
+        cursor.execute(
+            sql.SQL("ALTER TABLE {} DROP CONSTRAINT {}").format(
+                _table(table_name), sql.Identifier(name)
+            )
+        )
+        rebuild.append(
+            sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} ").format(
+                _table(table_name), sql.Identifier(name)
+            )
+            + sql.SQL(definition)
+        )
+    for name, definition in indexes:
+        # regclass text is already quoted and schema qualified when needed
+        cursor.execute(sql.SQL("DROP INDEX {}").format(sql.SQL(name)))
+        # the definition of a partitioned table index is ON ONLY the parent,
+        # which would leave it invalid and missing on the partitions
+        rebuild.append(sql.SQL(definition.replace(" ON ONLY ", " ON ", 1)))
+    logging.info(
+        "Dropped %d indexes and %d constraints of %s for the reload",
+        len(indexes),
+        len(constraints),
+        table_name,
+    )
+    # indexes first, so that foreign keys are validated with them in place
+    return rebuild[len(constraints) :] + rebuild[: len(constraints)]
+
+
+def _table(table_name: str) -> sql.Composable:
+    """
+    Quoted, optionally schema qualified, table name
+    """
+    return sql.Identifier(*table_name.split("."))
@@ -0,0 +1,366 @@
+"""
+Continuous micro-batch ingestion of loan events into the landing zone and
+Postgres
+"""
+
+import argparse
+import logging
+import os
+import queue
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable
+
+import numpy as np
+import pyarrow as pa
+import s3fs
+from pyarrow import compute as pc
+
+import metrics
+from config import create_postgress_config
+from ETL import Pipeline
+# the event generator lives with the mock data generators, setup/ is put on
+# the import path by the entry point (PYTHONPATH of the container)
+from generate_loan_events import ORIGINATION, STATUS_CHANGE, generate_loan_events
+from layout import ParquetLayout
+from pipeline import BUCKET, KEY_COLUMNS, create_fs
+
+EVENT_COLUMNS = ["event_type", "event_time"]
+LATENCY_PERCENTILES = [50, 95, 99]
+
+
+@dataclass
+class IngestReport:
+    """
+    Throughput and end to end latency of an ingestion run
+    Args:
+        events (int): events ingested
+        flushes (int): micro-batches flushed
+        seconds (float): time from the first event received to the last flush
+        latencies (dict[str, float]): seconds from the emission of an event
+            to the commit of its micro-batch, by percentile ("p50", "p95",
+            "p99" and "max")
+        flush_reasons (dict[str, int]): flushes by trigger, "size", "time"
+            or "end" of the stream
+    """
+
+    events: int = 0
+    flushes: int = 0
+    seconds: float = 0.0
+    latencies: dict[str, float] = field(default_factory=dict)
+    flush_reasons: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def events_per_sec(self) -> float:
+        """
+        Sustained ingestion rate
+        """
+        return self.events / self.seconds if self.seconds else 0.0
+
+
+class MicroBatchIngester:
+    """
+    Buffer a stream of loan event batches and flush them as one micro-batch
+    once max_rows events are buffered or the oldest buffered event is
+    max_wait seconds old, whichever comes first. A flush appends the events
+    to the event log dataset on the fs, then upserts the originations into
+    the Postgres table and applies the status changes to it. The stream is
+    read on a separate thread, so the time trigger fires even while no
+    event arrives, and a slow flush applies back pressure to the producer
+    through a bounded queue.
+    """
+
+    def __init__(
+        self,
+        pipeline: Pipeline,
+        fs: s3fs.S3FileSystem,
+        fs_path: str,
+        config: dict,
+        table_name: str = "loans",
+        key_columns: list[str] | None = None,
+        max_rows: int = 10_000,
+        max_wait: float = 1.0,
+        layout: ParquetLayout | None = None,
+        queue_size: int = 64,
+    ) -> None:
+        """
+        Args:
+            pipeline (Pipeline): pipeline writing the fs and Postgres
+            fs (s3fs.S3FileSystem): file system client
+            fs_path (str): fs path of the event log dataset
+            config (dict): postgres connection configuration
+            table_name (str): table the loans are upserted into
+            key_columns (list[str], optional): key of table_name, its
+                KEY_COLUMNS entry if not set
+            max_rows (int): events that trigger a flush
+            max_wait (float): age in seconds of the oldest buffered event that
+                triggers a flush
+            layout (ParquetLayout, optional): layout of the event log dataset
+            queue_size (int): event batches read ahead of the flushes
+        """
+        self.pipeline = pipeline
+        self.fs = fs
+        self.fs_path = fs_path
+        self.config = config
+        self.table_name = table_name
+        self.key_columns = key_columns or KEY_COLUMNS[table_name]
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.layout = layout
+        self.queue_size = queue_size
+        self._flushes = 0
+        self._started = datetime.now()
+
+    @metrics.instrument()
+    def run(self, events: Iterable[pa.RecordBatch]) -> IngestReport:
+        """
+        Ingest a stream of events until it ends
+        Args:
+            events (Iterable[pa.RecordBatch]): event batches with the loans
+                columns, event_type and event_time
+        Returns:
+            IngestReport: throughput and latency of the run
+        """
+        pending: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        reader = threading.Thread(
+            target=_read_events, args=(events, pending), daemon=True
+        )
+        reader.start()
+        report = IngestReport()
+        latencies = []
+        buffer: list[pa.RecordBatch] = []
+        buffered = 0
+        deadline = None
+        start = None
+        while True:
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - _now(), np.timedelta64(0, "us"))
+                timeout = timeout / np.timedelta64(1, "s")
+            try:
+                item = pending.get(timeout=timeout)
+            except queue.Empty:
+                latencies.append(self._flush(buffer, "time", report))
+                buffer, buffered, deadline = [], 0, None
+                continue
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            start = start or time.perf_counter()
+            if deadline is None:
+                oldest = pc.min(item.column("event_time")).value
+                deadline = np.datetime64(oldest, "us") + np.timedelta64(
+                    int(self.max_wait * 1e6), "us"
+                )
+            buffer.append(item)
+            buffered += item.num_rows
+            if buffered >= self.max_rows:
+                latencies.append(self._flush(buffer, "size", report))
+                buffer, buffered, deadline = [], 0, None
+        if buffer:
+            latencies.append(self._flush(buffer, "end", report))
+        reader.join()
+        report.seconds = time.perf_counter() - start if start else 0.0
+        if latencies:
+            latency = np.concatenate(latencies)
+            report.latencies = {
+                f"p{q}": float(value)
+                for q, value in zip(
+                    LATENCY_PERCENTILES, np.percentile(latency, LATENCY_PERCENTILES)
+                )
+            }
+            report.latencies["max"] = float(latency.max())
+        logging.info(
+            "Ingested %d events in %d flushes, %.0f events/s, latency %s",
+            report.events,
+            report.flushes,
+            report.events_per_sec,
+            ", ".join(f"{k} {v:.3f}s" for k, v in report.latencies.items()),
+        )
+        return report
+
+    def _flush(
+        self, buffer: list[pa.RecordBatch], reason: str, report: IngestReport
+    ) -> np.ndarray:
+        """
+        Write one micro-batch to the fs and Postgres
+        Returns:
+            np.ndarray: seconds from emission to commit of every event
+        """
+        events = pa.Table.from_batches(buffer)
+        with metrics.stage("flush", reason=reason) as stage:
+            stage.rows, stage.bytes = events.num_rows, events.nbytes
+            self._flushes += 1
+            self.pipeline.put_to_fs(
+                events,
+                self.fs_path,
+                self.fs,
+                basename_template=(
+                    f"events-{self._started:%Y%m%d%H%M%S}-{self._flushes:08d}"
+                    "-{i}.parquet"
+                ),
+                layout=self.layout,
+            )
+            loan_columns = [
+                name for name in events.column_names if name not in EVENT_COLUMNS
+            ]
+            # originations first, so a status change of a loan originated in
+            # the same micro-batch updates it rather than inserting it
+            for event_type, columns in (
+                (ORIGINATION, loan_columns),
+                (STATUS_CHANGE, self.key_columns + ["status"]),
+            ):
+                rows = events.filter(pc.equal(events["event_type"], event_type))
+                if rows.num_rows:
+                    self.pipeline.write_to_postgres_bulk(
+                        data=rows.select(columns),
+                        config=self.config,
+                        table_name=self.table_name,
+                        key_columns=self.key_columns,
+                    )
+        committed = _now()
+        report.events += events.num_rows
+        report.flushes += 1
+        report.flush_reasons[reason] = report.flush_reasons.get(reason, 0) + 1
+        emitted = events["event_time"].to_numpy().astype("datetime64[us]")
+        return (committed - emitted) / np.timedelta64(1, "s")
+
+
+def _read_events(events: Iterable[pa.RecordBatch], pending: queue.Queue):
+    """
+    Move the event batches to the queue, ending with None or the exception
+    that ended the stream
+    """
+    try:
+        for batch in events:
+            pending.put(batch)
+        pending.put(None)
+    except BaseException as e:  # pylint: disable=broad-except
+        pending.put(e)
+
+
+def _now() -> np.datetime64:
+    """
+    Current time in the naive local clock of the event times
+    """
+    return np.datetime64(datetime.now(), "us")
+
+
+def main(
+    rate: float,
+    duration: float | None = None,
+    max_rows: int = 10_000,
+    max_wait: float = 1.0,
+    status_change_ratio: float = 0.3,
+    seed: int | None = None,
+    metrics_dir: str | None = None,
+) -> IngestReport:
+    """
+    Generate loan events against the customers of the landing zone and
+    ingest them into s3://landing-zone/loan_events and the loans table
+    Args:
+        rate (float): target events per second
+        duration (float, optional): seconds to run for, until interrupted
+            with Ctrl-C if not set
+        max_rows (int): events that trigger a flush
+        max_wait (float): event age in seconds that triggers a flush
+        status_change_ratio (float): share of the events that are status
+            changes
+        seed (int, optional): seed of the event generator
+        metrics_dir (str, optional): directory the JSON run report and the
+            Prometheus textfile of the stage metrics are written to
+    Returns:
+        IngestReport: throughput and latency of the run
+    """
+    fs = create_fs()
+    postgress_config = create_postgress_config()
+    stop = threading.Event()
+    with Pipeline() as pipeline:
+        customers = pipeline.read_table_from_fs(
+            f"s3://{BUCKET}/customers", fs, columns=["customer_id", "income"]
+        )
+        events = generate_loan_events(
+            customer_ids=customers["customer_id"].to_numpy(),
+            customer_income=pc.fill_null(
+                pc.cast(customers["income"], pa.float64()), np.nan
+            ).to_numpy(),
+            rate=rate,
+            duration=duration,
+            status_change_ratio=status_change_ratio,
+            rng=np.random.default_rng(seed),
+            stop=stop,
+        )
+        ingester = MicroBatchIngester(
+            pipeline=pipeline,
+            fs=fs,
+            fs_path=f"s3://{BUCKET}/loan_events",
+            config=postgress_config,
+            max_rows=max_rows,
+            max_wait=max_wait,
+        )
+        # the first Ctrl-C ends the stream, the buffered events are still
+        # flushed and the run reported; a second one interrupts as usual
+        previous = signal.getsignal(signal.SIGINT)
+
+        def interrupt(signum, frame):  # pylint: disable=unused-argument
+            logging.info("Interrupted, flushing the buffered events")
+            signal.signal(signal.SIGINT, previous)
+            stop.set()
+
+        signal.signal(signal.SIGINT, interrupt)
+        try:
+            report = ingester.run(events)
+        finally:
+            signal.signal(signal.SIGINT, previous)
+    logging.info(
+        "Target rate %.0f events/s, sustained %.0f events/s",
+        rate,
+        report.events_per_sec,
+    )
+    if metrics_dir:
+        metrics.RECORDER.export(metrics_dir, name="streaming")
+    return report
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=1_000, help="events per second")
+    parser.add_argument("--duration", type=float, help="seconds to run for")
+    parser.add_argument(
+        "--max-rows", type=int, default=10_000, help="events that trigger a flush"
+    )
+    parser.add_argument(
+        "--max-wait",
+        type=float,
+        default=1.0,
+        help="age in seconds of the oldest buffered event that triggers a flush",
+    )
+    parser.add_argument("--status-change-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.environ.get("ETL_METRICS_DIR"),
+        help="write a JSON run report and a Prometheus textfile of the stages",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    main(
+        rate=args.rate,
+        duration=args.duration,
+        max_rows=args.max_rows,
+        max_wait=args.max_wait,
+        status_change_ratio=args.status_change_ratio,
+        seed=args.seed,
+        metrics_dir=args.metrics_dir,
+    )
@@ -0,0 +1,639 @@
+"""
+Benchmarks of the mock data generators and the ETL pipeline stages.
+
+Every case runs in a fresh process against a local fsspec file system in
+place of MinIO and, unless a Postgres configuration is given, a stub COPY
+sink that drains the COPY stream without a database. Inputs are generated
+once per row count and are not part of the measurement. Throughput and memory
+are compared against a stored baseline, so regressions show up offline on
+any Linux box.
+
+    python benchmark.py --rows 10000 100000 --save-baseline
+    python benchmark.py --rows 10000 100000
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from multiprocessing import get_context
+from typing import Callable, Iterator
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "ETL"))
+sys.path.append(os.path.join(BENCHMARK_DIR, "..", "setup"))
+
+# pylint: disable=wrong-import-position
+import fsspec
+import numpy as np
+import pandas as pd
+from pyarrow import parquet as pq
+
+import generate_mock_data as gen
+import metrics
+import string_pools
+from ETL import Pipeline
+
+ROW_COUNTS = [10_000, 100_000, 1_000_000, 10_000_000]
+DDL_PATH = os.path.join(
+    BENCHMARK_DIR, "..", "setup", "migrations", "0001_create_tables.sql"
+)
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+# type names of the table migration as reported by format_type
+PG_TYPE_NAMES = {"varchar": "character varying", "float": "double precision"}
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class Case:
+    """
+    A benchmark
+    Args:
+        name (str): unique case name
+        setup (Callable[[int, str, dict | None], dict]): prepares the inputs
+            of a run of rows rows in a work directory, given the Postgres
+            configuration if any, not measured
+        run (Callable[..., object]): measured work, called with the inputs
+        max_rows (int | None): largest row count the case runs at, e.g. for
+            row by row generators that would take hours at 10M rows
+    """
+
+    name: str
+    setup: Callable[[int, str, dict | None], dict]
+    run: Callable[..., object]
+    max_rows: int | None = None
+
+
+@dataclass
+class Result:
+    """
+    Best run of a case at a row count
+    Args:
+        case (str): case name
+        rows (int): rows processed
+        seconds (float): wall time of the fastest repeat
+        cpu_seconds (float): CPU time of the fastest repeat
+        rows_per_sec (float): throughput of the fastest repeat
+        peak_rss_delta_bytes (int): highest RSS growth over the RSS before
+            the measured work, over all repeats
+    """
+
+    case: str
+    rows: int
+    seconds: float
+    cpu_seconds: float
+    rows_per_sec: float
+    peak_rss_delta_bytes: int
+
+    @property
+    def key(self) -> str:
+        """
+        Identifier of the case and row count in the baseline
+        """
+        return f"{self.case}[{self.rows}]"
+
+
+class SinkPipeline(Pipeline):
+    """
+    Pipeline whose Postgres connections are stubs that drain COPY streams,
+    so the encoding and streaming work is measured without a database
+    """
+
+    def __init__(self, column_types: dict[str, dict[str, str]], **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.column_types = column_types
+
+    @contextmanager
+    def connection(self, config: dict) -> Iterator["_SinkConnection"]:
+        yield _SinkConnection(self.column_types)
+
+
+class _SinkConnection:
+    """
+    Stand-in for a psycopg2 connection, enough for the Pipeline COPY paths
+    """
+
+    closed = False
+
+    def __init__(self, column_types: dict[str, dict[str, str]]) -> None:
+        self.column_types = column_types
+        self.bytes = 0
+
+    def cursor(self) -> "_SinkCursor":
+        return _SinkCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class _SinkCursor:
+    """
+    Stand-in for a psycopg2 cursor that answers the column type lookup of
+    pg_copy.table_column_types and reads COPY data to the end
+    """
+
+    def __init__(self, conn: _SinkConnection) -> None:
+        self.conn = conn
+        self._rows = []
+
+    def __enter__(self) -> "_SinkCursor":
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql: str, params: tuple = ()):
+        table_name = params[0].rsplit(".", 1)[-1]
+        self._rows = list(self.conn.column_types[table_name].items())
+
+    def fetchall(self) -> list[tuple]:
+        return self._rows
+
+    def copy_expert(self, sql: str, file, size: int = 8192):
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            self.conn.bytes += len(chunk)
+
+
+def ddl_column_types(path: str = DDL_PATH) -> dict[str, dict[str, str]]:
+    """
+    Column types of every table created by the table migration, named as
+    format_type names them
+    """
+    with open(path, encoding="UTF-8") as f:
+        ddl = f.read()
+    tables = {}
+    for name, body in re.findall(
+        r"create table (?:if not exists )?[\w.]*?(\w+) \((.*?)\);", ddl, re.S
+    ):
+        tables[name] = {
+            column: PG_TYPE_NAMES.get(pg_type, pg_type)
+            for column, pg_type in re.findall(
+                r'"(\w+)" (double precision|\w+)', body
+            )
+        }
+    return tables
+
+
+def loans_parquet(rows: int, work_dir: str) -> str:
+    """
+    Local Parquet file of rows loans, generated once per row count
+    """
+    path = os.path.join(work_dir, "inputs", f"loans-{rows}.parquet")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rng = np.random.default_rng(10)
+    customers = min(rows, 100_000)
+    customer_ids = rng.integers(10**11, 10**12, size=customers)
+    customer_income = rng.normal(60_000, 15_000, size=customers)
+    chunk_size = 500_000
+    tmp = f"{path}.tmp"
+    gen.write_parquet_chunks(
+        tmp,
+        gen.LOAN_SCHEMA,
+        (
+            gen.generate_loans_from_index(
+                batch_size=min(chunk_size, rows - start),
+                customer_ids=customer_ids,
+                customer_income=customer_income,
+                rng=rng,
+            )
+            for start in range(0, rows, chunk_size)
+        ),
+    )
+    os.replace(tmp, path)
+    return path
+
+
+def loans_dataset(rows: int, work_dir: str) -> str:
+    """
+    Parquet dataset of rows loans on the local file system, written once
+    """
+    path = os.path.join(work_dir, "fs", f"loans-{rows}")
+    if not os.path.exists(path):
+        Pipeline().put_to_fs(
+            pq.read_table(loans_parquet(rows, work_dir)),
+            path=f"{path}.tmp",
+            fs=fsspec.filesystem("file"),
+        )
+        os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _customers_setup(rows: int, work_dir: str, _: dict | None) -> dict:
+    gen.random.seed(10)
+    gen.np.random.seed(10)
+    gen.fake.seed_instance(10)
+    return {"batch_size": rows}
+
+
+def _columnar_customers_setup(rows: int, work_dir: str, _: dict | None) -> dict:
+    # the string pools are built once per seed and cached on disk, mapping
+    # them is part of the setup rather than of the measured generation
+    return {
+        "batch_size": rows,
+        "rng": np.random.default_rng(10),
+        "pools": string_pools.load_pools(seed=10),
+    }
+
+
+def _loans_setup(rows: int, work_dir: str, _: dict | None) -> dict:
+    inputs = _customers_setup(rows, work_dir, None)
+    inputs["customer_data"] = gen.generate_customer_data_columnar(
+        batch_size=1_000, rng=np.random.default_rng(10)
+    )
+    return inputs
+
+
+def _columnar_loans_setup(rows: int, work_dir: str, _: dict | None) -> dict:
+    inputs = _loans_setup(rows, work_dir, None)
+    inputs["rng"] = np.random.default_rng(10)
+    return inputs
+
+
+def _stream_loans_setup(rows: int, work_dir: str, _: dict | None) -> dict:
+    rng = np.random.default_rng(10)
+    return {
+        "rows": rows,
+        "path": os.path.join(work_dir, "out", "stream-loans.parquet"),
+        "rng": rng,
+        "customer_ids": rng.integers(10**11, 10**12, size=1_000),
+        "customer_income": rng.normal(60_000, 15_000, size=1_000),
+    }
+
+
+def _stream_loans(rows, path, rng, customer_ids, customer_income) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return gen.write_parquet_chunks(
+        path,
+        gen.LOAN_SCHEMA,
+        (
+            gen.generate_loans_from_index(
+                batch_size=min(100_000, rows - start),
+                customer_ids=customer_ids,
+                customer_income=customer_income,
+                rng=rng,
+            )
+            for start in range(0, rows, 100_000)
+        ),
+    )
+
+
+def _pipeline_setup(arrow_native: bool = False, **inputs) -> Callable:
+    """
+    Setup of a pipeline case: a pipeline writing to the Postgres of the
+    configuration, after emptying its loans table, or to a COPY sink, plus the
+    given inputs, each a function of (rows, work_dir)
+    """
+
+    def setup(rows: int, work_dir: str, postgres_config: dict | None) -> dict:
+        fs_path = os.path.join(work_dir, "out", "dataset")
+        if os.path.exists(fs_path):
+            fsspec.filesystem("file").rm(fs_path, recursive=True)
+        if postgres_config:
+            pipeline = Pipeline(arrow_native=arrow_native)
+            with pipeline.connection(postgres_config) as conn:
+                with conn.cursor() as c:
+                    c.execute("TRUNCATE loans")
+                conn.commit()
+        else:
+            pipeline = SinkPipeline(ddl_column_types(), arrow_native=arrow_native)
+        return {
+            "pipeline": pipeline,
+            "fs": fsspec.filesystem("file"),
+            "fs_path": fs_path,
+            "config": postgres_config or {},
+            **{name: make(rows, work_dir) for name, make in inputs.items()},
+        }
+
+    return setup
+
+
+CASES = [
+    Case(
+        "generate_customer_data",
+        _customers_setup,
+        gen.generate_customer_data,
+        max_rows=100_000,
+    ),
+    Case(
+        "generate_customer_data_columnar",
+        _columnar_customers_setup,
+        gen.generate_customer_data_columnar,
+        max_rows=1_000_000,
+    ),
+    Case(
+        "generate_loans_data",
+        _loans_setup,
+        gen.generate_loans_data,
+        max_rows=100_000,
+    ),
+    Case(
+        "generate_loans_data_columnar",
+        _columnar_loans_setup,
+        gen.generate_loans_data_columnar,
+    ),
+    Case("write_parquet_chunks", _stream_loans_setup, _stream_loans),
+    Case(
+        "local_to_fs_transfer",
+        _pipeline_setup(local_path=loans_parquet),
+        lambda pipeline, fs, fs_path, config, local_path: pipeline.local_to_fs_transfer(
+            local_path=local_path, fs_path=fs_path, fs=fs
+        ),
+    ),
+    Case(
+        "local_to_fs_transfer_arrow",
+        _pipeline_setup(arrow_native=True, local_path=loans_parquet),
+        lambda pipeline, fs, fs_path, config, local_path: pipeline.local_to_fs_transfer(
+            local_path=local_path, fs_path=fs_path, fs=fs
+        ),
+    ),
+    Case(
+        "read_from_fs",
+        _pipeline_setup(dataset=loans_dataset),
+        lambda pipeline, fs, fs_path, config, dataset: pipeline.read_from_fs(
+            path=dataset, fs=fs
+        ),
+    ),
+    Case(
+        "read_table_from_fs",
+        _pipeline_setup(dataset=loans_dataset),
+        lambda pipeline, fs, fs_path, config, dataset: pipeline.read_table_from_fs(
+            path=dataset, fs=fs
+        ),
+    ),
+    Case(
+        "write_to_postgres",
+        _pipeline_setup(df=lambda rows, work_dir: pd.read_parquet(
+            loans_parquet(rows, work_dir)
+        )),
+        lambda pipeline, fs, fs_path, config, df: pipeline.write_to_postgres(
+            df=df, config=config, table_name="loans"
+        ),
+    ),
+    Case(
+        "write_to_postgres_binary",
+        _pipeline_setup(table=lambda rows, work_dir: pq.read_table(
+            loans_parquet(rows, work_dir)
+        )),
+        lambda pipeline, fs, fs_path, config, table: pipeline.write_to_postgres_binary(
+            data=table, config=config, table_name="loans"
+        ),
+    ),
+    Case(
+        "fs_to_postgres_transfer",
+        _pipeline_setup(dataset=loans_dataset),
+        lambda pipeline, fs, fs_path, config, dataset: pipeline.fs_to_postgres_transfer(
+            path=dataset, fs=fs, config=config, table_name="loans"
+        ),
+    ),
+    Case(
+        "fs_to_postgres_transfer_binary",
+        _pipeline_setup(dataset=loans_dataset),
+        lambda pipeline, fs, fs_path, config, dataset: pipeline.fs_to_postgres_transfer(
+            path=dataset, fs=fs, config=config, table_name="loans", binary=True
+        ),
+    ),
+    Case(
+        "tee_transfer",
+        _pipeline_setup(local_path=loans_parquet),
+        lambda pipeline, fs, fs_path, config, local_path: pipeline.tee_transfer(
+            local_path=local_path,
+            fs_path=fs_path,
+            fs=fs,
+            config=config,
+            table_name="loans",
+        ),
+    ),
+]
+
+
+class _RssSampler:
+    """
+    Highest resident set size of the process while the sampler runs, read
+    from /proc/self/statm every interval seconds
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.start = _rss_bytes()
+        self.peak = self.start
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "_RssSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_bytes())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss_bytes())
+
+
+def _rss_bytes() -> int:
+    """
+    Current resident set size of the process
+    """
+    with open("/proc/self/statm", encoding="ascii") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+def run_case(
+    name: str,
+    rows: int,
+    work_dir: str,
+    repeat: int,
+    postgres_config: dict | None = None,
+) -> Result:
+    """
+    Run a case repeat times and keep the fastest run, in the current process
+    """
+    case = next(case for case in CASES if case.name == name)
+    best, peak_delta = None, 0
+    for _ in range(repeat):
+        inputs = case.setup(rows, work_dir, postgres_config)
+        with _RssSampler() as rss, metrics.stage("benchmark", case=name) as stage:
+            case.run(**inputs)
+        peak_delta = max(peak_delta, rss.peak - rss.start)
+        if best is None or stage.wall_seconds < best.wall_seconds:
+            best = stage
+        del inputs
+    return Result(
+        case=name,
+        rows=rows,
+        seconds=best.wall_seconds,
+        cpu_seconds=best.cpu_seconds,
+        rows_per_sec=rows / best.wall_seconds if best.wall_seconds else 0.0,
+        peak_rss_delta_bytes=peak_delta,
+    )
+
+
+def run_benchmarks(
+    row_counts: list[int],
+    case_names: list[str] | None = None,
+    work_dir: str | None = None,
+    repeat: int = 3,
+    postgres_config: dict | None = None,
+) -> list[Result]:
+    """
+    Run every selected case at every row count it supports, each in a fresh
+    process so that memory measurements do not carry over between cases
+    Args:
+        row_counts (list[int]): row counts to run at
+        case_names (list[str], optional): cases to run, all if not set
+        work_dir (str, optional): directory of the cached inputs and outputs,
+            a temporary directory if not set
+        repeat (int): runs per case and row count, the fastest is kept
+        postgres_config (dict, optional): Postgres to load, whose loans table
+            is emptied before every run, a COPY sink if not set
+    Returns:
+        list[Result]: results in run order
+    """
+    unknown = set(case_names or []) - {case.name for case in CASES}
+    if unknown:
+        raise ValueError(f"Unknown benchmark cases {sorted(unknown)}")
+    with tempfile.TemporaryDirectory() as tmp:
+        work_dir = work_dir or tmp
+        results = []
+        for rows in row_counts:
+            for case in CASES:
+                if case_names and case.name not in case_names:
+                    continue
+                if case.max_rows is not None and rows > case.max_rows:
+                    continue
+                with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(
+                        run_case, case.name, rows, work_dir, repeat, postgres_config
+                    ).result()
+                print(
+                    f"{result.key:48} {result.seconds:9.3f}s "
+                    f"{result.rows_per_sec:14,.0f} rows/s "
+                    f"{result.peak_rss_delta_bytes / 2**20:9.1f} MiB",
+                    flush=True,
+                )
+                results.append(result)
+    return results
+
+
+def compare(results: list[Result], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare results with a baseline
+    Args:
+        results (list[Result]): results of this run
+        baseline (dict): results of the baseline run by key
+        tolerance (float): allowed relative loss of throughput and growth of
+            memory, e.g. 0.2 for 20%
+    Returns:
+        list[str]: description of every regression
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if previous is None:
+            continue
+        speed = result.rows_per_sec / previous["rows_per_sec"] - 1
+        memory = (result.peak_rss_delta_bytes + 2**20) / (
+            previous["peak_rss_delta_bytes"] + 2**20
+        ) - 1
+        print(f"{result.key:48} throughput {speed:+7.1%} memory {memory:+7.1%}")
+        if speed < -tolerance:
+            regressions.append(f"{result.key} throughput {speed:+.1%}")
+        if memory > tolerance:
+            regressions.append(f"{result.key} memory {memory:+.1%}")
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=ROW_COUNTS)
+    parser.add_argument(
+        "--case",
+        action="append",
+        choices=[case.name for case in CASES],
+        help="case to run, repeatable, all if not set",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--work-dir", help="directory the generated inputs are cached in"
+    )
+    parser.add_argument(
+        "--postgres-config",
+        type=json.loads,
+        help='JSON connection configuration of a local Postgres, e.g. '
+        '\'{"database": "staging", "host": "localhost"}\', a COPY sink if not set',
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store the results as the baseline instead of comparing",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="write the results as JSON")
+    return parser.parse_args()
+
+
+def main() -> int:
+    """
+    Run the benchmarks and compare them with the baseline
+    Returns:
+        int: exit status, 1 if a case regressed
+    """
+    args = parse_args()
+    started = time.perf_counter()
+    results = run_benchmarks(
+        row_counts=args.rows,
+        case_names=args.case,
+        work_dir=args.work_dir,
+        repeat=args.repeat,
+        postgres_config=args.postgres_config,
+    )
+    print(f"Ran {len(results)} benchmarks in {time.perf_counter() - started:.1f}s")
+    by_key = {result.key: asdict(result) for result in results}
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(list(by_key.values()), f, indent=2)
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="UTF-8") as f:
+                baseline = json.load(f)
+        with open(args.baseline, "w", encoding="UTF-8") as f:
+            json.dump({**baseline, **by_key}, f, indent=2, sort_keys=True)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+    with open(args.baseline, encoding="UTF-8") as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
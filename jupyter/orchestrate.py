@@ -0,0 +1,225 @@
+"""
+Single-process entry point of the container: generate the mock data, apply the
+schema migrations and run the ETL pipeline as selectable steps. The modules of
+a step are imported only when it runs and the Postgres configuration and S3
+client are created once, and an import time and startup breakdown is reported
+at the end.
+
+Arguments after "--" are passed to the ETL step, see ETL/pipeline.py --help,
+and the --generate-args string to the generate step, see
+setup/generate_mock_data.py --help.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import shlex
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from types import ModuleType
+
+LOADED_AT = time.time()
+STARTED = time.perf_counter()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# ETL/ goes first: its ETL.py module must win over the ETL/ directory itself,
+# which is importable as a namespace package from ROOT
+sys.path[:0] = [os.path.join(ROOT, "ETL"), os.path.join(ROOT, "setup")]
+# pylint: disable=wrong-import-position
+from config import create_postgress_config
+
+STEPS = ["generate", "ddl", "etl"]
+# modules every step imports, heaviest dependencies first so that the report
+# attributes their import time to them rather than to the step modules
+STEP_MODULES = {
+    "generate": ["numpy", "pandas", "pyarrow", "faker", "generate_mock_data"],
+    "ddl": ["psycopg2", "run_ddl"],
+    "etl": ["pyarrow.dataset", "s3fs", "psycopg2", "ETL", "pipeline"],
+}
+
+
+@dataclass
+class StartupReport:
+    """
+    Where the time of a run went
+    Args:
+        interpreter_seconds (float | None): from process creation to the
+            orchestrator being loaded, None where it cannot be measured;
+            accurate to a clock tick
+        imports (dict[str, float]): seconds spent importing every module of
+            STEP_MODULES the first time, in import order
+        steps (dict[str, float]): seconds of every step, imports included
+        total_seconds (float): from the orchestrator being loaded to the end
+            of the last step
+    """
+
+    interpreter_seconds: float | None = None
+    imports: dict[str, float] = field(default_factory=dict)
+    steps: dict[str, float] = field(default_factory=dict)
+    total_seconds: float = 0.0
+
+    def log(self):
+        """
+        Log the breakdown, one line per import and step
+        """
+        lines = ["Startup report"]
+        if self.interpreter_seconds is not None:
+            lines.append(f"  {'interpreter':<32}{self.interpreter_seconds:8.3f}s")
+        for name, seconds in self.imports.items():
+            lines.append(f"  {'import ' + name:<32}{seconds:8.3f}s")
+        for name, seconds in self.steps.items():
+            lines.append(f"  {'step ' + name:<32}{seconds:8.3f}s")
+        lines.append(f"  {'total':<32}{self.total_seconds:8.3f}s")
+        logging.info("\n".join(lines))
+
+
+class Orchestrator:
+    """
+    Runs the steps in one process, sharing the clients they need
+    """
+
+    def __init__(self, report: StartupReport) -> None:
+        """
+        Args:
+            report (StartupReport): report the imports and steps are timed in
+        """
+        self.report = report
+        self._postgress_config: dict | None = None
+        self._fs = None
+
+    def load(self, step: str) -> dict[str, ModuleType]:
+        """
+        Import the modules of a step, timing the ones not imported yet
+        Args:
+            step (str): step name
+        Returns:
+            dict[str, ModuleType]: modules by name
+        """
+        modules = {}
+        for name in STEP_MODULES[step]:
+            if name not in sys.modules:
+                start = time.perf_counter()
+                importlib.import_module(name)
+                self.report.imports[name] = time.perf_counter() - start
+            modules[name] = sys.modules[name]
+        return modules
+
+    @property
+    def postgress_config(self) -> dict:
+        """
+        Postgres connection configuration, read from the environment once
+        """
+        if self._postgress_config is None:
+            self._postgress_config = create_postgress_config()
+        return self._postgress_config
+
+    def run(self, step: str, args: argparse.Namespace):
+        """
+        Run one step
+        Args:
+            step (str): step name
+            args (argparse.Namespace): orchestrator arguments
+        """
+        start = time.perf_counter()
+        modules = self.load(step)
+        if step == "generate":
+            generate_mock_data = modules["generate_mock_data"]
+            generate_mock_data.main(
+                **vars(generate_mock_data.parse_args(shlex.split(args.generate_args)))
+            )
+        elif step == "ddl":
+            modules["run_ddl"].main(postgress_config=self.postgress_config)
+        elif step == "etl":
+            pipeline = modules["pipeline"]
+            if self._fs is None:
+                self._fs = pipeline.create_fs()
+            pipeline.main(
+                **vars(pipeline.parse_args(args.etl_args)),
+                fs=self._fs,
+                postgress_config=self.postgress_config,
+            )
+        self.report.steps[step] = time.perf_counter() - start
+
+
+def main(args: argparse.Namespace) -> StartupReport:
+    """
+    Run the selected steps in order
+    Args:
+        args (argparse.Namespace): parsed arguments, see parse_args
+    Returns:
+        StartupReport: import time and startup breakdown of the run
+    """
+    report = StartupReport(interpreter_seconds=_interpreter_seconds())
+    orchestrator = Orchestrator(report)
+    try:
+        for step in STEPS:
+            if step in args.steps:
+                logging.info("Running step %s", step)
+                orchestrator.run(step, args)
+    finally:
+        report.total_seconds = time.perf_counter() - STARTED
+        report.log()
+        if args.report_path:
+            with open(args.report_path, "w", encoding="utf-8") as f:
+                json.dump(asdict(report), f, indent=2)
+    return report
+
+
+def _interpreter_seconds() -> float | None:
+    """
+    Seconds from the creation of this process to the orchestrator being
+    loaded, from the process start time in clock ticks since boot and the
+    uptime of the system, on Linux only
+    """
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as f:
+            # the fields after the parenthesized command name, starttime is
+            # the 22nd field of the line
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="utf-8") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    age = uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    return max(age - (time.time() - LOADED_AT), 0.0)
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--steps",
+        type=lambda value: value.split(","),
+        default=STEPS,
+        help=f"comma separated steps to run, of {','.join(STEPS)}",
+    )
+    parser.add_argument(
+        "--generate-args",
+        default="",
+        help='arguments of the generate step, e.g. --generate-args="--mode '
+        'sharded --customers 1000000 --loans 5000000", see '
+        "setup/generate_mock_data.py --help",
+    )
+    parser.add_argument(
+        "--report-path", help="write the startup report to this JSON file"
+    )
+    parser.add_argument("etl_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    unknown = [step for step in args.steps if step not in STEPS]
+    if unknown:
+        parser.error(f"unknown steps {unknown}, choose from {STEPS}")
+    if args.etl_args[:1] == ["--"]:
+        args.etl_args = args.etl_args[1:]
+    return args
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(parse_args())
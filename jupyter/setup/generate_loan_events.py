@@ -0,0 +1,153 @@
+"""
+Continuous stream of loan events, originations of new loans and status
+changes of the loans originated earlier, emitted at a target rate
+"""
+
+import time
+from collections import deque
+from datetime import datetime
+from threading import Event
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import compute as pc
+
+from generate_mock_data import LOAN_SCHEMA, LOAN_STATUSES, generate_loans_from_index
+
+ORIGINATION = "origination"
+STATUS_CHANGE = "status_change"
+EVENT_SCHEMA = LOAN_SCHEMA.append(pa.field("event_type", pa.string())).append(
+    pa.field("event_time", pa.timestamp("us"))
+)
+
+
+def generate_loan_events(
+    customer_ids: np.ndarray,
+    customer_income: np.ndarray,
+    rate: float,
+    duration: float | None = None,
+    status_change_ratio: float = 0.3,
+    tick: float = 0.05,
+    open_loans: int = 100_000,
+    rng: np.random.Generator | None = None,
+    stop: Event | None = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Emit loan events at rate events per second, one batch per tick. An
+    origination is a full loans row starting on the day it is emitted; a
+    status change carries the key of a loan originated earlier in the
+    stream and its new status, the other columns are NULL. Every event is
+    stamped with the time it was emitted, so consumers can measure their end
+    to end latency. When the consumer falls behind, the events due are
+    emitted in one larger batch instead of being dropped.
+    Args:
+        customer_ids (np.ndarray): ids of the customers the loans are drawn
+            against
+        customer_income (np.ndarray): income of each customer, NaN if unknown
+        rate (float): target events per second
+        duration (float, optional): seconds to emit for, until stop is set
+            if not set
+        status_change_ratio (float): share of the events that are status
+            changes, once loans were originated
+        tick (float): seconds between batches
+        open_loans (int): most recent originations status changes are drawn
+            from
+        rng (np.random.Generator, optional): random generator
+        stop (Event, optional): event that ends the stream when set
+    Yields:
+        pa.RecordBatch: events with EVENT_SCHEMA
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    # (loan_id, start_date) of the most recent originations
+    originated: deque[tuple[str, object]] = deque(maxlen=open_loans)
+    start = time.perf_counter()
+    emitted = 0
+    while not (stop is not None and stop.is_set()):
+        elapsed = time.perf_counter() - start
+        if duration is not None and elapsed >= duration:
+            break
+        due = int(rate * elapsed) - emitted
+        if due <= 0:
+            time.sleep(tick)
+            continue
+        changes = rng.binomial(due, status_change_ratio) if originated else 0
+        batch = _events(
+            due - changes, changes, customer_ids, customer_income, originated, rng
+        )
+        emitted += due
+        yield batch
+
+
+def _events(
+    originations: int,
+    changes: int,
+    customer_ids: np.ndarray,
+    customer_income: np.ndarray,
+    originated: deque,
+    rng: np.random.Generator,
+) -> pa.RecordBatch:
+    """
+    One batch of originations followed by status changes, all stamped now
+    """
+    now = datetime.now()
+    loans = pa.Table.from_pandas(
+        generate_loans_from_index(
+            batch_size=originations,
+            customer_ids=customer_ids,
+            customer_income=customer_income,
+            rng=rng,
+            as_of=now,
+        ),
+        schema=LOAN_SCHEMA,
+        preserve_index=False,
+    ).replace_schema_metadata()
+    # originations start the day they are emitted
+    today = pa.scalar(now.date(), pa.date32())
+    terms = pa.array(rng.integers(180, 1096, size=originations), pa.int32())
+    loans = loans.set_column(
+        loans.schema.get_field_index("start_date"),
+        "start_date",
+        pa.array([now.date()] * originations, pa.date32()),
+    ).set_column(
+        loans.schema.get_field_index("end_date"),
+        "end_date",
+        pc.if_else(
+            pc.is_null(loans["end_date"]),
+            pa.scalar(None, pa.date32()),
+            pc.cast(pc.add(pc.cast(today, pa.int32()), terms), pa.date32()),
+        ),
+    )
+    originated.extend(zip(loans["loan_id"].to_pylist(), [now.date()] * originations))
+
+    keys = [originated[i] for i in rng.integers(0, len(originated), size=changes)]
+    status = pa.array(
+        np.asarray(LOAN_STATUSES, dtype=np.float64)[
+            rng.integers(0, len(LOAN_STATUSES), size=changes)
+        ]
+    )
+    updates = pa.table(
+        {
+            name: pa.nulls(changes, field.type)
+            for name, field in zip(LOAN_SCHEMA.names, LOAN_SCHEMA)
+        }
+    )
+    updates = (
+        updates.set_column(
+            0, "loan_id", pa.array([key[0] for key in keys], pa.string())
+        )
+        .set_column(
+            LOAN_SCHEMA.get_field_index("start_date"),
+            "start_date",
+            pa.array([key[1] for key in keys], pa.date32()),
+        )
+        .set_column(LOAN_SCHEMA.get_field_index("status"), "status", status)
+    )
+    events = pa.concat_tables([loans, updates])
+    events = events.append_column(
+        "event_type",
+        pa.array([ORIGINATION] * originations + [STATUS_CHANGE] * changes),
+    ).append_column(
+        "event_time", pa.array([now] * events.num_rows, pa.timestamp("us"))
+    )
+    return events.cast(EVENT_SCHEMA).combine_chunks().to_batches()[0]
@@ -3,16 +3,108 @@ This script generates mock data for the Customers and Loans tables
 and writes them to S3 in Parquet format.
 """
 
+import argparse
+import math
 import os
 import random
-from datetime import timedelta, datetime
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+from pyarrow import parquet as pq
 from faker import Faker
 
+# metrics is shared with the ETL pipeline, ETL/ is put on the import path by
+# the entry point (PYTHONPATH of the container, orchestrate.py, benchmarks)
+import metrics
+from string_pools import StringPools, load_pools
+
 fake = Faker()
 
+SECTORS = [
+    "Retail",
+    "Healthcare",
+    "Education",
+    "Technology",
+    "Finance",
+    "Government",
+]
+SECTOR_WEIGHTS = [0.25, 0.15, 0.15, 0.20, 0.15, 0.10]
+EDUCATION_LEVELS = [
+    "High School",
+    "Associate's Degree",
+    "Bachelor's Degree",
+    "Master's Degree",
+    "Doctorate",
+]
+EDUCATION_LEVEL_WEIGHTS = [0.2, 0.2, 0.25, 0.15, 0.2]
+EMPLOYMENT_STATUSES = ["Employed", "Unemployed", "Self-employed"]
+EMPLOYMENT_STATUS_WEIGHTS = [0.7, 0.25, 0.05]
+CB_PERSON_DEFAULT_ON_FILE = ["Y", "N"]
+CB_PERSON_DEFAULT_ON_FILE_WEIGHTS = [0.1, 0.9]
+GENDERS = ["Male", "Female"]
+LOAN_INTENTS = [
+    "Personal",
+    "Mortgage",
+    "Education",
+    "Business",
+    "Medical",
+    "Venture",
+    "Home improvement",
+    "Debt consolidation",
+]
+LOAN_INTENT_WEIGHTS = [10, 20, 15, 15, 5, 5, 10, 20]
+LOAN_STATUSES = [1, 0]
+REPAYMENT_METHODS = ["Monthly", "Bi-weekly"]
+PERSONAL_LOAN_PURPOSES = ["Home Renovation", "Vacation", "Wedding", "Debt Consolidation"]
+BUSINESS_LOAN_PURPOSES = ["Startup Capital", "Expansion", "Equipment Purchase"]
+NULL_PROBABILITY = 0.05
+# 8-digit customer ids
+CUSTOMER_ID_LOW, CUSTOMER_ID_HIGH = 10**7, 10**8
+
+CUSTOMER_SCHEMA = pa.schema(
+    [
+        ("customer_id", pa.int64()),
+        ("name", pa.string()),
+        ("gender", pa.string()),
+        ("sector", pa.string()),
+        ("date_of_birth", pa.timestamp("ns")),
+        ("address", pa.string()),
+        ("city", pa.string()),
+        ("country", pa.string()),
+        ("phone_number", pa.string()),
+        ("email", pa.string()),
+        ("income", pa.float64()),
+        ("employment_status", pa.string()),
+        ("years_of_employment", pa.int64()),
+        ("cb_person_default_on_file", pa.string()),
+        ("cb_preson_cred_hist_length", pa.int64()),
+        ("education_level", pa.string()),
+    ]
+)
+LOAN_SCHEMA = pa.schema(
+    [
+        ("loan_id", pa.string()),
+        ("customer_id", pa.int64()),
+        ("loan_amount", pa.int64()),
+        ("interest_rate", pa.float64()),
+        ("start_date", pa.date32()),
+        ("end_date", pa.date32()),
+        ("status", pa.float64()),
+        ("loan_intent", pa.string()),
+        ("credit_score", pa.int64()),
+        ("loan_term", pa.int64()),
+        ("loan_grade", pa.string()),
+        ("repayment_method", pa.string()),
+        ("collateral_value", pa.int64()),
+        ("loan_purpose", pa.string()),
+    ]
+)
+
 
+@metrics.instrument()
 def generate_customer_data(batch_size: int) -> pd.DataFrame:
     """
     Generate sample data for Customers table
@@ -22,35 +114,13 @@ def generate_customer_data(batch_size: int) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame with sample data
     """
-    sectors = [
-        "Retail",
-        "Healthcare",
-        "Education",
-        "Technology",
-        "Finance",
-        "Government",
-    ]
-    sector_weights = [0.25, 0.15, 0.15, 0.20, 0.15, 0.10]
-    education_level = [
-        "High School",
-        "Associate's Degree",
-        "Bachelor's Degree",
-        "Master's Degree",
-        "Doctorate",
-    ]
-    education_level_weights = [0.2, 0.2, 0.25, 0.15, 0.2]
-    employment_status = ["Employed", "Unemployed", "Self-employed"]
-    employment_status_weights = [0.7, 0.25, 0.05]
-    cb_person_default_on_file = ["Y", "N"]
-    cb_person_default_on_file_weights = [0.1, 0.9]
-    genders = ["Male", "Female"]
     data = []
     for _ in range(batch_size):
         customer_data = {
             "customer_id": fake.random_number(digits=8, fix_len=True),
             "name": fake.name(),
-            "gender": random.choice(genders),
-            "sector": random.choices(sectors, weights=sector_weights)[0],
+            "gender": random.choice(GENDERS),
+            "sector": random.choices(SECTORS, weights=SECTOR_WEIGHTS)[0],
             "date_of_birth": datetime.now()
             - timedelta(
                 days=int(
@@ -67,22 +137,22 @@ def generate_customer_data(batch_size: int) -> pd.DataFrame:
             "email": fake.email(),
             "income": round(random.triangular(4000, 200000, 13000), 2),
             "employment_status": random.choices(
-                employment_status,
-                weights=employment_status_weights,
+                EMPLOYMENT_STATUSES,
+                weights=EMPLOYMENT_STATUS_WEIGHTS,
             )[0],
             "years_of_employment": np.random.exponential(5, 1)[0],
             "cb_person_default_on_file": random.choices(
-                cb_person_default_on_file,
-                weights=cb_person_default_on_file_weights,
+                CB_PERSON_DEFAULT_ON_FILE,
+                weights=CB_PERSON_DEFAULT_ON_FILE_WEIGHTS,
             )[0],
             "cb_preson_cred_hist_length": max(0, min(30, np.random.lognormal(0.5, 1))),
             "education_level": random.choices(
-                education_level, weights=education_level_weights
+                EDUCATION_LEVELS, weights=EDUCATION_LEVEL_WEIGHTS
             )[0],
         }
         for key in customer_data:
             if (
-                key != "customer_id" and random.random() < 0.05
+                key != "customer_id" and random.random() < NULL_PROBABILITY
             ):  # Adjust the probability as needed
                 customer_data[key] = None
         data.append(customer_data)
@@ -96,6 +166,156 @@ def generate_customer_data(batch_size: int) -> pd.DataFrame:
     return df
 
 
+@metrics.instrument()
+def generate_customer_data_columnar(
+    batch_size: int,
+    rng: np.random.Generator | None = None,
+    as_of: datetime | None = None,
+    pools: StringPools | None = None,
+    customer_ids: np.ndarray | None = None,
+) -> pd.DataFrame:
+    """
+    Generate sample data for Customers table one column at a time.
+    Same columns, distributions and dtypes as generate_customer_data, but
+    every numeric and categorical column is drawn as a whole array and the
+    Faker columns are sampled from precomputed string pools, with emails
+    derived from the names.
+    Args:
+        batch_size (int): Number of rows to generate
+        rng (np.random.Generator, optional): seeded random generator
+        as_of (datetime, optional): reference time for the dates, now if not set
+        pools (StringPools, optional): pools of the Faker columns, the
+            default en_US pools if not set
+        customer_ids (np.ndarray, optional): ids of the rows, distinct ids
+            from customer_id_column if not set
+
+    Returns:
+        pd.DataFrame: DataFrame with sample data
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    if customer_ids is None:
+        customer_ids = customer_id_column(int(rng.integers(2**32)), 0, batch_size)
+    as_of = as_of or datetime.now()
+    pools = pools or load_pools()
+    names, emails = pools.names_and_emails(rng, batch_size)
+    age_years = np.clip(
+        rng.lognormal(mean=np.log(30), sigma=0.25, size=batch_size), 18, 140
+    ).astype(np.int64)
+    columns = {
+        "customer_id": customer_ids,
+        "name": _pool_column(names),
+        "gender": _choice_column(rng, GENDERS, None, batch_size),
+        "sector": _choice_column(rng, SECTORS, SECTOR_WEIGHTS, batch_size),
+        "date_of_birth": np.datetime64(as_of, "ns")
+        - (age_years * 365).astype("timedelta64[D]"),
+        "address": _pool_column(pools.sample("street_address", rng, batch_size)),
+        "city": _pool_column(pools.sample("city", rng, batch_size)),
+        "country": _pool_column(pools.sample("country", rng, batch_size)),
+        "phone_number": _pool_column(pools.sample("phone_number", rng, batch_size)),
+        "email": _pool_column(emails),
+        "income": np.round(
+            rng.triangular(left=4000, mode=13000, right=200000, size=batch_size), 2
+        ),
+        "employment_status": _choice_column(
+            rng, EMPLOYMENT_STATUSES, EMPLOYMENT_STATUS_WEIGHTS, batch_size
+        ),
+        "years_of_employment": rng.exponential(5, size=batch_size),
+        "cb_person_default_on_file": _choice_column(
+            rng,
+            CB_PERSON_DEFAULT_ON_FILE,
+            CB_PERSON_DEFAULT_ON_FILE_WEIGHTS,
+            batch_size,
+        ),
+        "cb_preson_cred_hist_length": np.clip(
+            rng.lognormal(0.5, 1, size=batch_size), 0, 30
+        ),
+        "education_level": _choice_column(
+            rng, EDUCATION_LEVELS, EDUCATION_LEVEL_WEIGHTS, batch_size
+        ),
+    }
+    _inject_nulls(columns, rng, keep=("customer_id",))
+    df = pd.DataFrame(columns)
+    df["cb_preson_cred_hist_length"] = (
+        df["cb_preson_cred_hist_length"].round().astype(pd.Int64Dtype())
+    )
+    df["years_of_employment"] = (
+        df["years_of_employment"].round().astype(pd.Int64Dtype())
+    )
+    return df
+
+
+def customer_id_column(seed: int, start: int, size: int) -> np.ndarray:
+    """
+    Distinct 8-digit customer ids of the customers at positions start to
+    start + size of a run. Positions are mapped through an affine permutation
+    of the id range keyed by seed, so the ids look random but never repeat
+    within a run, however it is split into chunks and shards.
+    Args:
+        seed (int): key of the permutation, the same for the whole run
+        start (int): position of the first customer in the run
+        size (int): number of ids
+
+    Returns:
+        np.ndarray: int64 customer ids
+    """
+    span = CUSTOMER_ID_HIGH - CUSTOMER_ID_LOW
+    if start + size > span:
+        raise ValueError(f"at most {span} distinct customer ids, got {start + size}")
+    key = np.random.default_rng(seed)
+    multiplier = int(key.integers(1, span))
+    while math.gcd(multiplier, span) != 1:
+        multiplier = int(key.integers(1, span))
+    shift = int(key.integers(0, span))
+    positions = np.arange(start, start + size, dtype=np.int64)
+    return CUSTOMER_ID_LOW + (positions * multiplier + shift) % span
+
+
+def _pool_column(values: pa.Array) -> np.ndarray:
+    """
+    Object array of the values sampled from a string pool
+    """
+    return values.to_numpy(zero_copy_only=False)
+
+
+def _choice_column(
+    rng: np.random.Generator, values: list, weights: list | None, size: int
+) -> np.ndarray:
+    """
+    Draw a categorical column with the given (unnormalized) weights
+    """
+    p = None
+    if weights is not None:
+        p = np.asarray(weights, dtype=np.float64)
+        p = p / p.sum()
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=p)]
+
+
+def _inject_nulls(
+    columns: dict, rng: np.random.Generator, keep: tuple = ()
+) -> None:
+    """
+    Null out NULL_PROBABILITY of the values of every column not listed in keep
+    Args:
+        columns (dict): column name to NumPy array, modified in place
+        rng (np.random.Generator): random generator
+        keep (tuple): columns that never receive nulls
+    """
+    names = [name for name in columns if name not in keep]
+    size = len(columns[names[0]])
+    mask = rng.random((len(names), size)) < NULL_PROBABILITY
+    for name, null_rows in zip(names, mask):
+        values = columns[name]
+        if values.dtype == object:
+            values[null_rows] = None
+        elif values.dtype.kind == "M":
+            values[null_rows] = np.datetime64("NaT")
+        else:
+            values = values.astype(np.float64)
+            values[null_rows] = np.nan
+        columns[name] = values
+
+
+@metrics.instrument()
 def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.DataFrame:
     """
     Generate sample data for Loans table
@@ -106,35 +326,23 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
     Returns:
         pd.DataFrame: DataFrame with sample data
     """
-    loan_intents = [
-        "Personal",
-        "Mortgage",
-        "Education",
-        "Business",
-        "Medical",
-        "Venture",
-        "Home improvement",
-        "Debt consolidation",
-    ]
-    loan_intent_weights = [10, 20, 15, 15, 5, 5, 10, 20]
-    loan_status = [1, 0]
-    repayment_methods = ["Monthly", "Bi-weekly"]
+    customer_ids = customer_data["customer_id"].to_numpy()
+    customer_incomes = customer_data["income"].to_numpy()
     data = []
     for _ in range(batch_size):
         loan_id = fake.uuid4()
-        customer_id = random.choice(customer_data["customer_id"])
-        customer_income = customer_data.loc[
-            customer_data["customer_id"] == customer_id, "income"
-        ].iloc[0]
+        position = random.randrange(len(customer_ids))
+        customer_id = customer_ids[position]
+        customer_income = customer_incomes[position]
         interest_rate = round(random.uniform(2, 12), 2)
         start_date = fake.date_between(start_date="-2y", end_date="today")
         end_date = start_date + timedelta(
             days=random.randint(180, 1095)
         )  # Loan term between 6 and 36 months
         status = random.choices(
-            loan_status, weights=[random.uniform(0, 0.3), 1 - random.uniform(0, 0.3)]
+            LOAN_STATUSES, weights=[random.uniform(0, 0.3), 1 - random.uniform(0, 0.3)]
         )[0]
-        loan_intent = random.choices(loan_intents, weights=loan_intent_weights)[0]
+        loan_intent = random.choices(LOAN_INTENTS, weights=LOAN_INTENT_WEIGHTS)[0]
         if customer_income > 0:
             credit_score = max(
                 300,
@@ -170,7 +378,7 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
             collateral_value = random.randint(0, 50000)
             loan_amount = random.randint(1000, 50000)
         loan_term = random.randint(12, 60)
-        repayment_method = random.choice(repayment_methods)
+        repayment_method = random.choice(REPAYMENT_METHODS)
         loan_purpose = get_loan_purpose(loan_intent)
         loan_grade = get_loan_grade(credit_score)
         loans_data = {
@@ -191,7 +399,9 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
         }
         for key in loans_data:
             if (
-                key != "loan_id" and key != "customer_id" and random.random() < 0.05
+                key != "loan_id"
+                and key != "customer_id"
+                and random.random() < NULL_PROBABILITY
             ):  # Adjust the probability as needed
                 loans_data[key] = None
         data.append(loans_data)
@@ -203,6 +413,237 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
     return df
 
 
+@metrics.instrument()
+def generate_loans_data_columnar(
+    batch_size: int,
+    customer_data: pd.DataFrame,
+    rng: np.random.Generator | None = None,
+) -> pd.DataFrame:
+    """
+    Generate sample data for Loans table one column at a time
+    Args:
+        batch_size (int): number of rows to generate
+        customer_data (pd.DataFrame): Customer data to use for generating loans
+        rng (np.random.Generator, optional): seeded random generator
+
+    Returns:
+        pd.DataFrame: DataFrame with sample data
+    """
+    return generate_loans_from_index(
+        batch_size=batch_size,
+        customer_ids=customer_data["customer_id"].to_numpy(),
+        customer_income=customer_data["income"].to_numpy(
+            dtype=np.float64, na_value=np.nan
+        ),
+        rng=rng,
+    )
+
+
+@metrics.instrument()
+def generate_loans_from_index(
+    batch_size: int,
+    customer_ids: np.ndarray,
+    customer_income: np.ndarray,
+    rng: np.random.Generator | None = None,
+    as_of: datetime | None = None,
+) -> pd.DataFrame:
+    """
+    Generate sample data for Loans table against positional customer arrays.
+    Customers are sampled by position, so the cost does not depend on the
+    number of customers, and every derived column is computed from the
+    sampled income vector with array operations.
+    Args:
+        batch_size (int): number of rows to generate
+        customer_ids (np.ndarray): customer ids
+        customer_income (np.ndarray): income of each customer, NaN if unknown
+        rng (np.random.Generator, optional): seeded random generator
+        as_of (datetime, optional): reference time for the dates, now if not set
+
+    Returns:
+        pd.DataFrame: DataFrame with sample data, same columns and dtypes as
+            generate_loans_data
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    as_of = as_of or datetime.now()
+    positions = rng.integers(0, len(customer_ids), size=batch_size)
+    income = customer_income[positions]
+    start_date = np.datetime64(as_of.date(), "D") - rng.integers(
+        0, 731, size=batch_size
+    ).astype("timedelta64[D]")
+    # Loan term between 6 and 36 months
+    end_date = start_date + rng.integers(180, 1096, size=batch_size).astype(
+        "timedelta64[D]"
+    )
+    default_weight = rng.uniform(0, 0.3, size=batch_size)
+    paid_weight = 1 - rng.uniform(0, 0.3, size=batch_size)
+    status = np.where(
+        rng.random(batch_size) * (default_weight + paid_weight) < default_weight,
+        LOAN_STATUSES[0],
+        LOAN_STATUSES[1],
+    )
+    loan_intent = _choice_column(rng, LOAN_INTENTS, LOAN_INTENT_WEIGHTS, batch_size)
+
+    has_income = income > 0
+    credit_score = np.where(
+        has_income,
+        np.clip(
+            np.trunc(
+                _triangular(
+                    rng, 0.005 * income, 0.012 * income, 0.008 * income, batch_size
+                )
+            ),
+            300,
+            800,
+        ),
+        rng.integers(600, 801, size=batch_size),
+    ).astype(np.int64)
+    collateral_value = np.where(
+        has_income,
+        np.clip(
+            np.trunc(_triangular(rng, 0, 0.2 * income, 0.5 * income, batch_size)),
+            0,
+            50000,
+        ),
+        rng.integers(0, 50001, size=batch_size),
+    ).astype(np.int64)
+    loan_amount = np.where(
+        has_income,
+        np.round(
+            _triangular(
+                rng, 0.2 * income, 0.5 * income, 0.8 * income, batch_size
+            )
+        ),
+        rng.integers(1000, 50001, size=batch_size),
+    ).astype(np.int64)
+
+    columns = {
+        "loan_id": uuid4_column(rng, batch_size),
+        "customer_id": customer_ids[positions],
+        "loan_amount": loan_amount,
+        "interest_rate": np.round(rng.uniform(2, 12, size=batch_size), 2),
+        "start_date": start_date.astype(object),
+        "end_date": end_date.astype(object),
+        "status": status,
+        "loan_intent": loan_intent,
+        "credit_score": credit_score,
+        "loan_term": rng.integers(12, 61, size=batch_size),
+        "loan_grade": _loan_grade_column(rng, credit_score),
+        "repayment_method": _choice_column(rng, REPAYMENT_METHODS, None, batch_size),
+        "collateral_value": collateral_value,
+        "loan_purpose": _loan_purpose_column(rng, loan_intent),
+    }
+    _inject_nulls(columns, rng, keep=("loan_id", "customer_id"))
+    df = pd.DataFrame(columns)
+    df["loan_amount"] = df["loan_amount"].astype(pd.Int64Dtype())
+    df["credit_score"] = df["credit_score"].astype(pd.Int64Dtype())
+    df["loan_term"] = df["loan_term"].astype(pd.Int64Dtype())
+    df["collateral_value"] = df["collateral_value"].astype(pd.Int64Dtype())
+    return df
+
+
+def uuid4_column(rng: np.random.Generator, size: int) -> np.ndarray:
+    """
+    Generate random version 4 UUID strings in bulk from random bytes
+    Args:
+        rng (np.random.Generator): random generator
+        size (int): number of UUIDs
+
+    Returns:
+        np.ndarray: object array of canonical UUID strings
+    """
+    raw = rng.integers(0, 256, size=(size, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+    hex_digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    digits = np.empty((size, 32), dtype=np.uint8)
+    digits[:, 0::2] = hex_digits[raw >> 4]
+    digits[:, 1::2] = hex_digits[raw & 0x0F]
+    text = np.full((size, 36), ord("-"), dtype=np.uint8)
+    # 8-4-4-4-12 groups, each shifted right by the dashes before it
+    groups = ((0, 8), (8, 12), (12, 16), (16, 20), (20, 32))
+    for dashes, (start, stop) in enumerate(groups):
+        text[:, start + dashes : stop + dashes] = digits[:, start:stop]
+    # 64-bit offsets, 32-bit ones overflow past 2**31 / 36 (~59.6M) UUIDs
+    offsets = np.arange(0, 36 * (size + 1), 36, dtype=np.int64)
+    array = pa.Array.from_buffers(
+        pa.large_string(), size, [None, pa.py_buffer(offsets), pa.py_buffer(text)]
+    )
+    return array.to_numpy(zero_copy_only=False)
+
+
+def _triangular(
+    rng: np.random.Generator, low, high, mode, size: int
+) -> np.ndarray:
+    """
+    Array version of random.triangular(low, high, mode).
+    Unlike rng.triangular it accepts a mode outside [low, high], which the
+    collateral and loan amount formulas rely on.
+    """
+    u = rng.random(size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        c = (mode - low) / (high - low)
+        flip = u > c
+        u = np.where(flip, 1.0 - u, u)
+        c = np.where(flip, 1.0 - c, c)
+        low, high = np.where(flip, high, low), np.where(flip, low, high)
+        values = low + (high - low) * np.sqrt(u * c)
+    return np.where(high == low, low, values)
+
+
+def _loan_grade_column(rng: np.random.Generator, credit_score: np.ndarray) -> np.ndarray:
+    """
+    Array version of get_loan_grade
+    """
+    pick = rng.random(len(credit_score))
+
+    def pick_from(grades: list) -> np.ndarray:
+        return np.asarray(grades, dtype=object)[(pick * len(grades)).astype(np.int64)]
+
+    return np.select(
+        [
+            credit_score >= 750,
+            credit_score >= 700,
+            credit_score >= 650,
+            credit_score >= 600,
+        ],
+        [
+            np.full(len(credit_score), "A", dtype=object),
+            pick_from(["A", "B"]),
+            pick_from(["B", "C"]),
+            pick_from(["C", "D"]),
+        ],
+        default=pick_from(["D", "E", "F", "G"]),
+    )
+
+
+def _loan_purpose_column(rng: np.random.Generator, loan_intent: np.ndarray) -> np.ndarray:
+    """
+    Array version of get_loan_purpose
+    """
+    pick = rng.random(len(loan_intent))
+    personal = np.asarray(PERSONAL_LOAN_PURPOSES, dtype=object)[
+        (pick * len(PERSONAL_LOAN_PURPOSES)).astype(np.int64)
+    ]
+    business = np.asarray(BUSINESS_LOAN_PURPOSES, dtype=object)[
+        (pick * len(BUSINESS_LOAN_PURPOSES)).astype(np.int64)
+    ]
+    return np.select(
+        [
+            loan_intent == "Personal",
+            loan_intent == "Mortgage",
+            loan_intent == "Business",
+            loan_intent == "Education",
+        ],
+        [
+            personal,
+            np.full(len(loan_intent), "Home Purchase", dtype=object),
+            business,
+            np.full(len(loan_intent), "Tuition Fees", dtype=object),
+        ],
+        default="Other",
+    )
+
+
 def get_loan_purpose(loan_intent: str) -> str:
     """
     Generate loan purpose based on loan intent
@@ -213,13 +654,11 @@ def get_loan_purpose(loan_intent: str) -> str:
         str: loan purpose
     """
     if loan_intent == "Personal":
-        return random.choice(
-            ["Home Renovation", "Vacation", "Wedding", "Debt Consolidation"]
-        )
+        return random.choice(PERSONAL_LOAN_PURPOSES)
     elif loan_intent == "Mortgage":
         return "Home Purchase"
     elif loan_intent == "Business":
-        return random.choice(["Startup Capital", "Expansion", "Equipment Purchase"])
+        return random.choice(BUSINESS_LOAN_PURPOSES)
     elif loan_intent == "Education":
         return "Tuition Fees"
     else:
@@ -248,19 +687,361 @@ def get_loan_grade(credit_score: int) -> str:
         return random.choice(["D", "E", "F", "G"])
 
 
-def generate_mock_data():
+@metrics.instrument()
+def generate_mock_data(columnar: bool = False, seed: int = 10):
     """
     Generate mock data for customer and loans tables
+    Args:
+        columnar (bool): draw whole columns from a seeded NumPy generator
+            instead of building the rows one by one
+        seed (int): seed of the random generators
     """
-    random.seed(10)
-    customer_df = generate_customer_data(batch_size=random.randint(1000, 2000))
-    loans_df = generate_loans_data(
-        batch_size=random.randint(3000, 5000), customer_data=customer_df
+    random.seed(seed)
+    np.random.seed(seed)
+    fake.seed_instance(seed)
+    if columnar:
+        rng = np.random.default_rng(seed)
+        customer_df = generate_customer_data_columnar(
+            batch_size=random.randint(1000, 2000), rng=rng, pools=load_pools(seed=seed)
+        )
+        loans_df = generate_loans_data_columnar(
+            batch_size=random.randint(3000, 5000), customer_data=customer_df, rng=rng
+        )
+    else:
+        customer_df = generate_customer_data(batch_size=random.randint(1000, 2000))
+        loans_df = generate_loans_data(
+            batch_size=random.randint(3000, 5000), customer_data=customer_df
+        )
+    home = os.environ["HOME"]
+    for table_name, df in (("customers", customer_df), ("loans", loans_df)):
+        # the part file directory of a previous sharded run
+        _reset_output(f"{home}/work/data/{table_name}.parquet")
+        df.to_parquet(f"{home}/work/data/{table_name}.parquet")
+
+
+@metrics.instrument()
+def stream_mock_data(
+    customer_rows: int | None = None,
+    loan_rows: int | None = None,
+    chunk_size: int = 100_000,
+    seed: int = 10,
+):
+    """
+    Generate mock data for customer and loans tables in fixed-size chunks.
+    Each chunk is appended as a row group through a single Parquet writer per
+    table, and loans are drawn against a compact (customer_id, income) index
+    of 16 bytes per customer instead of the customer frame, so memory does
+    not grow with the number of loans.
+    Args:
+        customer_rows (int, optional): number of customers, random if not set
+        loan_rows (int, optional): number of loans, random if not set
+        chunk_size (int): number of rows generated and written at a time
+        seed (int): seed of the random generators
+    """
+    random.seed(seed)
+    home = os.environ["HOME"]
+    data_dir = f"{home}/work/data"
+    # the part file directories of a previous sharded run
+    for table_name in ("customers", "loans"):
+        _reset_output(f"{data_dir}/{table_name}.parquet")
+    write_mock_data_chunks(
+        customer_path=f"{data_dir}/customers.parquet",
+        loan_path=f"{data_dir}/loans.parquet",
+        customer_rows=(
+            random.randint(1000, 2000) if customer_rows is None else customer_rows
+        ),
+        loan_rows=random.randint(3000, 5000) if loan_rows is None else loan_rows,
+        chunk_size=chunk_size,
+        rng=np.random.default_rng(seed),
+        pools=load_pools(seed=seed),
+        id_seed=seed,
     )
+
+
+def write_mock_data_chunks(
+    customer_path: str,
+    loan_path: str,
+    customer_rows: int,
+    loan_rows: int,
+    chunk_size: int,
+    rng: np.random.Generator,
+    as_of: datetime | None = None,
+    pools: StringPools | None = None,
+    id_seed: int | None = None,
+    first_customer: int = 0,
+):
+    """
+    Write customers and loans drawn from rng to two Parquet files chunk by chunk
+    Args:
+        customer_path (str): Parquet file for the customers
+        loan_path (str): Parquet file for the loans
+        customer_rows (int): number of customers
+        loan_rows (int): number of loans, drawn against these customers only
+        chunk_size (int): number of rows generated and written at a time
+        rng (np.random.Generator): seeded random generator
+        as_of (datetime, optional): reference time for the dates, now if not set
+        pools (StringPools, optional): pools of the customer Faker columns
+        id_seed (int, optional): key of the customer id permutation of the
+            run, see customer_id_column; drawn from rng if not set
+        first_customer (int): position in the run of the first customer, so
+            the ids of runs split in shards do not overlap
+    """
+    if loan_rows and not customer_rows:
+        raise ValueError("loans need at least one customer")
+    as_of = as_of or datetime.now()
+    if id_seed is None:
+        id_seed = int(rng.integers(2**32))
+    customer_ids = np.empty(customer_rows, dtype=np.int64)
+    customer_income = np.empty(customer_rows, dtype=np.float64)
+
+    def customer_chunks():
+        for start in range(0, customer_rows, chunk_size):
+            stop = min(start + chunk_size, customer_rows)
+            chunk = generate_customer_data_columnar(
+                batch_size=stop - start,
+                rng=rng,
+                as_of=as_of,
+                pools=pools,
+                customer_ids=customer_id_column(
+                    id_seed, first_customer + start, stop - start
+                ),
+            )
+            customer_ids[start:stop] = chunk["customer_id"].to_numpy()
+            customer_income[start:stop] = chunk["income"].to_numpy()
+            yield chunk
+
+    def loan_chunks():
+        for start in range(0, loan_rows, chunk_size):
+            yield generate_loans_from_index(
+                batch_size=min(chunk_size, loan_rows - start),
+                customer_ids=customer_ids,
+                customer_income=customer_income,
+                rng=rng,
+                as_of=as_of,
+            )
+
+    write_parquet_chunks(customer_path, CUSTOMER_SCHEMA, customer_chunks())
+    write_parquet_chunks(loan_path, LOAN_SCHEMA, loan_chunks())
+
+
+@metrics.instrument()
+def generate_sharded_mock_data(
+    customer_rows: int,
+    loan_rows: int,
+    shards: int,
+    seed: int = 10,
+    chunk_size: int = 100_000,
+    as_of: date | None = None,
+    max_workers: int | None = None,
+):
+    """
+    Generate mock data for customer and loans tables on a process pool.
+    Shard i writes part-0000i.parquet under customers.parquet/ and
+    loans.parquet/; its loans only reference its own customers. Every shard
+    seeds random, NumPy and Faker from its own child of SeedSequence(seed),
+    so the output is bit-identical for a given (seed, shards, as_of)
+    whatever the number of workers. The string pools of seed are built before
+    the pool starts and every worker maps the same file. Customer ids are
+    distinct across shards, every shard taking its own range of positions in
+    the id permutation of seed.
+    Args:
+        customer_rows (int): total number of customers
+        loan_rows (int): total number of loans
+        shards (int): number of part files per table, at most customer_rows
+            so that every shard has customers to draw its loans against
+        seed (int): root seed
+        chunk_size (int): number of rows generated and written at a time
+        as_of (date, optional): reference date for the dates, today if not set
+        max_workers (int, optional): number of processes, one per CPU if not set
+    """
+    if loan_rows and not customer_rows:
+        raise ValueError("loans need at least one customer")
+    shards = max(1, min(shards, customer_rows))
+    as_of = datetime.combine(as_of or date.today(), datetime.min.time())
     home = os.environ["HOME"]
-    customer_df.to_parquet(f"{home}/work/data/customers.parquet")
-    loans_df.to_parquet(f"{home}/work/data/loans.parquet")
+    data_dir = f"{home}/work/data"
+    for table_name in ("customers", "loans"):
+        _reset_output(f"{data_dir}/{table_name}.parquet")
+        os.makedirs(f"{data_dir}/{table_name}.parquet")
+
+    pools = load_pools(seed=seed)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _generate_shard,
+                customer_path=f"{data_dir}/customers.parquet/part-{shard:05d}.parquet",
+                loan_path=f"{data_dir}/loans.parquet/part-{shard:05d}.parquet",
+                customer_rows=_shard_rows(customer_rows, shards, shard),
+                loan_rows=_shard_rows(loan_rows, shards, shard),
+                chunk_size=chunk_size,
+                seed_sequence=seed_sequence,
+                as_of=as_of,
+                pools=pools,
+                id_seed=seed,
+                first_customer=_shard_start(customer_rows, shards, shard),
+            )
+            for shard, seed_sequence in enumerate(
+                np.random.SeedSequence(seed).spawn(shards)
+            )
+        ]
+        for shard, future in enumerate(futures):
+            metrics.RECORDER.extend(future.result(), shard=shard)
+
+
+def _generate_shard(seed_sequence: np.random.SeedSequence, **kwargs) -> list[dict]:
+    """
+    Seed every random source of this process from seed_sequence and write one
+    shard, returning the stage metrics of the shard
+    """
+    metrics.RECORDER.reset()
+    shard_seed = int(seed_sequence.generate_state(1)[0])
+    random.seed(shard_seed)
+    np.random.seed(shard_seed)
+    fake.seed_instance(shard_seed)
+    write_mock_data_chunks(rng=np.random.default_rng(seed_sequence), **kwargs)
+    return metrics.RECORDER.stages()
+
+
+def _shard_rows(rows: int, shards: int, shard: int) -> int:
+    """
+    Number of rows of shard when rows are split as evenly as possible
+    """
+    return rows // shards + (shard < rows % shards)
+
+
+def _shard_start(rows: int, shards: int, shard: int) -> int:
+    """
+    Number of rows of the shards before shard, see _shard_rows
+    """
+    return shard * (rows // shards) + min(shard, rows % shards)
+
+
+def _reset_output(path: str):
+    """
+    Remove a previous Parquet file or part file directory at path
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+@metrics.instrument()
+def write_parquet_chunks(path: str, schema: pa.Schema, chunks) -> int:
+    """
+    Append DataFrame chunks as row groups of a single Parquet file
+    Args:
+        path (str): Parquet file to write
+        schema (pa.Schema): schema every chunk is converted to
+        chunks (Iterable[pd.DataFrame]): chunks to write
+
+    Returns:
+        int: number of rows written
+    """
+    writer = None
+    rows = 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                # the first chunk's schema carries the pandas metadata that
+                # restores the Int64 columns on read
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            rows += table.num_rows
+            metrics.record(rows=table.num_rows, bytes=table.nbytes)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """
+    Parse command line arguments
+    Args:
+        argv (list[str], optional): arguments, sys.argv[1:] if not set
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--mode",
+        choices=["rows", "columnar", "streaming", "sharded"],
+        default="rows",
+        help="row by row generation, vectorized columnar generation, "
+        "chunked columnar generation streamed to Parquet or the same on a "
+        "process pool with one part file per shard",
+    )
+    parser.add_argument("--seed", type=int, default=10)
+    parser.add_argument("--customers", type=int, help="number of customers")
+    parser.add_argument("--loans", type=int, help="number of loans")
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument("--shards", type=int, default=os.cpu_count())
+    parser.add_argument("--workers", type=int, help="number of processes")
+    parser.add_argument(
+        "--as-of",
+        type=date.fromisoformat,
+        help="reference date of the sharded data, today if not set",
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        default=os.environ.get("ETL_METRICS_DIR"),
+        help="write a JSON run report and a Prometheus textfile of the stages",
+    )
+    args = parser.parse_args(argv)
+    if args.mode == "sharded" and (args.customers is None or args.loans is None):
+        parser.error("--mode sharded requires --customers and --loans")
+    return args
+
+
+def main(
+    mode: str = "rows",
+    seed: int = 10,
+    customers: int | None = None,
+    loans: int | None = None,
+    chunk_size: int = 100_000,
+    shards: int | None = None,
+    workers: int | None = None,
+    as_of: date | None = None,
+    metrics_dir: str | None = None,
+):
+    """
+    Generate the mock data in one of the modes of parse_args
+    Args:
+        mode (str): "rows", "columnar", "streaming" or "sharded"
+        seed (int): random seed
+        customers (int, optional): number of customers, required when sharded
+        loans (int, optional): number of loans, required when sharded
+        chunk_size (int): rows generated at a time when streaming or sharded
+        shards (int, optional): part files of the sharded data, one per CPU
+            if not set
+        workers (int, optional): processes generating the shards
+        as_of (date, optional): reference date of the sharded data, today if
+            not set
+        metrics_dir (str, optional): directory the JSON run report and the
+            Prometheus textfile of the stage metrics are written to
+    """
+    if mode == "sharded":
+        generate_sharded_mock_data(
+            customer_rows=customers,
+            loan_rows=loans,
+            shards=shards or os.cpu_count(),
+            seed=seed,
+            chunk_size=chunk_size,
+            as_of=as_of,
+            max_workers=workers,
+        )
+    elif mode == "streaming":
+        stream_mock_data(
+            customer_rows=customers,
+            loan_rows=loans,
+            chunk_size=chunk_size,
+            seed=seed,
+        )
+    else:
+        generate_mock_data(columnar=mode == "columnar", seed=seed)
+    if metrics_dir:
+        metrics.RECORDER.export(metrics_dir, name="generate_mock_data")
 
 
 if __name__ == "__main__":
-    generate_mock_data()
+    main(**vars(parse_args()))
@@ -1,3 +1,4 @@
+import argparse
 import os
 import random
 from datetime import timedelta, datetime
@@ -54,10 +55,13 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
     loan_intent_weights = [10, 20, 15, 15, 5, 5, 10, 20]
     repayment_methods = ["Monthly", "Bi-weekly"]
 
+    customer_ids = customer_data["customer_id"].to_numpy()
+    customer_incomes = customer_data["income"].to_numpy()
+    customer_clusters = customer_data["cluster"].to_numpy()
+
     data = []
-    for _ in range(batch_size):
-        customer = customer_data.sample(1).iloc[0]
-        customer_income = customer["income"]
+    for position in np.random.randint(len(customer_data), size=batch_size):
+        customer_income = customer_incomes[position]
         interest_rate = round(random.uniform(2, 12), 2)
         start_date = fake.date_between(start_date="-2y", end_date="today")
         end_date = start_date + timedelta(days=random.randint(180, 1095))
@@ -70,7 +74,7 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
 
         loans_data = {
             "loan_id": fake.uuid4(),
-            "customer_id": customer["customer_id"],
+            "customer_id": customer_ids[position],
             "loan_amount": loan_amount,
             "interest_rate": interest_rate,
             "start_date": start_date,
@@ -83,7 +87,7 @@ def generate_loans_data(batch_size: int, customer_data: pd.DataFrame) -> pd.Data
             "repayment_method": repayment_method,
             "collateral_value": collateral_value,
             "loan_purpose": get_loan_purpose(loan_intent),
-            "cluster": customer["cluster"]
+            "cluster": customer_clusters[position]
         }
         data.append(loans_data)
     df = pd.DataFrame(data)
@@ -117,15 +121,29 @@ def get_loan_grade(credit_score: int) -> str:
     else:
         return random.choice(["D", "E", "F", "G"])
 
-def generate_mock_data():
+def generate_mock_data(save_labels: bool = False):
     random.seed(10)
+    np.random.seed(10)
+    fake.seed_instance(10)
     customer_df = generate_customer_data(batch_size=random.randint(1000, 2000), n_clusters=5)
     loans_df = generate_loans_data(batch_size=random.randint(3000, 5000), customer_data=customer_df)
     home = os.environ["HOME"]
+    if save_labels:
+        # ground truth of the customer segmentation stage
+        customer_df[["customer_id", "cluster"]].to_parquet(
+            f"{home}/work/data/customer_clusters.parquet"
+        )
     customer_df.drop("cluster", axis=1, inplace=True)
     loans_df.drop("cluster", axis=1, inplace=True)
     customer_df.to_parquet(f"{home}/work/data/customers.parquet")
     loans_df.to_parquet(f"{home}/work/data/loans.parquet")
 
 if __name__ == "__main__":
-    generate_mock_data()
+    parser = argparse.ArgumentParser(description="Generate clustered mock data")
+    parser.add_argument(
+        "--save-labels",
+        action="store_true",
+        help="write the cluster of every customer to customer_clusters.parquet",
+    )
+    args = parser.parse_args()
+    generate_mock_data(save_labels=args.save_labels)
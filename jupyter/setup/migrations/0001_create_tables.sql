@@ -1,4 +1,4 @@
-create table staging.public.customers (
+create table if not exists staging.public.customers (
   "customer_id" varchar,
   "name" varchar,
   "gender" varchar,
@@ -17,7 +17,7 @@ create table staging.public.customers (
   "education_level" varchar
 );
 
-create table staging.public.loans (
+create table if not exists staging.public.loans (
   "loan_id" uuid,
   "customer_id" varchar,
   "loan_amount" integer,
@@ -32,4 +32,4 @@ create table staging.public.loans (
   "repayment_method" varchar,
   "collateral_value" integer,
   "loan_purpose" varchar
-);
\ No newline at end of file
+);
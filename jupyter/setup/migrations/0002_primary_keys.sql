@@ -0,0 +1,27 @@
+-- rows loaded before the keys existed may repeat a key, keep one of each
+delete from staging.public.customers a
+using staging.public.customers b
+where a.customer_id = b.customer_id and a.ctid < b.ctid;
+delete from staging.public.customers where customer_id is null;
+
+delete from staging.public.loans a
+using staging.public.loans b
+where a.loan_id = b.loan_id and a.ctid < b.ctid;
+delete from staging.public.loans where loan_id is null;
+
+do $$
+begin
+  if not exists (
+    select 1 from pg_constraint
+    where conrelid = 'staging.public.customers'::regclass and contype = 'p'
+  ) then
+    alter table staging.public.customers add primary key (customer_id);
+  end if;
+  if not exists (
+    select 1 from pg_constraint
+    where conrelid = 'staging.public.loans'::regclass and contype = 'p'
+  ) then
+    alter table staging.public.loans add primary key (loan_id);
+  end if;
+end
+$$;
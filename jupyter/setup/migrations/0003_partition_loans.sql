@@ -0,0 +1,58 @@
+-- loans becomes range partitioned on start_date. Monthly partitions are
+-- created by run_ddl.py; rows outside of them, and rows without a
+-- start_date, land in loans_default. A unique constraint on a partitioned
+-- table has to include the partition key, and start_date can be NULL, so
+-- loan_id is unique together with start_date, NULLs not distinct.
+do $$
+begin
+  if exists (
+    select 1 from pg_partitioned_table
+    where partrelid = to_regclass('staging.public.loans')
+  ) then
+    return;
+  end if;
+
+  if to_regclass('staging.public.loans') is not null then
+    alter table staging.public.loans rename to loans_unpartitioned;
+    alter index if exists staging.public.loans_pkey
+      rename to loans_unpartitioned_pkey;
+    alter index if exists staging.public.loans_customer_id_idx
+      rename to loans_unpartitioned_customer_id_idx;
+  end if;
+
+  create table staging.public.loans (
+    "loan_id" uuid not null,
+    "customer_id" varchar,
+    "loan_amount" integer,
+    "interest_rate" float,
+    "start_date" date,
+    "end_date" date,
+    "status" varchar,
+    "loan_intent" varchar,
+    "credit_score" integer,
+    "loan_term" integer,
+    "loan_grade" varchar,
+    "repayment_method" varchar,
+    "collateral_value" integer,
+    "loan_purpose" varchar,
+    constraint loans_loan_id_start_date_key
+      unique nulls not distinct (loan_id, start_date)
+  ) partition by range (start_date);
+
+  create table staging.public.loans_default
+    partition of staging.public.loans default;
+
+  if to_regclass('staging.public.loans_unpartitioned') is not null then
+    insert into staging.public.loans
+    select * from staging.public.loans_unpartitioned;
+    drop table staging.public.loans_unpartitioned;
+  end if;
+end
+$$;
+
+create index if not exists loans_customer_id_idx
+  on staging.public.loans (customer_id);
+create index if not exists loans_start_date_brin
+  on staging.public.loans using brin (start_date);
+create index if not exists loans_end_date_brin
+  on staging.public.loans using brin (end_date);
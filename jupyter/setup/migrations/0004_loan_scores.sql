@@ -0,0 +1,7 @@
+-- nightly credit-risk scores of the loans, upserted by ETL/scoring.py
+create table if not exists staging.public.loan_scores (
+  "loan_id" uuid primary key,
+  "score" double precision,
+  "model_version" varchar,
+  "scored_at" timestamp
+);
@@ -0,0 +1,67 @@
+-- loan_id is unique on its own again. The unique constraint of the
+-- partitioned loans table has to include start_date, so the loan_ids lookup
+-- table claims every loan_id for one start_date, and a row trigger on loans
+-- rejects a loan_id claimed for another start_date while a loan still holds
+-- that claim. Claims are not removed when loans are deleted or partitions
+-- truncated; a stale claim is taken over by the next row that needs it.
+
+-- rows loaded while only (loan_id, start_date) was unique may repeat a
+-- loan_id, keep the one with the latest start_date
+delete from staging.public.loans l
+using (
+  select tableoid, ctid, row_number() over (
+    partition by loan_id order by start_date desc nulls last
+  ) as n
+  from staging.public.loans
+) d
+where l.tableoid = d.tableoid and l.ctid = d.ctid and d.n > 1;
+
+create table if not exists staging.public.loan_ids (
+  "loan_id" uuid primary key,
+  "start_date" date
+);
+
+insert into staging.public.loan_ids (loan_id, start_date)
+select loan_id, start_date from staging.public.loans
+on conflict (loan_id) do nothing;
+
+create or replace function staging.public.loans_claim_loan_id()
+returns trigger
+language plpgsql
+as $$
+declare
+  claimed date;
+begin
+  insert into staging.public.loan_ids (loan_id, start_date)
+  values (new.loan_id, new.start_date)
+  on conflict (loan_id) do nothing;
+  if found then
+    return null;
+  end if;
+  select start_date into claimed
+  from staging.public.loan_ids
+  where loan_id = new.loan_id
+  for update;
+  if claimed is not distinct from new.start_date then
+    return null;
+  end if;
+  if exists (
+    select 1 from staging.public.loans
+    where loan_id = new.loan_id
+      and (start_date = claimed or (claimed is null and start_date is null))
+  ) then
+    raise exception 'loan_id % already exists with start_date %',
+      new.loan_id, coalesce(claimed::text, 'NULL')
+      using errcode = 'unique_violation';
+  end if;
+  update staging.public.loan_ids
+  set start_date = new.start_date
+  where loan_id = new.loan_id;
+  return null;
+end
+$$;
+
+drop trigger if exists loans_claim_loan_id on staging.public.loans;
+create trigger loans_claim_loan_id
+  after insert or update of loan_id, start_date on staging.public.loans
+  for each row execute function staging.public.loans_claim_loan_id();
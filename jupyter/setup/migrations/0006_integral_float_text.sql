@@ -0,0 +1,6 @@
+-- float columns loaded into varchar columns are rendered without a
+-- fractional part when integral ("1", not "1.0") on every load path; rows
+-- loaded earlier through the pandas CSV path still read "1.0"
+update staging.public.loans
+set status = left(status, -2)
+where status ~ '^-?[0-9]+\.0$';
@@ -1,40 +1,328 @@
 """
-This script is used to run the DDL.sql file to create the tables in the PostgreSQL database.
+This script manages the schema of the PostgreSQL database. It applies the
+versioned migrations of the migrations directory that were not applied yet,
+recording them in the schema_migrations table, and creates the monthly
+partitions of the loans table.
 """
 
+import argparse
+import hashlib
+import logging
 import os
+from datetime import date
+
 import psycopg2
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2 import sql
+from psycopg2.extensions import connection
+
+# the connection configuration is shared with the ETL pipeline, ETL/ is put on
+# the import path by the entry point (PYTHONPATH of the container,
+# orchestrate.py)
+from config import create_postgress_config
+
+MIGRATIONS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "migrations"
+)
+# key of the advisory lock serializing concurrent schema managers
+LOCK_ID = 0x5C4E3A
+# the migrations use UNIQUE NULLS NOT DISTINCT, new in PostgreSQL 15
+MIN_SERVER_VERSION = 150000
+# range partitioned tables and the number of months before and after the
+# current one they get a partition for
+MONTHLY_PARTITIONS = {"staging.public.loans": (36, 3)}
+
 
-def main():
+def main(
+    months_back: int | None = None,
+    months_ahead: int | None = None,
+    postgress_config: dict | None = None,
+):
     """
-    Run the DDL.sql file to create the tables in the PostgreSQL database
+    Apply the pending migrations and create the monthly partitions
+    Args:
+        months_back (int, optional): months before the current one to create
+            partitions for, the MONTHLY_PARTITIONS default if not set
+        months_ahead (int, optional): months after the current one to create
+            partitions for, the MONTHLY_PARTITIONS default if not set
+        postgress_config (dict, optional): postgres connection configuration,
+            read from the environment if not set
     """
-    # Connect to PostgreSQL
-    home = os.environ["HOME"]
-    sql_dir = f"{home}/work/setup"
-    postgress_config = {
-        "database": os.environ["POSTGRES_DATABASE"],
-        "user": os.environ["POSTGRES_USER"],
-        "password": os.environ["POSTGRES_PASSWORD"],
-        "host": os.environ["POSTGRES_HOST"],
-        "port": os.environ["POSTGRES_PORT"],
-    }
+    postgress_config = postgress_config or create_postgress_config()
 
-    # Create a cursor object
     conn = psycopg2.connect(**postgress_config)
-    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-    cur = conn.cursor()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+        conn.commit()
+        apply_migrations(conn)
+        for table_name, (back, ahead) in MONTHLY_PARTITIONS.items():
+            ensure_monthly_partitions(
+                conn,
+                table_name,
+                first_month=_add_months(
+                    date.today(), -(back if months_back is None else months_back)
+                ),
+                last_month=_add_months(
+                    date.today(), ahead if months_ahead is None else months_ahead
+                ),
+            )
+    finally:
+        conn.close()
+
+
+def apply_migrations(
+    conn: connection, migrations_dir: str = MIGRATIONS_DIR
+) -> list[str]:
+    """
+    Apply the migrations named <version>_<name>.sql that are not recorded in
+    schema_migrations yet, in version order, each in its own transaction
+    together with its record. Servers older than MIN_SERVER_VERSION are
+    refused with a RuntimeError before anything is applied.
+    Args:
+        conn (connection): psycopg2 connection
+        migrations_dir (str): directory of the migration files
+
+    Returns:
+        list[str]: applied migration file names
+    """
+    if conn.server_version < MIN_SERVER_VERSION:
+        raise RuntimeError(
+            f"The migrations need PostgreSQL {MIN_SERVER_VERSION // 10000} or "
+            f"later, the server runs {conn.server_version}"
+        )
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version integer PRIMARY KEY,
+                name varchar NOT NULL,
+                checksum varchar NOT NULL,
+                applied_at timestamp NOT NULL DEFAULT now()
+            )"""
+        )
+        cur.execute("SELECT version, name, checksum FROM schema_migrations")
+        applied = {version: (name, checksum) for version, name, checksum in cur}
+    conn.commit()
+
+    done = []
+    for version, name, path in list_migrations(migrations_dir):
+        with open(path, "r", encoding="UTF-8") as f:
+            sql_queries = f.read()
+        checksum = hashlib.sha256(sql_queries.encode()).hexdigest()
+        if version in applied:
+            if applied[version][1] != checksum:
+                logging.warning(
+                    "Migration %s changed after it was applied, it is not rerun",
+                    os.path.basename(path),
+                )
+            continue
+        try:
+            with conn.cursor() as cur:
+                cur.execute(sql_queries)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, checksum) "
+                    "VALUES (%s, %s, %s)",
+                    (version, name, checksum),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error("Migration %s failed", os.path.basename(path))
+            raise
+        logging.info("Applied migration %s", os.path.basename(path))
+        done.append(os.path.basename(path))
+    return done
+
+
+def list_migrations(
+    migrations_dir: str = MIGRATIONS_DIR,
+) -> list[tuple[int, str, str]]:
+    """
+    List the migration files of a directory
+    Args:
+        migrations_dir (str): directory of the migration files
+
+    Returns:
+        list[tuple[int, str, str]]: version, name and path of every migration,
+            in version order
+    """
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        stem, extension = os.path.splitext(file_name)
+        version, _, name = stem.partition("_")
+        if extension != ".sql" or not version.isdigit():
+            continue
+        path = os.path.join(migrations_dir, file_name)
+        migrations.append((int(version), name, path))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {migrations_dir}")
+    return migrations
 
-    with open(f"{sql_dir}/DDL.sql", "r", encoding="UTF-8") as f:
-        sql_queries = f.read()
 
-    cur.execute(sql_queries)
+def ensure_monthly_partitions(
+    conn: connection, table_name: str, first_month: date, last_month: date
+) -> list[str]:
+    """
+    Create the missing monthly partitions of a range partitioned table.
+    Rows of a new month that already sit in the default partition are moved
+    to the new partition.
+    Args:
+        conn (connection): psycopg2 connection
+        table_name (str): partitioned table, optionally schema qualified
+        first_month (date): any day of the first month
+        last_month (date): any day of the last month
+
+    Returns:
+        list[str]: names of the created partitions
+    """
+    schema, _, base_name = table_name.rpartition(".")
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass""",
+            (table_name,),
+        )
+        existing = dict(cur.fetchall())
+        cur.execute("SELECT pg_get_partkeydef(%s::regclass)", (table_name,))
+        key = cur.fetchone()[0]
+    if key is None or not key.startswith("RANGE ("):
+        raise ValueError(f"{table_name} is not range partitioned")
+    column = key[len("RANGE (") : -1]
+    default = next(
+        (name for name, bound in existing.items() if bound == "DEFAULT"), None
+    )
+
+    created = []
+    month = first_month.replace(day=1)
+    while month <= last_month:
+        name = f"{base_name}_p{month:%Y%m}"
+        if name not in existing:
+            _create_range_partition(
+                conn,
+                table_name=table_name,
+                partition=sql.Identifier(*schema.split("."), name)
+                if schema
+                else sql.Identifier(name),
+                column=column,
+                lower=month,
+                upper=_add_months(month, 1),
+                default=default,
+                schema=schema,
+            )
+            created.append(name)
+        month = _add_months(month, 1)
+    if created:
+        logging.info(
+            "Created %d monthly partitions of %s, %s to %s",
+            len(created),
+            table_name,
+            created[0],
+            created[-1],
+        )
+    return created
+
+
+def _create_range_partition(
+    conn: connection,
+    table_name: str,
+    partition: sql.Identifier,
+    column: str,
+    lower: date,
+    upper: date,
+    default: str | None,
+    schema: str,
+):
+    """
+    Create one partition for [lower, upper), moving its rows out of the
+    default partition first if it holds any, in a single transaction
+    """
+    table = sql.Identifier(*table_name.split("."))
+    bounds = sql.SQL("FOR VALUES FROM ({}) TO ({})").format(
+        sql.Literal(lower), sql.Literal(upper)
+    )
+    in_range = sql.SQL("{column} >= {lower} AND {column} < {upper}").format(
+        column=sql.Identifier(column),
+        lower=sql.Literal(lower),
+        upper=sql.Literal(upper),
+    )
+    try:
+        with conn.cursor() as cur:
+            default_table = None
+            if default is not None:
+                default_table = (
+                    sql.Identifier(*schema.split("."), default)
+                    if schema
+                    else sql.Identifier(default)
+                )
+                cur.execute(
+                    sql.SQL("SELECT EXISTS (SELECT 1 FROM {} WHERE {})").format(
+                        default_table, in_range
+                    )
+                )
+            if default_table is not None and cur.fetchone()[0]:
+                # creating the partition would violate the constraint of the
+                # default partition, so the rows move into a detached table
+                # that is attached once filled
+                cur.execute(
+                    sql.SQL(
+                        "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING "
+                        "CONSTRAINTS)"
+                    ).format(partition, table)
+                )
+                cur.execute(
+                    sql.SQL(
+                        "WITH moved AS (DELETE FROM {} WHERE {} RETURNING *) "
+                        "INSERT INTO {} SELECT * FROM moved"
+                    ).format(default_table, in_range, partition)
+                )
+                cur.execute(
+                    sql.SQL("ALTER TABLE {} ATTACH PARTITION {} {}").format(
+                        table, partition, bounds
+                    )
+                )
+            else:
+                cur.execute(
+                    sql.SQL("CREATE TABLE {} PARTITION OF {} {}").format(
+                        partition, table, bounds
+                    )
+                )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
-    # Close the cursor and connection
-    cur.close()
-    conn.close()
+
+def _add_months(day: date, months: int) -> date:
+    """
+    First day of the month months after the month of day
+    """
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def parse_args() -> argparse.Namespace:
+    """
+    Parse command line arguments
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--months-back",
+        type=int,
+        help="months before the current one that get a partition",
+    )
+    parser.add_argument(
+        "--months-ahead",
+        type=int,
+        help="months after the current one that get a partition",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    main(months_back=args.months_back, months_ahead=args.months_ahead)
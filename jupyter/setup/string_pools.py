@@ -0,0 +1,212 @@
+"""
+Precomputed pools of Faker values the columnar generators sample from instead
+of calling Faker for every row. The pools of a locale and seed are built once,
+stored as an Arrow IPC file and memory-mapped by every run and worker process.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+from pyarrow import compute as pc
+from faker import Faker
+
+# Faker calls drawn to fill every pool, before deduplication
+POOL_DRAWS = {
+    "first_name": 5_000,
+    "last_name": 5_000,
+    "street_address": 50_000,
+    "city": 20_000,
+    "country": 2_000,
+    "phone_number": 50_000,
+    "free_email_domain": 200,
+}
+POOL_DIR = os.environ.get(
+    "STRING_POOL_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mock_data", "string_pools"),
+)
+EMAIL_SEPARATORS = ["", ".", "_"]
+
+# pools mapped by this process, by file path
+_LOADED: dict[str, "StringPools"] = {}
+
+
+class StringPools:
+    """
+    Deduplicated Faker values of one locale and seed, memory-mapped from an
+    Arrow IPC file with one record batch per pool. Sampled columns are taken
+    from the mapped pools, and pickling only carries the file path, so
+    worker processes map the same file instead of receiving copies.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): pool file written by write_pools
+        """
+        self.path = path
+        reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+        names = json.loads(reader.schema.metadata[b"pools"])
+        self.pools = {
+            name: reader.get_batch(i).column(0) for i, name in enumerate(names)
+        }
+
+    def __reduce__(self):
+        return load_file, (self.path,)
+
+    def sample(self, name: str, rng: np.random.Generator, size: int) -> pa.Array:
+        """
+        Draw values of a pool uniformly, with replacement
+        Args:
+            name (str): pool name, a key of POOL_DRAWS
+            rng (np.random.Generator): random generator
+            size (int): number of values
+
+        Returns:
+            pa.Array: sampled values
+        """
+        pool = self.pools[name]
+        return pool.take(pa.array(rng.integers(0, len(pool), size=size)))
+
+    def names_and_emails(
+        self, rng: np.random.Generator, size: int
+    ) -> tuple[pa.Array, pa.Array]:
+        """
+        Draw full names and emails derived from them, like
+        "jane.doe42@example.org"
+        Args:
+            rng (np.random.Generator): random generator
+            size (int): number of names
+
+        Returns:
+            tuple[pa.Array, pa.Array]: names and emails
+        """
+        first = self.sample("first_name", rng, size)
+        last = self.sample("last_name", rng, size)
+        names = pc.binary_join_element_wise(first, last, " ")
+        separators = pa.array(EMAIL_SEPARATORS).take(
+            pa.array(rng.integers(0, len(EMAIL_SEPARATORS), size=size))
+        )
+        numbers = rng.integers(0, 100, size=size)
+        suffixes = pc.if_else(
+            pa.array(rng.random(size) < 0.5),
+            pc.cast(pa.array(numbers), pa.string()),
+            "",
+        )
+        emails = pc.binary_join_element_wise(
+            _email_part(first),
+            separators,
+            _email_part(last),
+            suffixes,
+            "@",
+            self.sample("free_email_domain", rng, size),
+            "",
+        )
+        return names, emails
+
+
+def load_pools(
+    locale: str = "en_US", seed: int = 0, directory: str | None = None
+) -> StringPools:
+    """
+    Map the pools of a locale and seed, building and storing them first if
+    no run did yet
+    Args:
+        locale (str): Faker locale
+        seed (int): seed of the Faker instance the pools are drawn from
+        directory (str, optional): pool file directory, POOL_DIR if not set
+
+    Returns:
+        StringPools: mapped pools
+    """
+    path = pool_path(locale, seed, directory)
+    if path not in _LOADED and not os.path.exists(path):
+        write_pools(build_pools(locale, seed), path)
+    return load_file(path)
+
+
+def load_file(path: str) -> StringPools:
+    """
+    Map a pool file, once per process
+    Args:
+        path (str): pool file written by write_pools
+
+    Returns:
+        StringPools: mapped pools
+    """
+    if path not in _LOADED:
+        _LOADED[path] = StringPools(path)
+    return _LOADED[path]
+
+
+def pool_path(locale: str, seed: int, directory: str | None = None) -> str:
+    """
+    Pool file of a locale and seed. The name includes a digest of POOL_DRAWS,
+    so files built with other pool sizes are not reused.
+    Args:
+        locale (str): Faker locale
+        seed (int): seed of the Faker instance
+        directory (str, optional): pool file directory, POOL_DIR if not set
+
+    Returns:
+        str: path of the pool file
+    """
+    digest = hashlib.sha256(json.dumps(POOL_DRAWS, sort_keys=True).encode())
+    return os.path.join(
+        directory or POOL_DIR, f"{locale}-{seed}-{digest.hexdigest()[:8]}.arrow"
+    )
+
+
+def build_pools(locale: str, seed: int) -> dict[str, pa.Array]:
+    """
+    Draw every pool from a seeded Faker instance
+    Args:
+        locale (str): Faker locale
+        seed (int): seed of the Faker instance
+
+    Returns:
+        dict[str, pa.Array]: pool name to distinct values, in order of first
+            draw
+    """
+    faker = Faker(locale)
+    faker.seed_instance(seed)
+    pools = {}
+    for name, draws in POOL_DRAWS.items():
+        provider = getattr(faker, name)
+        pools[name] = pc.unique(pa.array([provider() for _ in range(draws)]))
+    return pools
+
+
+def write_pools(pools: dict[str, pa.Array], path: str):
+    """
+    Store pools as an Arrow IPC file with one record batch per pool. The
+    file is written next to path and renamed over it, so concurrent builds
+    never expose a partial file.
+    Args:
+        pools (dict[str, pa.Array]): pool name to values
+        path (str): pool file to write
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    schema = pa.schema(
+        [("value", pa.string())], metadata={"pools": json.dumps(list(pools))}
+    )
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, schema) as writer:
+            for values in pools.values():
+                writer.write_batch(pa.record_batch([values], schema=schema))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _email_part(values: pa.Array) -> pa.Array:
+    """
+    Lower case ASCII letters and digits of a name, e.g. "Müller" -> "muller"
+    """
+    ascii_ = pc.utf8_normalize(values, form="NFKD")
+    return pc.replace_substring_regex(pc.utf8_lower(ascii_), r"[^a-z0-9]", "")